@@ -0,0 +1,5 @@
+import sys
+
+from financelama.cli import main
+
+sys.exit(main())
@@ -0,0 +1,364 @@
+"""
+Analytics of evaluated transactions: recurring payments, rolling spend per category, running
+balance per account and month-over-month anomalies.
+
+All views are computed with grouped operations on sorted datetime indexes. Rolling spend and
+running balance are derived from a daily cube (sums per day, category, account and sign), so
+windows are differences of cumulative sums. analytics() caches all views for the current change
+version of the database and only re-reads changed months after a change.
+"""
+import numpy as np
+import pandas as pd
+
+from financelama.config import analytics_windows, anomaly_min_change, anomaly_min_months, \
+    anomaly_threshold, anomaly_window, recurring_amount_decimals, recurring_min_count, \
+    recurring_periods, recurring_regularity, recurring_tolerance
+from financelama.core import Financelama, is_missing, value_in_euros
+from financelama.evaluation import _in_months, evaluate, frame_to_cube, monthly_cube
+from financelama.instrumentation import stage
+from financelama.orderers import normalize_orderer
+
+# Dimensions of daily cube, see daily_cube()
+daily_dimensions = ['day', 'category', 'account', 'sign']
+
+# Average days per month, used for the monthly amount of recurring payments
+_days_per_month = 30.44
+
+
+def daily_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates evaluated transactions per day, category, account and sign (income or expense).
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Evaluated dataframe in standard or compact representation
+
+    Returns
+    -------
+    pandas.DataFrame with value and count indexed by sorted daily_dimensions
+    """
+    value = value_in_euros(df).astype('float64')
+
+    return pd.DataFrame({
+        'day': df['day'].dt.normalize(),
+        'category': df['category'].astype(object).fillna('None'),
+        'account': df['account'].astype(object).fillna('None'),
+        'sign': np.where(value < 0, 'expense', 'income'),
+        'value': value,
+        'count': 1,
+    }).groupby(daily_dimensions, sort=True)[['value', 'count']].sum()
+
+
+def _daily_pivot(daily: pd.DataFrame, level: str, sign: str = None) -> pd.DataFrame:
+    """ Values of daily cube per day (without gaps) and given level, optionally of one sign. """
+    if sign is not None:
+        daily = daily[daily.index.get_level_values('sign') == sign]
+
+    pivot = daily.groupby(level=['day', level])['value'].sum().unstack(level, fill_value=0)
+    if len(pivot) > 0:
+        pivot = pivot.reindex(pd.date_range(pivot.index.min(), pivot.index.max(), freq='D'),
+                              fill_value=0)
+
+    return pivot
+
+
+def rolling_spend(daily: pd.DataFrame, windows: list = None) -> pd.DataFrame:
+    """
+    Expenses per category within trailing windows of days.
+
+    Parameters
+    ----------
+    daily: pd.Dataframe
+        Daily cube, see daily_cube()
+    windows: list of int, optional
+        Window lengths in days (including the current day). Default: analytics_windows from
+        config
+
+    Returns
+    -------
+    Dict with pandas.DataFrame for each window, indexed by day with one column per category
+    (no columns without expenses), expenses are positive
+    """
+    windows = analytics_windows if windows is None else windows
+
+    # Sum of a window is the difference of cumulative sums of its last day and the day before
+    cumulative = (-_daily_pivot(daily, 'category', 'expense')).cumsum()
+
+    return {w: (cumulative - cumulative.shift(w, fill_value=0)).round(2) for w in windows}
+
+
+def running_balance(daily: pd.DataFrame) -> pd.DataFrame:
+    """
+    Balance of each account at the end of each day, relative to the balance before its first
+    transaction (the absolute balance isn't contained in the exports).
+
+    Parameters
+    ----------
+    daily: pd.Dataframe
+        Daily cube, see daily_cube()
+
+    Returns
+    -------
+    pandas.DataFrame indexed by day with one column per account
+    """
+    return _daily_pivot(daily, 'account').cumsum().round(2)
+
+
+def monthly_anomalies(cube: pd.DataFrame, window: int = None, threshold: float = None,
+                      min_months: int = None, min_change: float = None) -> pd.DataFrame:
+    """
+    Compares expenses of each month and category with the previous months.
+
+    Parameters
+    ----------
+    cube: pd.Dataframe
+        Monthly aggregate cube, see evaluation.monthly_cube()
+    window, threshold, min_months, min_change: optional
+        Number of previous months, minimum deviation in standard deviations, minimum number of
+        previous months and minimum deviation in EUR. Default: anomaly_* from config
+
+    Returns
+    -------
+    pandas.DataFrame indexed by month and category with expense, expected (mean of previous
+    months), deviation, zscore and boolean column anomaly. Only months with enough previous
+    months are contained.
+    """
+    window = anomaly_window if window is None else window
+    threshold = anomaly_threshold if threshold is None else threshold
+    min_months = anomaly_min_months if min_months is None else min_months
+    min_change = anomaly_min_change if min_change is None else min_change
+
+    expenses = cube[cube.index.get_level_values('sign') == 'expense']
+    expenses = expenses.groupby(level=['month', 'category'])['value'].sum().abs()
+    expenses = expenses.unstack('category', fill_value=0)
+    if len(expenses) > 0:
+        expenses = expenses.reindex(pd.date_range(expenses.index.min(), expenses.index.max(),
+                                                  freq='M'), fill_value=0)
+    expenses = expenses.rename_axis(index='month', columns='category')
+
+    history = expenses.shift(1).rolling(window, min_periods=min_months)
+    expected = history.mean()
+    deviation = expenses - expected
+
+    # Constant history (e.g. rent) has no deviation, so any change is an outlier
+    with np.errstate(divide='ignore', invalid='ignore'):
+        zscore = deviation / history.std()
+
+    result = pd.DataFrame({
+        'expense': expenses.stack(),
+        'expected': expected.stack(dropna=False),
+        'deviation': deviation.stack(dropna=False),
+        'zscore': zscore.stack(dropna=False),
+    }).dropna(subset=['expected'])
+    result['anomaly'] = (result['zscore'].abs() >= threshold) & \
+        (result['deviation'].abs() >= min_change)
+
+    return result.sort_index()
+
+
+def _prepare_recurring(df: pd.DataFrame) -> pd.DataFrame:
+    """ Transactions with series key (normalized orderer and rounded amount), reports and
+    transactions without orderer are left out.
+    """
+    df = df[is_missing(df['report'])]
+    value = value_in_euros(df).astype('float64')
+
+    # Orderers repeat a lot, so that each distinct orderer is normalized once
+    codes, distinct = pd.factorize(df['orderer'].astype(object).mask(is_missing(df['orderer'])))
+    normalized = np.append(normalize_orderer(pd.Series(distinct, dtype=object)).values, '')
+
+    prepared = pd.DataFrame({
+        'key': normalized[codes],
+        'amount': value.round(recurring_amount_decimals),
+        'day': df['day'].dt.normalize(),
+        'orderer': df['orderer'].astype(object),
+        'account': df['account'].astype(object).fillna('None'),
+        'category': df['category'].astype(object).fillna('None'),
+        'value': value,
+    })
+
+    return prepared[prepared['key'] != '']
+
+
+def _most_frequent(groups: pd.Series, values: pd.Series) -> pd.Series:
+    """ Most frequent value per group (ties by last occurrence). """
+    counts = pd.DataFrame({'group': groups.values, 'value': values.values})
+    counts = counts.groupby(['group', 'value'], sort=False).size().reset_index(name='n')
+    counts = counts.sort_values(['group', 'n'], kind='stable').drop_duplicates('group', keep='last')
+
+    return counts.set_index('group')['value']
+
+
+def _recurring_series(prepared: pd.DataFrame) -> pd.DataFrame:
+    """ Interval statistics of all series (same key and amount) of prepared transactions. """
+    prepared = prepared.sort_values(['key', 'amount', 'day'], kind='stable', ignore_index=True)
+    group = prepared.groupby(['key', 'amount'], sort=False).ngroup()
+
+    # Intervals between consecutive transactions of the same series
+    days = prepared['day'].values.astype('datetime64[D]').astype('int64')
+    interval = pd.Series(np.diff(days, prepend=days[:1]), dtype='float64')
+    interval[group != group.shift()] = np.nan
+    median = interval.groupby(group).transform('median')
+    regular = (interval - median).abs() <= recurring_tolerance * median
+
+    by_group = prepared.groupby(group)
+    count = by_group.size()
+    series = pd.DataFrame({
+        'key': by_group['key'].first(),
+        'amount': by_group['amount'].first(),
+        'value': by_group['value'].median(),
+        'count': count,
+        'first': by_group['day'].first(),
+        'last': by_group['day'].last(),
+        'interval_days': interval.groupby(group).median(),
+        'regularity': regular.groupby(group).sum() / (count - 1).where(count > 1),
+        'orderer': by_group['orderer'].last(),
+        'account': _most_frequent(group, prepared['account']),
+        'category': _most_frequent(group, prepared['category']),
+    })
+
+    return series.set_index(['key', 'amount'])
+
+
+def _select_recurring(series: pd.DataFrame, reference_day) -> pd.DataFrame:
+    """ Recurring payments of series statistics, see recurring_payments(). """
+    series = series[(series['count'] >= recurring_min_count) &
+                    (series['regularity'] >= recurring_regularity)]
+
+    # Nearest named period within tolerance
+    periods = np.array(list(recurring_periods.values()), dtype='float64')
+    distance = np.abs(series['interval_days'].values[:, None] - periods[None, :]) / periods
+    nearest = distance.argmin(axis=1) if len(series) > 0 else np.array([], dtype=int)
+    matched = distance[np.arange(len(series)), nearest] <= recurring_tolerance
+
+    result = series[matched].copy()
+    result['period'] = np.array(list(recurring_periods), dtype=object)[nearest[matched]]
+    result['monthly_value'] = (result['value'] * _days_per_month /
+                               result['interval_days']).round(2)
+    result['next_expected'] = result['last'] + pd.to_timedelta(result['interval_days'], 'D')
+    result['active'] = result['next_expected'] + pd.to_timedelta(
+        recurring_tolerance * result['interval_days'], 'D') >= pd.Timestamp(reference_day)
+
+    columns = ['orderer', 'value', 'period', 'interval_days', 'count', 'first', 'last',
+               'next_expected', 'active', 'monthly_value', 'account', 'category']
+
+    return result.reset_index()[['key'] + columns].sort_values(
+        ['active', 'monthly_value'], ascending=[False, True], kind='stable', ignore_index=True)
+
+
+def recurring_payments(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Detects recurring payments (e.g. subscriptions and rent) in evaluated transactions.
+
+    Transactions of the same normalized orderer (see orderers.normalize_orderer) and equal
+    rounded amount form a series. A series is recurring if its intervals match one of the
+    recurring_periods (see config).
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Evaluated dataframe in standard or compact representation
+
+    Returns
+    -------
+    pandas.DataFrame with one row per recurring series: key (normalized orderer), orderer (of
+    last transaction), value (median), period, interval_days (median), count, first, last,
+    next_expected (day), active (next transaction still expected), monthly_value, account and
+    category (most frequent). Active series come first, sorted by monthly_value.
+    """
+    return _select_recurring(_recurring_series(_prepare_recurring(df)), df['day'].max())
+
+
+def _views(daily: pd.DataFrame, series: pd.DataFrame, cube: pd.DataFrame, reference_day) -> dict:
+    return {
+        'daily': daily,
+        'rolling': rolling_spend(daily),
+        'balance': running_balance(daily),
+        'recurring': _select_recurring(series, reference_day),
+        'anomalies': monthly_anomalies(cube),
+    }
+
+
+def frame_analytics(df: pd.DataFrame) -> dict:
+    """
+    All analytics views of evaluated dataframe, see analytics(). Used if no database is
+    available.
+    """
+    return _views(daily_cube(df), _recurring_series(_prepare_recurring(df)), frame_to_cube(df),
+                  df['day'].max())
+
+
+def analytics(lama: Financelama) -> dict:
+    """
+    All analytics views of evaluated transactions (see evaluation.evaluate).
+
+    Views are cached for the current change version. After a change, only transactions of
+    changed months are aggregated again and only series of orderers with transactions in
+    changed months are recomputed. Reports are aggregated like in evaluate() and always
+    re-read, since adding transactions may change their day.
+
+    Parameters
+    ----------
+    lama: Financelama
+        Reference to Financelama object which manages database connection.
+
+    Returns
+    -------
+    Dict of views
+        'daily': daily cube (see daily_cube),
+        'rolling': rolling spend per category (see rolling_spend),
+        'balance': running balance per account (see running_balance),
+        'recurring': recurring payments (see recurring_payments),
+        'anomalies': month-over-month anomalies (see monthly_anomalies)
+    """
+    version = lama.version()
+    cached = lama.cache.get('analytics')
+
+    if cached is None or cached['version'] != version:
+        with stage('analytics') as record:
+            df = evaluate(lama, compact=True)
+            reported = ~is_missing(df['report'])
+            transactions = df[~reported]
+            record['rows'] = transactions.shape[0]
+
+            if cached is None:
+                daily = daily_cube(transactions)
+                prepared = _prepare_recurring(transactions)
+                series = _recurring_series(prepared)
+            else:
+                months = sorted(lama.changes_since(cached['version'])[0])
+                changed = _in_months(transactions['day'], months)
+
+                previous = cached['daily']
+                unchanged = ~_in_months(previous.index.get_level_values('day'), months)
+                daily = pd.concat([previous[unchanged],
+                                   daily_cube(transactions[changed])]).sort_index()
+
+                # Series with transactions in changed months before or after the change
+                previous = cached['prepared']
+                outdated = _in_months(previous['day'], months)
+                new = _prepare_recurring(transactions[changed])
+                prepared = pd.concat([previous[~outdated], new], ignore_index=True)
+                touched = pd.MultiIndex.from_frame(
+                    pd.concat([previous.loc[outdated, ['key', 'amount']],
+                               new[['key', 'amount']]]))
+                in_touched = pd.MultiIndex.from_frame(prepared[['key', 'amount']]).isin(touched)
+
+                series = cached['series']
+                series = pd.concat([series[~series.index.isin(touched)],
+                                    _recurring_series(prepared[in_touched])])
+
+            # Aggregated reports are added to the daily cube only
+            views = _views(pd.concat([daily, daily_cube(df[reported])]).groupby(
+                level=daily_dimensions, sort=True).sum(), series, monthly_cube(lama),
+                df['day'].max())
+
+        cached = {'version': version,
+                  'daily': daily,
+                  'prepared': prepared,
+                  'series': series,
+                  'views': views}
+        lama.cache['analytics'] = cached
+
+    return cached['views']
@@ -0,0 +1,303 @@
+"""
+Command line interface of Financelama, run as python -m financelama <command>.
+
+Modules needed by a command are imported only when it is run, so that import, categorize,
+report and evaluate don't load dash and plotly. Only serve starts the dashboard.
+"""
+import argparse
+import importlib
+import logging
+import os
+import time
+
+from financelama.config import cli_startup_budget
+from financelama.instrumentation import configure_logging, Instrumentation, JsonSink, logger, \
+    LogSink, ProfileSink, TracemallocSink
+
+_start_time = time.perf_counter()
+
+# Modules loaded for each command
+command_modules = {
+    'import': ['financelama.file_import'],
+    'categorize': ['financelama.process'],
+    'report': ['financelama.process'],
+    'evaluate': ['financelama.evaluation'],
+    'search': [],
+    'rules': ['financelama.rules'],
+    'export': ['financelama.export'],
+    'serve': ['financelama.evaluation', 'financelama.visual'],
+    'watch': ['financelama.inbox'],
+}
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='financelama',
+                                     description='Import, categorize and evaluate bank '
+                                                 'transactions.')
+    parser.add_argument('--db', default='lama.db', help='SQLite database (default: lama.db)')
+    parser.add_argument('--snapshot', default=None,
+                        help='Folder for columnar snapshot of database (requires pyarrow)')
+    parser.add_argument('--quiet', action='store_true', help='Only log warnings and errors')
+    parser.add_argument('--debug', action='store_true', help='Log debug messages')
+    parser.add_argument('--stats', default=None, metavar='JSON',
+                        help='Write wall time, rows and memory of each stage to JSON file')
+    parser.add_argument('--profile', default=None, metavar='FILE',
+                        help='Profile command with cProfile and write statistics to file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='Trace memory allocations for peak memory of each stage (slow)')
+    parser.add_argument('--memory-dump', default=None, metavar='FILE',
+                        help='Trace memory and dump tracemalloc snapshot to file at the end')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('import', help='Import CSV files or folders of CSV files')
+    p.add_argument('paths', nargs='+', help='CSV file of any format in bank_formats (DKB giro, '
+                                            'DKB debit card, PayPal) or folder')
+    p.add_argument('--chunksize', type=int, default=None,
+                   help='Import files in chunks of that many transactions')
+    p.add_argument('--workers', type=int, default=None,
+                   help='Number of worker processes for folders')
+
+    p = commands.add_parser('categorize', help='Assign categories to transactions')
+    p.add_argument('--all', action='store_true', dest='all_entries',
+                   help='Recategorize all transactions, not only uncategorized ones')
+    p.add_argument('--verbose', action='store_true', help='Print each assignment')
+    p.add_argument('--fuzzy', action='store_true',
+                   help='Categorize by clusters of similar orderers (cached in database)')
+    p.add_argument('--index', action='store_true', dest='use_index',
+                   help='Match keywords by full-text index of the database')
+
+    p = commands.add_parser('report', help='Assign transactions to a report or remove them '
+                                           'from their reports')
+    p.add_argument('name', nargs='?', default=None,
+                   help='Name of report, omit for removing transactions from their reports')
+    p.add_argument('--rowids', type=int, nargs='+', default=None, help='RowIds to assign')
+    p.add_argument('--range', type=int, nargs=2, action='append', dest='ranges',
+                   metavar=('FIRST', 'LAST'), help='Range of rowids, both included (repeatable)')
+    p.add_argument('--start', default=None, help='Only transactions from this day on')
+    p.add_argument('--end', default=None, help='Only transactions until this day (included)')
+    p.add_argument('--orderer', default=None,
+                   help='Only transactions with matching orderer (SQL LIKE pattern, '
+                        'e.g. %%hotel%%)')
+    p.add_argument('--category', default=None, help='Only transactions of this category')
+
+    p = commands.add_parser('evaluate', help='Print monthly income and expenses')
+    p.add_argument('--output', default=None, help='Write evaluated transactions to CSV file')
+    p.add_argument('--details', default=None, metavar='REPORT',
+                   help='Print transactions of given report')
+
+    p = commands.add_parser('search', help='Print transactions containing all given words')
+    p.add_argument('words', nargs='+', help='Words to search for (case insensitive)')
+    p.add_argument('--columns', nargs='+', default=None, choices=['orderer', 'reason', 'info'],
+                   help='Columns to search (default: all)')
+    p.add_argument('--limit', type=int, default=100,
+                   help='Maximum number of transactions (default: 100)')
+
+    p = commands.add_parser('rules', help='List, add or remove rules for categories and '
+                                          'dropped transactions')
+    actions = p.add_subparsers(dest='action', required=True)
+    actions.add_parser('list', help='Print all rules in order of matching')
+    a = actions.add_parser('add', help='Add rule and reclassify affected transactions')
+    a.add_argument('target', help='Category, or column with --drop')
+    a.add_argument('keyword', help='Keyword (case insensitive)')
+    a.add_argument('--drop', action='store_true',
+                   help='Drop transactions containing keyword on future imports')
+    a.add_argument('--priority', type=int, default=None,
+                   help='Order of categories, lower is matched first (default: priority of '
+                        'category, new categories last)')
+    a = actions.add_parser('remove', help='Remove rule and reclassify affected transactions')
+    a.add_argument('rule_id', type=int, help='Rule to remove (see list)')
+
+    p = commands.add_parser('export', help='Write monthly reports with figures of the dashboard '
+                                           'as JSON and HTML')
+    p.add_argument('path', help='Folder to write reports to')
+    p.add_argument('--months', nargs='+', default=None, metavar='YYYY-MM',
+                   help='Months of reports (default: all months)')
+    p.add_argument('--json-only', action='store_false', dest='html',
+                   help='Only write JSON, no HTML pages')
+    p.add_argument('--ledgers', default=None, metavar='FOLDER',
+                   help='Export all databases (*.db) of folder instead of --db, one subfolder '
+                        'per ledger')
+    p.add_argument('--workers', type=int, default=None,
+                   help='Number of worker processes')
+
+    p = commands.add_parser('serve', help='Start dashboard')
+    p.add_argument('--inbox', default=None,
+                   help='Import CSV files dropped into this folder in the background')
+    p.add_argument('--ledgers', default=None, metavar='FOLDER',
+                   help='Serve all databases (*.db) of folder with a ledger switch instead of '
+                        '--db (without --inbox)')
+
+    p = commands.add_parser('watch', help='Import CSV files dropped into a folder until '
+                                          'interrupted')
+    p.add_argument('inbox', help='Inbox folder')
+    p.add_argument('--fuzzy', action='store_true',
+                   help='Categorize by clusters of similar orderers (cached in database)')
+
+    return parser
+
+
+def _run_import(lama, args):
+    from financelama.file_import import read_file, read_folder_dkb
+
+    for path in args.paths:
+        if os.path.isdir(path):
+            read_folder_dkb(lama, path, workers=args.workers)
+        else:
+            read_file(lama, path, chunksize=args.chunksize)
+
+
+def _run_categorize(lama, args):
+    from financelama.process import categorize
+
+    categorize(lama, all_entries=args.all_entries, verbose=args.verbose, fuzzy=args.fuzzy,
+               use_index=args.use_index)
+
+
+def _run_report(lama, args):
+    from financelama.process import modify_report
+
+    modify_report(lama, args.name, list_of_rowids=args.rowids, list_of_ranges=args.ranges,
+                  start=args.start, end=args.end, orderer=args.orderer, category=args.category)
+
+
+def _run_evaluate(lama, args):
+    from financelama.evaluation import evaluate, monthly_cube, report_details
+
+    if args.details is not None:
+        print(report_details(lama, args.details).to_string())
+        return
+
+    if args.output is not None:
+        df = evaluate(lama)
+        df.to_csv(args.output, index=False)
+        print('[Evaluate] Wrote {0} transactions to {1}'.format(df.shape[0], args.output))
+        return
+
+    months = monthly_cube(lama).groupby(level=['month', 'sign'])['value'].sum()
+    months = months.unstack('sign', fill_value=0).reindex(columns=['income', 'expense'],
+                                                          fill_value=0)
+    months['balance'] = months['income'] + months['expense']
+    months.index = months.index.strftime('%Y-%m')
+    print(months.round(2).to_string())
+
+
+def _run_search(lama, args):
+    df = lama.search(' '.join(args.words), columns=args.columns, limit=args.limit)
+    print(df[['rowid', 'day', 'orderer', 'reason', 'value', 'category', 'report']].to_string(
+        index=False))
+
+
+def _run_rules(lama, args):
+    from financelama.rules import add_rule, list_rules, remove_rule
+
+    if args.action == 'list':
+        print(list_rules(lama).to_string(index=False))
+    elif args.action == 'add':
+        add_rule(lama, args.target, args.keyword, kind='drop' if args.drop else 'category',
+                 priority=args.priority)
+    else:
+        remove_rule(lama, args.rule_id)
+
+
+def _run_export(lama, args):
+    from financelama.export import export_ledgers, export_reports
+    from financelama.ledgers import LedgerPool
+
+    if args.ledgers is not None:
+        with LedgerPool.from_folder(args.ledgers, path_snapshots=args.snapshot) as ledgers:
+            export_ledgers(ledgers, args.path, months=args.months, html=args.html,
+                           workers=args.workers)
+        return
+
+    export_reports(lama, args.path, months=args.months, html=args.html, workers=args.workers)
+
+
+def _run_serve(lama, args):
+    from financelama.evaluation import evaluate
+    from financelama.ledgers import LedgerPool
+    from financelama.visual import start_dashboard
+
+    if args.ledgers is not None:
+        if args.inbox is not None:
+            raise ValueError('Inbox is not supported with several ledgers')
+        with LedgerPool.from_folder(args.ledgers, path_snapshots=args.snapshot) as ledgers:
+            start_dashboard(None, ledgers=ledgers)
+        return
+
+    start_dashboard(evaluate(lama, compact=True), lama, inbox=args.inbox)
+
+
+def _run_watch(lama, args):
+    from financelama.inbox import InboxWatcher
+
+    with InboxWatcher(lama, args.inbox, fuzzy=args.fuzzy):
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+_commands = {
+    'import': _run_import,
+    'categorize': _run_categorize,
+    'report': _run_report,
+    'evaluate': _run_evaluate,
+    'search': _run_search,
+    'rules': _run_rules,
+    'export': _run_export,
+    'serve': _run_serve,
+    'watch': _run_watch,
+}
+
+
+def main(argv=None) -> int:
+    """
+    Runs command line interface.
+
+    Parameters
+    ----------
+    argv : list of str, optional
+        Arguments without program name. Default: sys.argv[1:]
+
+    Returns
+    -------
+    Exit code
+    """
+    args = _parser().parse_args(argv)
+    configure_logging(logging.WARNING if args.quiet else
+                      logging.DEBUG if args.debug else logging.INFO)
+
+    for module in command_modules[args.command]:
+        importlib.import_module(module)
+
+    from financelama.core import Financelama
+    lama = Financelama(args.db, args.snapshot)
+
+    # Time from loading the CLI until the command is ready to run
+    startup = time.perf_counter() - _start_time
+    if startup > cli_startup_budget:
+        logger.warning('[Startup] %.3f s for %s (budget %.3f s) EXCEEDED', startup,
+                       args.command, cli_startup_budget)
+    else:
+        logger.info('[Startup] %.3f s for %s (budget %.3f s)', startup, args.command,
+                    cli_startup_budget)
+
+    sinks = [LogSink()]
+    if args.stats is not None:
+        sinks.append(JsonSink(args.stats))
+    if args.profile is not None:
+        sinks.append(ProfileSink(args.profile))
+    if args.trace_memory or args.memory_dump is not None:
+        sinks.append(TracemallocSink(args.memory_dump))
+
+    try:
+        with Instrumentation(sinks):
+            _commands[args.command](lama, args)
+    except ValueError as e:
+        logger.error('[Error] %s', e)
+        return 1
+    finally:
+        lama.close()
+
+    return 0
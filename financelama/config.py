@@ -1,23 +1,157 @@
-# Specification how file columns are mapped to Financelama columns (concatenates more than 1 col)
-# Make empty entries for empty mapping
+# Columns of Financelama, each bank format maps columns of its files to these
 financelama_columns = [
     'day', 'info', 'orderer', 'reason', 'orderer_account', 'orderer_bank', 'value'
 ]
-mapping_dkb_giro = [
-    ['Wertstellung'], ['Buchungstext'], ['Auftraggeber / Begünstigter'], ['Verwendungszweck'],
-    ['Kontonummer'], ['BLZ'], ['Betrag (EUR)']
-]
-mapping_dkb_debit = [
-    ['Wertstellung'], [], ['Beschreibung'], [], [], [], ['Betrag (EUR)']
-]
 
-mapping_paypal = [
-    ['Datum'], ['Hinweis'], ['Name'], ['Typ', 'Betreff'], [], [], ['Netto']
-]
+# Supported file formats by name, adding a bank only needs a new entry:
+#   signature    regular expression matching the first line of a file of this format
+#   delimiter    CSV delimiter
+#   encoding     file encoding (MBS encoding of exports made on windows)
+#   skip_rows    number of header lines above the column names
+#   account      bank account of all transactions, either fixed name or position within header
+#                lines: {'line': line, 'field': field, 'split': separator (optional)}
+#   mapping      Financelama column -> list of file columns, several columns are joined by a
+#                space. Unmapped Financelama columns are left empty
+#   thousands    thousands separator of amounts (None if not used)
+#   decimal      decimal separator of amounts
+#   date_format  format of dates (strptime)
+bank_formats = {
+    'dkb_giro': {
+        'signature': r'^"Kontonummer:"',
+        'delimiter': ';',
+        'encoding': 'ISO-8859-1',
+        'skip_rows': 6,
+        'account': {'line': 0, 'field': 1, 'split': ' / '},
+        'mapping': {
+            'day': ['Wertstellung'], 'info': ['Buchungstext'],
+            'orderer': ['Auftraggeber / Begünstigter'], 'reason': ['Verwendungszweck'],
+            'orderer_account': ['Kontonummer'], 'orderer_bank': ['BLZ'],
+            'value': ['Betrag (EUR)'],
+        },
+        'thousands': '.',
+        'decimal': ',',
+        'date_format': '%d.%m.%Y',
+    },
+    'dkb_debit': {
+        'signature': r'^"Kreditkarte:"',
+        'delimiter': ';',
+        'encoding': 'ISO-8859-1',
+        'skip_rows': 6,
+        'account': {'line': 0, 'field': 1},
+        'mapping': {
+            'day': ['Wertstellung'], 'orderer': ['Beschreibung'], 'value': ['Betrag (EUR)'],
+        },
+        'thousands': '.',
+        'decimal': ',',
+        'date_format': '%d.%m.%Y',
+    },
+    'paypal': {
+        'signature': r'^"Datum",.*"Name"',
+        'delimiter': ',',
+        'encoding': 'ISO-8859-1',
+        'skip_rows': 0,
+        'account': 'PayPal',
+        'mapping': {
+            'day': ['Datum'], 'info': ['Hinweis'], 'orderer': ['Name'],
+            'reason': ['Typ', 'Betreff'], 'value': ['Netto'],
+        },
+        'thousands': None,
+        'decimal': ',',
+        'date_format': '%d.%m.%Y',
+    },
+}
+
+# Number of bytes read from the beginning of a file for detecting its format
+detect_bytes = 4096
 
 # Transactions will be dropped if the following string is found as substring within the according
-# column
+# column. Seeds the drop rules of new databases, which are edited with rules.add_rule()
 dropping_keywords = {
    'orderer': ['KREDITKARTENABRECHNUNG', 'Ausgleich Kreditkarte'],
    'reason': ['umbuchung'],
-}
\ No newline at end of file
+}
+
+# Lookup table of categories with keywords, the first category with a keyword contained in
+# orderer or reason wins. Seeds the category rules of new databases, which are edited with
+# rules.add_rule() and rules.remove_rule()
+default_categories = {
+    'supermarket': ['rewe', 'coop', 'edeka', 'lidl', 'netto', 'norma', 'frukt', 'ica', 'ecenter', 'aksa'],
+    'rent': ['miete', 'mieete', 'wohnung', 'etagenbeitrag'],
+    'entertainment': ['netflix', 'spotify', 'ticket', 'konzert', 'museum', 'filmstaden'],
+    'restaurant': ['restaurant', 'restaurant', 'frittenwerk', 'bar', 'cafe', 'qstockholm', 'mcdonalds', 'backwerk', 'burger king', 'Bosch etterem', 'Bierkasse'],
+    'traffic': ['db', 'deutschebahn', 'train', 'deutsche bahn', 'sj', 'sl', 'flixbus'],
+    'drugstore': ['dm', 'rossmann'],
+    'shopping': ['amzn', 'amazon', 'ebay', 'lindt', 'eddie baur', 'bergfreunde', 'mayersche'],
+    'car': ['tankstelle', 'doetsch station',],
+    'income': ['gehalt', 'lohn', 'stipendium', 'entgelt'],
+    'cash': ['bankomat', 'sparkasse', 'sparda-bank', 'postbank']
+}
+
+# Number of worker processes parsing files in parallel on folder import (None: number of CPUs)
+import_workers = None
+
+# Ledger pool serving several databases from one process: number of databases kept open (least
+# recently used idle ones are closed) and number of threads running jobs of all ledgers
+ledger_max_open = 8
+ledger_workers = 4
+
+# SQLite page cache (KiB) and memory-mapped I/O size (bytes) for each database connection
+connection_cache_kib = 64000
+connection_mmap_bytes = 268435456
+
+# Seconds between checks of the dashboard for changes in the database (hot reload) and number of
+# filter combinations whose figures are kept in memory
+dashboard_reload_seconds = 5
+dashboard_cache_size = 256
+
+# Seconds the command line interface may spend on loading modules and opening the database before
+# running a command (reported after start)
+cli_startup_budget = 0.5
+
+# Maximum number of log messages per transaction (e.g. verbose categorization) within one run
+log_rate_limit = 20
+
+# Maximum number of explicitly given rowids per SQL statement (below SQLite's variable limit)
+rowid_batch_size = 500
+
+# Fuzzy clustering of orderers (categorize with fuzzy=True): minimum normalized Levenshtein
+# similarity of orderers in the same cluster, minimum share of common trigrams for comparing two
+# orderers at all, trigrams of more orderers than orderer_max_block are ignored for blocking
+orderer_similarity = 0.85
+orderer_min_overlap = 0.5
+orderer_max_block = 200
+
+# Words removed from orderers before clustering (legal forms)
+orderer_stopwords = ['gmbh', 'co', 'kg', 'ag', 'se', 'ev', 'ohg', 'ug', 'sa', 'sarl', 'ltd', 'inc']
+
+# Inbox for background imports: scan interval, time a file has to stay unchanged before import
+# and number of files the mean latency is computed of
+inbox_poll_seconds = 1.0
+inbox_debounce_seconds = 2.0
+inbox_latency_window = 100
+
+# Analytics: trailing windows (days) of rolling spend per category
+analytics_windows = [30, 90, 365]
+
+# Recurring payments: transactions of the same orderer with amounts equal after rounding to
+# recurring_amount_decimals are a series, which is recurring if it has at least
+# recurring_min_count transactions and a share of recurring_regularity of its intervals deviates
+# by at most recurring_tolerance (relative) from one of the recurring_periods (days)
+recurring_amount_decimals = 0
+recurring_min_count = 3
+recurring_regularity = 0.8
+recurring_tolerance = 0.1
+recurring_periods = {'weekly': 7, 'monthly': 30.44, 'quarterly': 91.31, 'yearly': 365.25}
+
+# Month-over-month anomalies: expenses of a category are compared with mean and standard
+# deviation of the previous anomaly_window months (at least anomaly_min_months), deviations of at
+# least anomaly_threshold standard deviations and anomaly_min_change EUR are flagged
+anomaly_window = 12
+anomaly_min_months = 3
+anomaly_threshold = 3.0
+anomaly_min_change = 50
+
+# Static export of monthly reports: months shown in bar chart and trends of each report (up to
+# the month of the report) and number of worker processes rendering reports (None: number of CPUs)
+export_history_months = 12
+export_workers = None
@@ -1,48 +1,462 @@
 # -*- coding: utf-8 -*-
 
-import os.path
+import contextlib
+import hashlib
+import re
 import sqlite3
+import threading
+import weakref
 
 import pandas as pd
 
+from financelama.config import connection_cache_kib, connection_mmap_bytes
+
+# Columns identifying a transaction, used for detecting duplicates on import
+fingerprint_columns = [
+    'account', 'day', 'info', 'orderer', 'orderer_account', 'orderer_bank', 'reason', 'value'
+]
+
+
+# Version of fingerprint computation, fingerprints of older versions are recomputed on opening
+fingerprint_version = 2
+
+# Text columns indexed for full-text search
+search_columns = ['orderer', 'reason', 'info']
+
+# Terms shorter than this can't be found by the trigram index and are matched by LIKE
+search_min_length = 3
+
+# Low-cardinality columns stored as categoricals in compact representation
+compact_categorical_columns = ['account', 'info', 'category', 'report']
+
+
+def is_missing(series: pd.Series) -> pd.Series:
+    """ Boolean mask of missing values, which are NA in compact representation and 'None'
+    otherwise.
+    """
+    return series.isna() | (series == 'None')
+
+
+def value_in_euros(df: pd.DataFrame) -> pd.Series:
+    """ Amounts in EUR of dataframe in standard or compact representation. """
+    if 'value_cents' in df.columns:
+        return df['value_cents'] / 100
+
+    return df['value']
+
+
+def to_compact(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts transactions to compact representation.
+
+    Low-cardinality columns (see compact_categorical_columns) become categoricals, amounts are
+    stored as integer cents in column value_cents instead of value and day as datetime64.
+    Missing values are NA instead of 'None'.
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Transactions as read from database or in standard representation.
+
+    Returns
+    -------
+    Dataframe in compact representation
+    """
+    df = df.copy()
+
+    for col in df.columns:
+        if col == 'day':
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+        elif col == 'value':
+            cents = (pd.to_numeric(df[col], errors='coerce') * 100).round()
+            df[col] = cents.astype('Int64' if cents.isna().any() else 'int64')
+        elif df[col].dtype == object:
+            df[col] = df[col].mask(is_missing(df[col]))
+            if col in compact_categorical_columns:
+                df[col] = df[col].astype('category')
+
+    return df.rename(columns={'value': 'value_cents'})
+
+
+def concat_frames(frames: list) -> pd.DataFrame:
+    """
+    Concatenates dataframes, categorical columns of the first dataframe stay categorical with
+    the union of all categories.
+    """
+    categorical = [c for c in frames[0].columns
+                   if isinstance(frames[0][c].dtype, pd.CategoricalDtype)]
+
+    for col in categorical:
+        categories = pd.unique(pd.concat(
+            [pd.Series(f[col].dropna().unique(), dtype=object) for f in frames]))
+        frames = [f.assign(**{col: f[col].astype(pd.CategoricalDtype(categories))})
+                  for f in frames]
+
+    return pd.concat(frames, ignore_index=True)
+
+
+def _normalize_column(series: pd.Series, column: str) -> pd.Series:
+    """ Normalizes column to string representation independent of its origin (file or database).
+    """
+    if column == 'day':
+        normalized = pd.to_datetime(series).dt.strftime('%Y-%m-%d')
+    elif column == 'value':
+        # Adding 0.0 turns -0.0 into 0.0
+        normalized = (pd.to_numeric(series, errors='coerce').round(2) + 0.0).map('{:.2f}'.format)
+    else:
+        # Text joined from several file columns contained 'nan' for missing parts before
+        # fingerprint_version 2
+        normalized = series.astype(str).str.strip()
+        joined = normalized.str.contains('nan', regex=False)
+        normalized[joined] = normalized[joined].str.replace(r'(?:^|\s)nan(?=\s|$)', '',
+                                                            regex=True).str.strip()
+
+    # Missing values are represented as None, NaN, 'None' or '' depending on their origin
+    return normalized.fillna('').replace(['None', 'nan', 'NaN', 'NaT'], '')
+
+
+def compute_fingerprints(df: pd.DataFrame, occurrences: dict = None) -> pd.Series:
+    """
+    Computes deterministic fingerprint for each transaction.
+
+    The fingerprint is a hash of all normalized fingerprint_columns. Identical transactions
+    within df are numbered in order of their appearance, so that all of them are kept.
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Transactions with at least all fingerprint_columns.
+    occurrences: dict, optional
+        Counts of transactions seen in previous chunks of the same file, updated in place. Used
+        for numbering identical transactions across chunks.
+
+    Returns
+    -------
+    pd.Series with hex digest for each row of df
+    """
+    key = pd.Series('', index=df.index)
+    for col in fingerprint_columns:
+        key = key + _normalize_column(df[col], col) + '\x1f'
+
+    ordinal = key.groupby(key).cumcount()
+    if occurrences is not None:
+        ordinal += key.map(occurrences).fillna(0).astype(int)
+        for k, count in key.value_counts().items():
+            occurrences[k] = occurrences.get(k, 0) + count
+
+    key = key + ordinal.astype(str)
+
+    return key.map(lambda k: hashlib.sha1(k.encode('utf-8')).hexdigest())
+
+
+class _ThreadConnection:
+    """ Connection of one thread, see Financelama.connection(). """
+
+    def __init__(self, con: sqlite3.Connection):
+        self.con = con
+
+
+def _discard_connection(ref, con: sqlite3.Connection):
+    """ Closes connection of an ended thread. """
+    lama = ref()
+    if lama is None:
+        con.close()
+    else:
+        lama._discard(con)
+
 
 class Financelama:
     """
     Manages database and provides access for all other functions
 
+    Each thread gets its own reusable connection to the database, which is opened in WAL mode,
+    so that readers (e.g. dashboard callbacks) and a writer can access the database concurrently.
+    The connection of a thread is closed when the thread ends, so that short-lived threads (e.g.
+    requests of the dashboard server) don't leave connections open.
+
     Attributes
     ----------
     PATH_DB: str
         Path to SQLite database file.
+    PATH_SNAPSHOT: str
+        Path to folder with columnar snapshot of database or None if disabled (see snapshot).
+    search_index: bool
+        True if full-text index is available (requires FTS5 with trigram tokenizer, SQLite
+        3.34 or newer), otherwise search falls back to LIKE.
 
     Methods
     -------
     connect_database(sql_query=None)
         Connect to database and casts columns to correct datatypes.
+    connection()
+        Reusable connection to database of the current thread.
+    transaction()
+        Context manager for a write transaction.
+    close()
+        Closes all connections.
+    version()
+        Current change version of database.
+    bump_version(conn)
+        Starts new change version, has to be called by all functions writing transactions.
+    changes_since(version)
+        Months and reports changed after given version.
+    search(query)
+        Transactions containing all words of query.
+    search_condition(terms)
+        SQL condition selecting transactions containing text terms.
     """
     PATH_DB: str
+    PATH_SNAPSHOT: str
+    search_index: bool
+    cache: dict
 
-    def __init__(self, path_database='lama.db'):
+    def __init__(self, path_database='lama.db', path_snapshot=None):
         """ Check if database file already exists and create with all columns if not.
 
         Parameters
         ----------
         path_database : str, optional
             Path to SQLite database (either existing or not). Default: 'lama.db'
+        path_snapshot : str, optional
+            Folder for columnar snapshot of database (Parquet, requires pyarrow). Snapshot is
+            kept in sync after imports and categorization and used for evaluation. Default:
+            None (no snapshot)
         """
         self.PATH_DB = path_database
+        self.PATH_SNAPSHOT = path_snapshot
+
+        # Results derived from database, only valid for the change version stored with them
+        self.cache = {}
+
+        # Connections by thread, all open ones are tracked for closing
+        self._local = threading.local()
+        self._connections = set()
+        self._lock = threading.Lock()
+
+        self._create_schema()
+
+    def _create_schema(self):
+        """ Creates all tables and indexes if not existing. Adds fingerprint and rule_id column to
+        databases created by older versions and fills in missing or outdated fingerprints.
+        """
+        with self.transaction() as con:
+            con.execute('CREATE TABLE IF NOT EXISTS transactions ('
+                        'account TEXT, day TEXT, info TEXT, orderer TEXT, orderer_account TEXT, '
+                        'orderer_bank TEXT, reason TEXT, value REAL, category TEXT, report TEXT, '
+                        'fingerprint TEXT, rule_id INTEGER)')
+
+            columns = [c[1] for c in con.execute('PRAGMA table_info(transactions)')]
+            if 'fingerprint' not in columns:
+                con.execute('ALTER TABLE transactions ADD COLUMN fingerprint TEXT')
+            if 'rule_id' not in columns:
+                # Rule which assigned the category, see rules
+                con.execute('ALTER TABLE transactions ADD COLUMN rule_id INTEGER')
+
+            self._create_changelog(con)
+            self.search_index = self._create_search_index(con)
+
+            stored_version = con.execute(
+                "SELECT value FROM lama_meta WHERE key = 'fingerprint_version'").fetchone()
+            outdated = stored_version is None or stored_version[0] != fingerprint_version
+
+            if con.execute('SELECT 1 FROM transactions WHERE fingerprint IS NULL OR ? LIMIT 1',
+                           [outdated]).fetchone():
+                # Fingerprints are recomputed for the whole table so that numbering of
+                # identical transactions is consistent
+                con.execute('DROP INDEX IF EXISTS idx_transactions_fingerprint')
+                df = pd.read_sql('SELECT rowid, ' + ', '.join(fingerprint_columns) +
+                                 ' FROM transactions ORDER BY rowid', con)
+                con.executemany('UPDATE transactions SET fingerprint = ? WHERE _ROWID_ = ?',
+                                zip(compute_fingerprints(df).tolist(), df['rowid'].tolist()))
+            con.execute("INSERT OR REPLACE INTO lama_meta VALUES ('fingerprint_version', ?)",
+                        [fingerprint_version])
+
+            con.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_fingerprint '
+                        'ON transactions (fingerprint)')
+
+            # Indexes for common filter columns
+            for col in ['day', 'category', 'report', 'rule_id']:
+                con.execute('CREATE INDEX IF NOT EXISTS idx_transactions_{0} '
+                            'ON transactions ({0})'.format(col))
+
+    @staticmethod
+    def _create_changelog(con):
+        """ Creates change version counter and changelog which is filled by triggers with months
+        and reports of all changed transactions.
+        """
+        con.execute('CREATE TABLE IF NOT EXISTS lama_meta (key TEXT PRIMARY KEY, value)')
+        con.execute("INSERT OR IGNORE INTO lama_meta VALUES ('version', 0)")
+
+        # Missing reports are logged as '' since NULL would defeat the unique constraint
+        con.execute('CREATE TABLE IF NOT EXISTS changelog ('
+                    'version INTEGER, month TEXT, report TEXT, UNIQUE (version, month, report))')
 
-        # Create database file if not already existing
-        if not os.path.isfile(self.PATH_DB):
-            table = pd.DataFrame(columns=[
-                'account', 'day', 'info', 'orderer', 'orderer_account', 'orderer_bank',
-                'reason', 'value', 'category', 'report'])
+        log = "INSERT OR IGNORE INTO changelog " \
+              "SELECT value, substr({0}.day, 1, 7), IFNULL({0}.report, '') " \
+              "FROM lama_meta WHERE key = 'version';"
+        con.execute('CREATE TRIGGER IF NOT EXISTS log_insert AFTER INSERT ON transactions '
+                    'BEGIN ' + log.format('NEW') + ' END')
+        con.execute('CREATE TRIGGER IF NOT EXISTS log_update AFTER UPDATE ON transactions '
+                    'BEGIN ' + log.format('OLD') + log.format('NEW') + ' END')
+        con.execute('CREATE TRIGGER IF NOT EXISTS log_delete AFTER DELETE ON transactions '
+                    'BEGIN ' + log.format('OLD') + ' END')
 
-            con = sqlite3.connect(self.PATH_DB)
-            table.to_sql('transactions', con, index=False)
-            con.close()
+    @staticmethod
+    def _create_search_index(con) -> bool:
+        """ Creates full-text index of search_columns, which is kept in sync by triggers and
+        built from existing transactions on creation. The index stores no copy of the text.
 
-    def connect_database(self, sql_query: str = None):
+        Returns
+        -------
+        True if index is available, False if SQLite lacks FTS5 or the trigram tokenizer.
+        """
+        exists = con.execute("SELECT 1 FROM sqlite_master "
+                             "WHERE name = 'transactions_fts'").fetchone()
+        try:
+            con.execute('CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(' +
+                        ', '.join(search_columns) + ", content='transactions', "
+                        "content_rowid='rowid', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            return False
+
+        columns = ', '.join(search_columns)
+        insert = 'INSERT INTO transactions_fts (rowid, {0}) VALUES (NEW.rowid, {1});'.format(
+            columns, ', '.join('NEW.' + c for c in search_columns))
+        delete = "INSERT INTO transactions_fts (transactions_fts, rowid, {0}) " \
+                 "VALUES ('delete', OLD.rowid, {1});".format(
+                     columns, ', '.join('OLD.' + c for c in search_columns))
+        con.execute('CREATE TRIGGER IF NOT EXISTS fts_insert AFTER INSERT ON transactions '
+                    'BEGIN ' + insert + ' END')
+        con.execute('CREATE TRIGGER IF NOT EXISTS fts_update AFTER UPDATE OF ' + columns +
+                    ' ON transactions BEGIN ' + delete + insert + ' END')
+        con.execute('CREATE TRIGGER IF NOT EXISTS fts_delete AFTER DELETE ON transactions '
+                    'BEGIN ' + delete + ' END')
+
+        if exists is None:
+            con.execute("INSERT INTO transactions_fts (transactions_fts) VALUES ('rebuild')")
+
+        return True
+
+    def _open(self) -> sqlite3.Connection:
+        """ Opens new connection with WAL journaling and tuned pragmas. """
+        # Waits up to 30 seconds for locks held by other connections
+        con = sqlite3.connect(self.PATH_DB, timeout=30, check_same_thread=False)
+
+        con.execute('PRAGMA journal_mode = WAL')
+        con.execute('PRAGMA synchronous = NORMAL')
+        con.execute('PRAGMA temp_store = MEMORY')
+        con.execute('PRAGMA cache_size = -{0}'.format(connection_cache_kib))
+        con.execute('PRAGMA mmap_size = {0}'.format(connection_mmap_bytes))
+
+        with self._lock:
+            self._connections.add(con)
+
+        return con
+
+    def _discard(self, con: sqlite3.Connection):
+        """ Closes connection and stops tracking it. """
+        with self._lock:
+            self._connections.discard(con)
+        con.close()
+
+    def connection(self) -> sqlite3.Connection:
+        """ Reusable connection to database of the current thread.
+
+        The connection is opened on first use and shared by all functions running in the same
+        thread, it does not have to be closed by the caller. If it was closed anyway, a new one
+        is opened. The connection is closed when the thread ends.
+        """
+        holder = getattr(self._local, 'connection', None)
+        con = None if holder is None else holder.con
+
+        if con is not None:
+            try:
+                con.total_changes
+            except sqlite3.ProgrammingError:
+                # Connection was closed by caller
+                con = None
+
+        if con is None:
+            con = self._open()
+            holder = self._local.connection = _ThreadConnection(con)
+
+            # Thread-local values are released when their thread ends, the finalizer must not
+            # keep self alive
+            weakref.finalize(holder, _discard_connection, weakref.ref(self), con)
+
+        return con
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """ Context manager for a write transaction on the connection of the current thread.
+
+        The write lock is acquired immediately, changes are committed when the block is left and
+        rolled back on exceptions. Nested usage joins the outer transaction.
+
+        Yields
+        ------
+        sqlite3.Connection
+        """
+        con = self.connection()
+
+        if con.in_transaction:
+            yield con
+            return
+
+        con.execute('BEGIN IMMEDIATE')
+        try:
+            yield con
+        except BaseException:
+            con.rollback()
+            raise
+        con.commit()
+
+    def close(self):
+        """ Closes all connections of all threads. """
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections = set()
+
+    def version(self) -> int:
+        """ Current change version of database, increases with every change of transactions.
+        """
+        return self.connection().execute(
+            "SELECT value FROM lama_meta WHERE key = 'version'").fetchone()[0]
+
+    @staticmethod
+    def bump_version(conn):
+        """ Starts new change version within the current transaction of conn. All changes of
+        transactions until commit are logged with this version.
+
+        Parameters
+        ----------
+        conn:
+            Connection to SQLite3 database which is used for writing transactions afterwards.
+        """
+        conn.execute("UPDATE lama_meta SET value = value + 1 WHERE key = 'version'")
+
+    def changes_since(self, version: int):
+        """ Months and reports of all transactions changed after given version.
+
+        Parameters
+        ----------
+        version : int
+            Change version as returned from version()
+
+        Returns
+        -------
+        Set of months ('YYYY-MM') and set of report names as touple in that very order.
+        """
+        changes = self.connection().execute(
+            'SELECT month, report FROM changelog WHERE version > ?', [version]).fetchall()
+
+        months = {c[0] for c in changes if c[0] is not None}
+        reports = {c[1] for c in changes if c[1] not in ('', 'None')}
+
+        return months, reports
+
+    def connect_database(self, sql_query: str = None, params=None, compact=False):
         """ Connect to database and casts columns to correct datatypes.
 
         Parameters
@@ -50,17 +464,24 @@ class Financelama:
         sql_query : str, optional
             Optional SQL query to run against database. If not given, all
             columns from table transactions are retrieved.
+        params : list, optional
+            Parameters for placeholders in sql_query.
+        compact : bool, optional
+            Return dataframe in compact representation, see to_compact().
 
         Returns
         -------
         Both, a pandas.Dataframe and the database connection are returned as
-        touple in that very order.
+        touple in that very order. The connection is shared, see connection().
         """
         if sql_query is None:
             sql_query = 'SELECT * FROM transactions'
 
-        con = sqlite3.connect(self.PATH_DB)
-        df = pd.read_sql(sql_query, con)
+        con = self.connection()
+        df = pd.read_sql(sql_query, con, params=params)
+
+        if compact:
+            return to_compact(df), con
 
         # Cast columns to correct datatypes
         if 'day' in df.columns:
@@ -79,3 +500,79 @@ class Financelama:
             df = df.astype({'report': 'str'})
 
         return df, con
+
+    def search_condition(self, terms, columns: list = None, match_all: bool = True):
+        """ SQL condition selecting transactions which contain text terms (case insensitive).
+
+        Terms of at least search_min_length characters are looked up in the full-text index,
+        so only matching rows are read. Shorter terms (and all terms if the index isn't
+        available) are matched by LIKE.
+
+        Parameters
+        ----------
+        terms : str or list of str
+            A string is split into words, each item of a list is taken as it is (e.g.
+            'burger king').
+        columns : list of str, optional
+            Columns to search, subset of search_columns. Default: all search_columns
+        match_all : bool, optional
+            Transactions have to contain all terms, otherwise at least one of them
+
+        Returns
+        -------
+        SQL condition and list of its parameters as touple in that very order, None if there
+        are no terms.
+        """
+        if isinstance(terms, str):
+            terms = terms.split()
+        terms = [t for t in terms if t]
+        columns = list(columns or search_columns)
+        if not terms:
+            return None
+
+        indexed = [t for t in terms if self.search_index and len(t) >= search_min_length]
+        conditions = []
+        params = []
+        if indexed:
+            phrases = ['"' + t.replace('"', '""') + '"' for t in indexed]
+            conditions.append('rowid IN (SELECT rowid FROM transactions_fts '
+                              'WHERE transactions_fts MATCH ?)')
+            params.append('{' + ' '.join(columns) + '} : (' +
+                          (' AND ' if match_all else ' OR ').join(phrases) + ')')
+
+        for t in terms:
+            if t in indexed:
+                continue
+            pattern = '%' + re.sub(r'([\\%_])', r'\\\1', t) + '%'
+            conditions.append('(' + ' OR '.join(c + " LIKE ? ESCAPE '\\'"
+                                                for c in columns) + ')')
+            params += [pattern] * len(columns)
+
+        return (' AND ' if match_all else ' OR ').join(conditions), params
+
+    def search(self, query: str, columns: list = None, limit: int = None) -> pd.DataFrame:
+        """ Transactions containing all words of query, newest first.
+
+        Parameters
+        ----------
+        query : str
+            Words to search for (case insensitive), e.g. 'rewe berlin'
+        columns : list of str, optional
+            Columns to search, subset of search_columns. Default: all search_columns
+        limit : int, optional
+            Maximum number of returned transactions
+
+        Returns
+        -------
+        pandas.DataFrame with rowid and all columns of matching transactions, empty if query
+        contains no words.
+        """
+        condition, params = self.search_condition(query, columns) or ('0', [])
+
+        sql_query = 'SELECT rowid, * FROM transactions WHERE ' + condition + \
+                    ' ORDER BY day DESC, rowid DESC'
+        if limit is not None:
+            sql_query += ' LIMIT ?'
+            params = params + [limit]
+
+        return self.connect_database(sql_query, params)[0]
@@ -1,65 +1,403 @@
-from financelama.core import Financelama
+from financelama.core import Financelama, concat_frames, is_missing, to_compact, value_in_euros
+from financelama.instrumentation import stage
+from financelama.snapshot import load_snapshot
+import numpy as np
 import pandas as pd
 
+# Dimensions of aggregate cube, see monthly_cube()
+cube_dimensions = ['month', 'category', 'account', 'sign']
 
-def _eval_report(df: pd.DataFrame, conn):
+# Columns of evaluated dataframe
+evaluation_columns = [
+    'account', 'day', 'info', 'orderer', 'orderer_account', 'orderer_bank', 'reason', 'value',
+    'category', 'report'
+]
+
+
+def _placeholders(values) -> str:
+    """ Placeholder list for SQL IN clause with one placeholder for each value. """
+    return '(' + ', '.join(['?'] * len(values)) + ')'
+
+
+def _eval_report(df: pd.DataFrame):
     """
     Replaces all reported transactions with single aggregated new row.
 
+    All reports are aggregated at once by grouping the reported transactions. The aggregated
+    row of a report is dated to its first transaction and holds the report name as reason.
+
     Parameters
     ----------
     df: pd.Dataframe
-        Initial dataframe
-    conn:
-        Connection to SQLite3 database.
+        Initial dataframe in standard or compact representation
 
     Returns
     -------
-    Dataframe where transactions as part of reports are replaced by their aggregated evaluation.
+    Dataframe where transactions as part of reports are replaced by their aggregated evaluation
+    and dataframe with all reported transactions indexed by report name, as touple in that very
+    order.
+    """
+    is_reported = ~is_missing(df['report'])
+    reported = df[is_reported]
+    compact = 'value_cents' in df.columns
+    value_column = 'value_cents' if compact else 'value'
+
+    # Aggregate all reports
+    aggregated = reported.groupby('report', sort=True, observed=True).agg(
+        day=('day', 'min'), **{value_column: (value_column, 'sum')})
+    aggregated = aggregated.reset_index()
+    aggregated['report'] = aggregated['report'].astype(object)
+    aggregated['reason'] = aggregated['report']
+    aggregated['info'] = 'REPORTED'
+
+    # Columns without meaning for reports are marked as missing like in the database
+    aggregated = aggregated.reindex(columns=df.columns, fill_value=None if compact else 'None')
+
+    # Replace all reported transactions by aggregated rows
+    evaluated = concat_frames([df[~is_reported], aggregated])
+
+    details = reported.set_index('report').sort_index()
+
+    return evaluated, details
+
+
+def _in_months(days, months: list) -> np.ndarray:
+    """ Boolean mask of days (datetime values) within given months ('YYYY-MM'). """
+    return np.isin(np.asarray(days, dtype='datetime64[M]'),
+                   np.array(months, dtype='datetime64[M]'))
+
+
+def _month_condition(months: list):
+    """
+    SQL condition selecting all transactions within given months ('YYYY-MM'). Uses day ranges,
+    so that the index on day can be used.
+
+    Returns
+    -------
+    Condition and list of parameters as touple in that very order.
+    """
+    if len(months) == 0:
+        return '0', []
+
+    params = []
+    for m in months:
+        month_start = pd.Timestamp(m + '-01')
+        params += [str(month_start), str(month_start + pd.offsets.MonthBegin(1))]
+
+    return '(' + ' OR '.join(['(day >= ? AND day < ?)'] * len(months)) + ')', params
+
+
+def _refresh_summaries(lama: Financelama):
+    """
+    Updates materialized aggregates per month and per report. Called by their readers
+    (monthly_summary() and monthly_cube()) only, so that evaluation doesn't write.
+
+    Only months and reports changed since the last refresh are recomputed. Transactions which
+    are part of a report are aggregated in report_summary only.
+
+    Parameters
+    ----------
+    lama: Financelama
+        Reference to Financelama object which manages database connection.
     """
-    cur = conn.cursor()
+    version = lama.version()
 
-    # Evaluate reports
-    cur.execute('SELECT DISTINCT report FROM transactions')
-    report_names = cur.fetchall()
+    # Summaries which have never been built have no version
+    summary_version = lama.connection().execute(
+        "SELECT value FROM lama_meta WHERE key = 'summary_version'").fetchone()
+    summary_version = -1 if summary_version is None else summary_version[0]
+
+    if summary_version == version:
+        return
+
+    month_query = 'INSERT INTO month_summary ' \
+                  'SELECT substr(day, 1, 7), IFNULL(category, \'None\'), account, ' \
+                  'CASE WHEN CAST(value AS REAL) < 0 THEN \'expense\' ELSE \'income\' END, ' \
+                  'SUM(CAST(value AS REAL)), COUNT(*) FROM transactions ' \
+                  'WHERE IFNULL(report, \'None\') = \'None\' {0} GROUP BY 1, 2, 3, 4'
+    report_query = 'INSERT INTO report_summary ' \
+                   'SELECT report, MIN(day), SUM(CAST(value AS REAL)), COUNT(*) ' \
+                   'FROM transactions WHERE {0} GROUP BY report'
+
+    with lama.transaction() as conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS month_summary (month TEXT, category TEXT, '
+                     'account TEXT, sign TEXT, value REAL, count INTEGER)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_month_summary_month '
+                     'ON month_summary (month)')
+        conn.execute('CREATE TABLE IF NOT EXISTS report_summary ('
+                     'report TEXT PRIMARY KEY, day TEXT, value REAL, count INTEGER)')
+
+        if summary_version < 0:
+            # Build summaries from scratch
+            conn.execute('DELETE FROM month_summary')
+            conn.execute('DELETE FROM report_summary')
+            conn.execute(month_query.format(''))
+            conn.execute(report_query.format('IFNULL(report, \'None\') <> \'None\''))
+        else:
+            months, reports = lama.changes_since(summary_version)
+            months = sorted(months)
+            reports = sorted(reports)
+
+            if len(months) > 0:
+                condition, params = _month_condition(months)
+                conn.execute('DELETE FROM month_summary WHERE month IN ' +
+                             _placeholders(months), months)
+                conn.execute(month_query.format('AND ' + condition), params)
+
+            if len(reports) > 0:
+                conn.execute('DELETE FROM report_summary WHERE report IN ' +
+                             _placeholders(reports), reports)
+                conn.execute(report_query.format('report IN ' + _placeholders(reports)),
+                             reports)
+
+        conn.execute("INSERT OR REPLACE INTO lama_meta VALUES ('summary_version', ?)",
+                     [version])
+
+
+def monthly_summary(lama: Financelama) -> pd.DataFrame:
+    """
+    Aggregated transactions per month, category, account and sign (income or expense).
+
+    Returns
+    -------
+    pandas.DataFrame with columns month, category, account, sign, value and count
+    """
+    _refresh_summaries(lama)
+
+    return pd.read_sql('SELECT * FROM month_summary ORDER BY month', lama.connection())
+
+
+def _to_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """ Sums up value and count of aggregated rows per cube dimension and sorts cube by them. """
+    df = df.astype({'value': 'float64', 'count': 'int64'})
+
+    return df.groupby(cube_dimensions, sort=True)[['value', 'count']].sum()
+
+
+def frame_to_cube(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregates evaluated dataframe into cube, see monthly_cube(). Used if no database is
+    available, e.g. for dashboards of a given dataframe.
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Evaluated dataframe in standard or compact representation
+
+    Returns
+    -------
+    pandas.DataFrame with value and count indexed by cube dimensions
+    """
+    value = value_in_euros(df)
 
-    for name in report_names:
-        if name[0] is None:
-            continue
+    return _to_cube(pd.DataFrame({
+        'month': df['day'].dt.to_period('M').dt.end_time.dt.normalize(),
+        'category': df['category'].astype(object).fillna('None'),
+        'account': df['account'].astype(object).fillna('None'),
+        'sign': np.where(value < 0, 'expense', 'income'),
+        'value': value,
+        'count': 1,
+    }))
 
-        # Aggregate data from database
-        cur.execute('SELECT SUM(value) FROM transactions WHERE report=?', name)
-        aggregated_sum = cur.fetchone()[0]
-        cur.execute('SELECT MIN(day) FROM transactions WHERE report=?', name)
-        date = cur.fetchone()[0]
 
-        # Add row with aggregated exense
-        df.append({'day': date,
-                   'reason': name[0],
-                   'value': aggregated_sum,
-                   'info': 'REPORTED'},
-                  ignore_index=True)
+def _read_month_summary(lama: Financelama, months: list = None) -> pd.DataFrame:
+    """ Reads materialized month_summary, either all or only given months ('YYYY-MM'). """
+    sql_query = 'SELECT * FROM month_summary'
+    if months is not None:
+        sql_query += ' WHERE month IN ' + _placeholders(months)
 
-    # Remove all reported transaction from dataframe
-    df = df[df.report == 'None']
+    df = pd.read_sql(sql_query, lama.connection(), params=months)
+    df['month'] = pd.to_datetime(df['month'] + '-01') + pd.offsets.MonthEnd(0)
+    df['account'] = df['account'].fillna('None')
 
     return df
 
 
-def evaluate(lama: Financelama):
+def monthly_cube(lama: Financelama) -> pd.DataFrame:
+    """
+    Pre-aggregated cube of evaluated transactions with dimensions month, category, account and
+    sign (income or expense).
+
+    The cube is built from the materialized month_summary and report_summary, which are updated
+    incrementally. It is cached for the current change version and only changed months are
+    re-read after a change. Reports are contained as single aggregated rows dated to their
+    first transaction, like in evaluate().
+
+    Parameters
+    ----------
+    lama: Financelama
+        Reference to Financelama object which manages database connection.
+
+    Returns
+    -------
+    pandas.DataFrame with value and count indexed by sorted cube dimensions. Months are
+    represented by the last day of the month, so that slices of a month can be selected with
+    cube.loc[month].
+    """
+    version = lama.version()
+    cached = lama.cache.get('cube')
+
+    if cached is None or cached['version'] != version:
+        _refresh_summaries(lama)
+
+        if cached is None:
+            months = _read_month_summary(lama)
+        else:
+            changed = sorted(lama.changes_since(cached['version'])[0])
+            previous = cached['months']
+            unchanged = ~_in_months(previous['month'], changed)
+            months = pd.concat([previous[unchanged], _read_month_summary(lama, changed)],
+                               ignore_index=True)
+
+        # Reports are few, so that they are always read completely
+        reports = pd.read_sql(
+            "SELECT substr(day, 1, 7) AS month, 'None' AS category, 'None' AS account, "
+            "CASE WHEN value < 0 THEN 'expense' ELSE 'income' END AS sign, value, "
+            "1 AS count FROM report_summary", lama.connection())
+        reports['month'] = pd.to_datetime(reports['month'] + '-01') + pd.offsets.MonthEnd(0)
+
+        cached = {'version': version,
+                  'months': months,
+                  'cube': _to_cube(pd.concat([months, reports], ignore_index=True))}
+        lama.cache['cube'] = cached
+
+    return cached['cube']
+
+
+def filter_cube(cube: pd.DataFrame, start=None, end=None, accounts=None,
+                categories=None) -> pd.DataFrame:
+    """
+    Slices cube (see monthly_cube) to range of months and to given accounts and categories.
+
+    Parameters
+    ----------
+    cube: pd.Dataframe
+        Aggregate cube with sorted index
+    start, end: date-like, optional
+        First and last day of range, the months containing them are included completely
+    accounts, categories: list of str, optional
+        Only keep these accounts and categories. None or empty list keeps all of them.
+
+    Returns
+    -------
+    pandas.DataFrame with the same layout as cube
+    """
+    if start is not None:
+        start = pd.Timestamp(start).normalize() + pd.offsets.MonthEnd(0)
+    if end is not None:
+        end = pd.Timestamp(end).normalize() + pd.offsets.MonthEnd(0)
+    if start is not None or end is not None:
+        cube = cube.loc[start:end]
+
+    if accounts:
+        cube = cube[cube.index.get_level_values('account').isin(accounts)]
+    if categories:
+        cube = cube[cube.index.get_level_values('category').isin(categories)]
+
+    return cube
+
+
+def _load_transactions(lama: Financelama, cached: dict, compact: bool) -> pd.DataFrame:
+    """
+    Loads transactions with additional rowid column for evaluation, only months changed since
+    the cached version are read if a cached result is given. Transactions are read from the
+    snapshot if enabled. See to_compact() for compact.
+    """
+    columns = ['rowid'] + evaluation_columns
+    sql_query = 'SELECT ' + ', '.join(columns) + ' FROM transactions'
+
+    if cached is None:
+        if lama.PATH_SNAPSHOT is not None:
+            # Only columns of the evaluation are read from the snapshot
+            df = load_snapshot(lama, columns).sort_values(by=['rowid'], ignore_index=True)
+            return to_compact(df) if compact else df
+        return lama.connect_database(sql_query, compact=compact)[0]
+
+    months = sorted(lama.changes_since(cached['version'])[0])
+    previous = cached['transactions']
+
+    if lama.PATH_SNAPSHOT is not None:
+        month_starts = [pd.Timestamp(m + '-01') for m in months]
+        ranges = [(m, m + pd.offsets.MonthBegin(1)) for m in month_starts]
+        changed = load_snapshot(lama, columns, ranges=ranges) if len(ranges) > 0 \
+            else previous.iloc[0:0]
+        if compact and len(ranges) > 0:
+            changed = to_compact(changed)
+    else:
+        condition, params = _month_condition(months)
+        changed = lama.connect_database(sql_query + ' WHERE ' + condition, params,
+                                        compact=compact)[0]
+
+    # Replace all cached transactions of changed months
+    unchanged = ~_in_months(previous['day'], months)
+
+    return concat_frames([previous[unchanged], changed]).sort_values(by=['rowid'])
+
+
+def evaluate(lama: Financelama, compact=False):
     """
     Evaluates database in preparation of analysis, e.g. calls all existing evaluation function.
+    Transactions as part of reports are replaced by a single aggregated row for each report.
+
+    Loaded transactions are cached for the current change version of the database. If the
+    database was changed, only the changed months are reloaded.
+
+    Parameters
+    ----------
+    lama: Financelama
+        Reference to Financelama object which manages database connection.
+    compact: bool, optional
+        Evaluate in compact representation (categoricals, amounts in cents), which needs less
+        memory for long-running processes like the dashboard. See to_compact().
 
     Returns
     -------
     pandas.DataFrame
         Evaluated data ready to be processed of visualization module (e.g. visual)
     """
-    # Get total data frame
-    df, conn = lama.connect_database('SELECT * FROM transactions')
+    version = lama.version()
+    cache_key = 'evaluate_compact' if compact else 'evaluate'
+    cached = lama.cache.get(cache_key)
 
-    _eval_report(df, conn)
+    if cached is None or cached['version'] != version:
+        with stage('evaluate') as record:
+            # Get total data frame
+            df = _load_transactions(lama, cached, compact)
 
-    conn.close()
+            evaluated, details = _eval_report(df.drop(columns=['rowid']))
+            record['rows'] = df.shape[0]
 
-    return df
+        # The result is derived from the transactions on each call, so that the cache doesn't
+        # hold a second copy of them
+        cached = {'version': version,
+                  'transactions': df,
+                  'reports': details}
+        lama.cache[cache_key] = cached
+
+        return evaluated
+
+    return _eval_report(cached['transactions'].drop(columns=['rowid']))[0]
+
+
+def report_details(lama: Financelama, report_name: str) -> pd.DataFrame:
+    """
+    All transactions which are part of a report.
+
+    Served from the index of reported transactions built by evaluate(), so the database is only
+    queried if it changed since the last evaluation.
+
+    Parameters
+    ----------
+    lama: Financelama
+        Reference to Financelama object which manages database connection.
+    report_name: str
+        Name of report
+
+    Returns
+    -------
+    pandas.DataFrame with all transactions of the report
+    """
+    evaluate(lama)
+    details = lama.cache['evaluate']['reports']
+
+    return details.loc[[report_name]] if report_name in details.index else details.iloc[0:0]
@@ -0,0 +1,166 @@
+"""
+Static export of dashboard figures without running the dashboard, e.g. for monthly reports.
+
+For each month a report with the figures of the dashboard (see visual.period_figures) is
+written as JSON (plotly figures) and as self-contained HTML page. The aggregate cube of each
+ledger is computed once, every report only gets its slice of the cube. Reports are rendered in
+parallel by a pool of worker processes.
+"""
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import plotly.io as pio
+import plotly.utils
+
+from financelama.config import export_history_months, export_workers
+from financelama.core import Financelama
+from financelama.evaluation import filter_cube, monthly_cube
+from financelama.instrumentation import add_stages, Instrumentation, logger, stage
+from financelama.ledgers import LedgerPool
+from financelama.visual import period_figures
+
+
+def report_months(cube: pd.DataFrame) -> list:
+    """ All months of cube as 'YYYY-MM' in chronological order. """
+    return sorted({m.strftime('%Y-%m') for m in cube.index.unique(level='month')})
+
+
+def report_figures(cube: pd.DataFrame, month: str) -> dict:
+    """
+    Figures of monthly report, see visual.period_figures().
+
+    Bar chart and trends show the export_history_months months until the month of the report,
+    pie charts the month itself.
+
+    Parameters
+    ----------
+    cube : pandas.DataFrame
+        Aggregate cube (see evaluation.monthly_cube), at least the months of the report
+    month : str
+        Month of report, e.g. '2024-01'
+
+    Returns
+    -------
+    Dict of plotly figures by id of their graph in the dashboard
+    """
+    end = pd.Timestamp(month) + pd.offsets.MonthEnd(0)
+    start = end - pd.offsets.MonthEnd(export_history_months - 1)
+
+    return period_figures(filter_cube(cube, start, end), month)
+
+
+def _report_html(title: str, figures: dict) -> str:
+    """ Self-contained HTML page with figures, plotly.js is embedded once. """
+    divs = [pio.to_html(figure, full_html=False, include_plotlyjs=i == 0, div_id=name)
+            for i, (name, figure) in enumerate(figures.items())]
+
+    return ('<!DOCTYPE html>\n<html>\n<head><meta charset="utf-8"><title>{0}</title></head>\n'
+            '<body>\n<h1>{0}</h1>\n{1}\n</body>\n</html>\n').format(title, '\n'.join(divs))
+
+
+def _render_report(cube: pd.DataFrame, month: str, path: str, title: str, html: bool):
+    """
+    Renders report of month and writes it to path (without extension). Runs in worker
+    processes of _export(), so that stages are recorded there and returned together with the
+    written files.
+    """
+    with Instrumentation() as instrumentation:
+        with stage('export_render', rows=cube.shape[0]):
+            figures = report_figures(cube, month)
+
+        with stage('export_write'):
+            files = [path + '.json']
+            with open(files[0], 'w') as f:
+                json.dump({'title': title, 'month': month,
+                           'figures': {n: fig.to_plotly_json() for n, fig in figures.items()}},
+                          f, cls=plotly.utils.PlotlyJSONEncoder)
+
+            if html:
+                files.append(path + '.html')
+                with open(files[1], 'w', encoding='utf-8') as f:
+                    f.write(_report_html(title, figures))
+
+    return files, instrumentation.records
+
+
+def _export(cubes: dict, path: str, months: list, html: bool, workers: int) -> list:
+    """ Renders reports of months for cubes by ledger (None for a single database without
+    subfolder) in parallel. Returns list of written files.
+    """
+    if workers is None:
+        workers = export_workers
+
+    jobs = []
+    for ledger, cube in cubes.items():
+        folder = path if ledger is None else os.path.join(path, ledger)
+        os.makedirs(folder, exist_ok=True)
+
+        for month in (report_months(cube) if months is None else months):
+            # Workers only get the months shown in the report
+            end = pd.Timestamp(month) + pd.offsets.MonthEnd(0)
+            extract = filter_cube(cube, end - pd.offsets.MonthEnd(export_history_months - 1),
+                                  end)
+            title = 'Financelama ' + month if ledger is None \
+                else 'Financelama {0} {1}'.format(ledger, month)
+            jobs.append((extract, month, os.path.join(folder, month), title, html))
+
+    files = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_report, *job) for job in jobs]
+
+        for future in futures:
+            report_files, stages = future.result()
+            add_stages(stages)
+            files += report_files
+
+    logger.info('[Export] Wrote %d reports of %d ledgers to %s', len(jobs), len(cubes), path)
+
+    return files
+
+
+def export_reports(lama: Financelama, path: str, months: list = None, html: bool = True,
+                   workers: int = None) -> list:
+    """
+    Writes monthly reports of database to folder, see module documentation.
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object for database access.
+    path : str
+        Folder to write reports to (created if not existing), files are named by month, e.g.
+        2024-01.json and 2024-01.html
+    months : list of str, optional
+        Months of reports, e.g. ['2024-01', '2024-02']. Default: all months with transactions
+    html : bool, optional
+        Write self-contained HTML pages besides JSON
+    workers : int, optional
+        Number of worker processes. Default: export_workers from config
+
+    Returns
+    -------
+    List of written files
+    """
+    return _export({None: monthly_cube(lama)}, path, months, html, workers)
+
+
+def export_ledgers(ledgers: LedgerPool, path: str, months: list = None, names: list = None,
+                   html: bool = True, workers: int = None) -> list:
+    """
+    Writes monthly reports of several ledgers to one subfolder per ledger, see export_reports().
+    Cubes of all ledgers are computed in parallel by the pool.
+
+    Parameters
+    ----------
+    ledgers : LedgerPool
+        Pool of ledgers
+    names : list of str, optional
+        Ledgers to export. Default: all ledgers of pool
+
+    Returns
+    -------
+    List of written files
+    """
+    return _export(ledgers.map(monthly_cube, names=names), path, months, html, workers)
@@ -1,73 +1,151 @@
 import pandas as pd
+import contextlib
+import csv
 import os.path
+import re
+from concurrent.futures import ProcessPoolExecutor
 
-from financelama.core import Financelama
+from financelama.core import Financelama, compute_fingerprints
 from financelama.config import *
+from financelama.instrumentation import add_stages, logger, Instrumentation, stage
+from financelama.matching import keyword_pattern, contains_any
+from financelama.rules import load_rules
+from financelama.snapshot import sync_snapshot
 
 
-def _drop_irrelevant_records(df: pd.DataFrame) -> pd.DataFrame:
-    balance = 0
-    counter = 0
-    for index, row in df.sort_values(by=['day']).iterrows():
-        for col, tags in dropping_keywords.items():
-            for t in tags:
-                if row[col].lower().find(t.lower()) != -1:
-                    # Print info message
-                    msg = row['orderer'] + '|' + row['info'] + '|' + str(row['value'])
-                    print("[Drop Transactions]" + msg)
+def _drop_irrelevant_records(df: pd.DataFrame, dropping: dict = None) -> pd.DataFrame:
+    """
+    Drops all transactions matching one of the dropping keywords (case insensitive).
+
+    For each configured column a single boolean mask is built from a compiled keyword pattern,
+    so that matching rows are dropped in one operation.
+
+    Parameters
+    ----------
+    df: pd.Dataframe
+        Financelama compatible dataframe
+    dropping: dict, optional
+        Keywords by column, e.g. drop rules of the database (see rules.load_rules). Default:
+        dropping_keywords from config
+
+    Returns
+    -------
+    Dataframe without dropped transactions
+    """
+    if dropping is None:
+        dropping = dropping_keywords
+
+    with stage('drop', rows=df.shape[0]):
+        mask = pd.Series(False, index=df.index)
+        for col, tags in dropping.items():
+            mask |= contains_any(df[col], keyword_pattern(tags))
+
+        balance = df.loc[mask, 'value'].sum()
+        counter = int(mask.sum())
+        logger.info('[Drop Transactions] Total count: %d with balance of %d EUR.', counter,
+                    round(balance))
+
+        return df.loc[~mask]
+
 
-                    # Drop row
-                    balance += row['value']
-                    counter += 1
-                    df.drop(index, inplace=True)
-    print('[Drop Transactions] Total count: ' + str(counter) + ' with balance of ' + str(
-        round(balance)) + ' EUR.')
+def _join_columns(file: pd.DataFrame, columns: list) -> pd.Series:
+    """ Joins file columns by a space, missing values are skipped. Rows missing in all columns
+    stay missing.
+    """
+    result = file[columns[0]].map(str, na_action='ignore')
+    for col in columns[1:]:
+        part = file[col].map(str, na_action='ignore')
+        result = (result + ' ' + part).fillna(result).fillna(part)
 
-    return df
+    return result
 
 
-def _map_columns(file: pd.DataFrame, mapping: list):
+def _map_columns(file: pd.DataFrame, mapping: dict) -> pd.DataFrame:
     """
-    Takes data frame with csv file and maps columns to Financelama columns. Not existing columns
-    will be filled with an empty string.
+    Takes data frame with csv file and maps columns to Financelama columns. Not mapped columns
+    are left empty (NaN).
 
     Parameters
     ----------
     file: pd.Dataframe
         Input dataframe read from csv file
-    mapping:
-        Ordered list with lists which specify which columns are to be mapped to the
-    corresponding Financelama columns. See financelama_columns for expected order.
+    mapping: dict
+        Financelama column -> list of file columns (see bank_formats in config). Several file
+        columns are joined by a space.
 
     Returns
     -------
     Financelama compatible dataframe
     """
-    if len(mapping) != len(financelama_columns):
-        print('Error  in _map_columns: Mismatching length  of mapping.')
-        print(mapping)
+    unknown = [col for col in mapping if col not in financelama_columns]
+    missing = [col for cols in mapping.values() for col in cols if col not in file.columns]
+    if unknown or missing:
+        raise ValueError('Mismatching mapping, unknown Financelama columns: {0}, missing file '
+                         'columns: {1}'.format(unknown, missing))
+
+    # Frame is built at once from mapped columns
+    columns = {}
+    for col in financelama_columns:
+        sources = mapping.get(col, [])
+        if len(sources) == 1:
+            columns[col] = file[sources[0]]
+        elif len(sources) > 1:
+            columns[col] = _join_columns(file, sources)
+
+    return pd.DataFrame(columns, index=file.index, columns=financelama_columns)
+
+
+def _insert_records(conn, df: pd.DataFrame) -> int:
+    """
+    Inserts prepared transactions, records already in the database (same fingerprint) are
+    ignored. Committing is left to the caller.
+
+    Parameters
+    ----------
+    conn:
+        Connection to SQLite3 database.
+    df: pd.Dataframe
+        Transactions as returned from _prepare_records().
 
-    res = pd.DataFrame(columns=financelama_columns)
+    Returns
+    -------
+    Integer counting how many records where actually added.
+    """
+    records = df.astype(object).where(df.notna(), None).values.tolist()
 
-    for i in range(len(financelama_columns)):
-        if len(mapping[i]) == 0:
-            continue
+    columns = ', '.join(df.columns)
+    placeholders = ', '.join(['?'] * len(df.columns))
 
-        res[financelama_columns[i]] = file[mapping[i][0]]
+    with stage('insert', rows=len(records)):
+        Financelama.bump_version(conn)
 
-        for j in range(1, len(mapping[i])):
-            # Append file column to Financelama column
-            res[financelama_columns[i]] = res[financelama_columns[i]].map(str) +\
-                                            ' ' +\
-                                            file[mapping[i][j]].map(str)
+        # New records are appended after the highest existing rowid
+        last_rowid = conn.execute('SELECT IFNULL(MAX(rowid), 0) FROM transactions').fetchone()[0]
+        conn.executemany('INSERT OR IGNORE INTO transactions (' + columns + ') VALUES (' +
+                         placeholders + ')', records)
 
-    return res
+        return conn.execute('SELECT COUNT(*) FROM transactions WHERE rowid > ?',
+                            [last_rowid]).fetchone()[0]
+
+
+def _prepare_records(df: pd.DataFrame, occurrences: dict = None) -> pd.DataFrame:
+    """ Adds fingerprint and converts timestamps to the same format as pandas.to_sql. See
+    compute_fingerprints() for occurrences.
+    """
+    with stage('dedup', rows=df.shape[0]):
+        df = df.assign(fingerprint=compute_fingerprints(df, occurrences))
+        df['day'] = df['day'].dt.strftime('%Y-%m-%d %H:%M:%S')
+
+        return df
 
 
 def _add_to_database(lama: Financelama, df: pd.DataFrame):
     """
     Adds dataframe to database without creating duplicates.
 
+    Duplicates are detected by the unique fingerprint of each transaction, so that only the new
+    records have to be processed and not the whole database.
+
     Parameters
     ----------
     lama: Financelama
@@ -79,138 +157,249 @@ def _add_to_database(lama: Financelama, df: pd.DataFrame):
     -------
     Integer counting how many records where actually added.
     """
+    with lama.transaction() as conn:
+        added_records = _insert_records(conn, _prepare_records(df))
+
+    sync_snapshot(lama)
+
+    return added_records
 
-    # Merge new file into existing database
-    sql_query = 'SELECT ' \
-                'day, info, orderer, reason, orderer_account, orderer_bank, value, ' \
-                'account FROM transactions'
-    initial_df, conn = lama.connect_database(sql_query)
 
-    # TODO duplicates are not recognized as missing value is in csv file empty ('') and in
-    #  database NULL or in python None
+def _detect_format(path: str) -> str:
+    """
+    Determines file format by matching the first line of the file with the signatures of
+    bank_formats. Only the first bytes of the file are read.
 
-    # Drop rows which are already in the database (avoiding duplicates)
-    df_merge = pd.merge(initial_df, df, how='outer', indicator=True)
-    new_data = df_merge.query('_merge == "right_only"').drop(['_merge'], 1)
-    new_data.to_sql('transactions', conn, if_exists='append', index=False)
+    Returns
+    -------
+    Name of format in bank_formats, e.g. 'dkb_giro', 'dkb_debit' or 'paypal'
+    """
+    with open(path, 'rb') as f:
+        head = f.read(detect_bytes)
 
-    conn.commit()
-    conn.close()
+    for name, bank_format in bank_formats.items():
+        lines = head.decode(bank_format['encoding'], errors='replace').splitlines()
+        if lines and re.match(bank_format['signature'], lines[0]):
+            return name
 
-    return new_data.shape[0]
+    raise ValueError('Unknown file format of ' + path)
 
 
-def read_file_dkb(lama: Financelama, path: str):
+def _parse_amounts(series: pd.Series, thousands: str = None, decimal: str = ',') -> pd.Series:
+    """ Parses amounts with given decimal separator (and optional thousands separator) to float.
     """
-    Load CSV file into database
+    series = series.astype(str)
+    if thousands is not None:
+        series = series.str.replace(thousands, '', regex=False)
+    if decimal != '.':
+        series = series.str.replace(decimal, '.', regex=False)
 
-    The file can be either a debit card or giro export from DKB.
-    Data is added to the database which is associated with that class instance.
-    Potential duplicates are filtered before adding data to database.
+    return pd.to_numeric(series)
+
+
+def _header_account(bank_format: dict, header: list) -> str:
+    """ Bank account of file, either fixed by format or read from header lines. """
+    account = bank_format['account']
+    if isinstance(account, str):
+        return account
+
+    line = next(csv.reader(header[account['line']:account['line'] + 1],
+                           delimiter=bank_format['delimiter']))
+    account_name = line[account['field']]
+    if account.get('split') is not None:
+        account_name = account_name.split(account['split'])[0]
+
+    return account_name
+
+
+def _parse_chunks(reader):
+    """ Yields chunks of CSV reader, parsing of each chunk is recorded as stage. """
+    while True:
+        with stage('parse') as record:
+            chunk = next(reader, None)
+            record['rows'] = 0 if chunk is None else chunk.shape[0]
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _iter_file(path: str, chunksize: int = None, format_name: str = None,
+               dropping: dict = None):
+    """
+    Parses CSV file of any format in bank_formats into Financelama compatible dataframes.
+
+    The file is read in a single pass, header with account data first and the transactions
+    afterwards.
 
     Parameters
     ----------
-    lama : Financelama
-        Reference to Financelama object which manages connection to database
     path : str
         CSV file to load
+    chunksize : int, optional
+        Number of transactions per yielded dataframe. If not given, the whole file is
+        yielded as one dataframe.
+    format_name : str, optional
+        Name of format in bank_formats. Default: detected by header of file
+    dropping : dict, optional
+        Keywords of transactions to drop by column, see _drop_irrelevant_records()
+
+    Yields
+    ------
+    pd.Dataframe
     """
+    bank_format = bank_formats[format_name or _detect_format(path)]
+    mapping = bank_format['mapping']
 
-    # Read bank account from first line to determine file type (giro or debit card)
-    first_line = pd.read_csv(
-        path, delimiter=';', encoding='ISO-8859-1', nrows=0,
-    )
+    with open(path, encoding=bank_format['encoding']) as f:
+        header = [f.readline() for _ in range(bank_format['skip_rows'])]
+        account = _header_account(bank_format, header)
 
-    # Read CSV file, skip Header with time and account data, MBS encoding (windows only) for
-    # special characters
-    csv_file = pd.read_csv(
-        path, delimiter=';', encoding='ISO-8859-1', skiprows=6,
-    )
+        # Keep amounts as string for parsing their number format
+        with stage('parse') as record:
+            csv_file = pd.read_csv(
+                f, delimiter=bank_format['delimiter'], dtype={mapping['value'][0]: str},
+                chunksize=chunksize,
+            )
+        if chunksize is None:
+            record['rows'] = csv_file.shape[0]
+            chunks = [csv_file]
+        else:
+            chunks = _parse_chunks(csv_file)
 
-    # DKB Giro account
-    if first_line.columns[0] == 'Kontonummer:':
-        df = _map_columns(csv_file, mapping_dkb_giro)
+        for chunk in chunks:
+            with stage('map_columns', rows=chunk.shape[0]):
+                df = _map_columns(chunk, mapping)
 
-        # Add column with bank account
-        df['account'] = first_line.columns[1].split(' / ')[0]
+            with stage('normalize', rows=df.shape[0]):
+                # Add column with bank account
+                df['account'] = account
 
-    # DKB Debit card
-    elif first_line.columns[0] == 'Kreditkarte:':
-        df = _map_columns(csv_file, mapping_dkb_debit)
+                # Parsing day to standard timestamp YYYY-MM-DD
+                df['day'] = pd.to_datetime(df['day'], format=bank_format['date_format'])
+                df['value'] = _parse_amounts(df['value'], bank_format['thousands'],
+                                             bank_format['decimal'])
 
-        # Add column with bank account
-        df['account'] = first_line.columns[1]
+                # Missing values are stored as 'None' in the database
+                df = df.fillna(value='None')
 
-    # Change decimal and thousand separator in value column
-    df['value'] = df['value'].apply(lambda x: x.replace('.', ''), )
-    df['value'] = df['value'].apply(lambda x: x.replace(',', '.'), )
+            yield _drop_irrelevant_records(df, dropping)
 
-    # Parsing day to standard timestamp YYYY-MM-DD
-    df['day'] = pd.to_datetime(df['day'], format='%d.%m.%Y')
-    df['value'] = pd.to_numeric(df['value'])
 
-    # Missing values are represented by '' which has to be filled by nan so
-    # that the merge operation is able to filter out duplicates correctly
-    df = df.fillna(value='None')
+def _parse(path: str, format_name: str = None, dropping: dict = None) -> pd.DataFrame:
+    """
+    Parses CSV file into Financelama compatible dataframe, see _iter_file().
+    """
+    return next(_iter_file(path, format_name=format_name, dropping=dropping))
 
-    df = _drop_irrelevant_records(df)
 
-    added_records = _add_to_database(lama, df)
+def _parse_file(path: str, dropping: dict = None) -> pd.DataFrame:
+    """
+    Parses CSV file of any supported format (detected by header) and prepares it for insertion.
+    Runs in worker processes of read_folder_dkb(), so that stages are recorded there and
+    returned together with the records.
+    """
+    with Instrumentation() as instrumentation:
+        df = _prepare_records(_parse(path, dropping=dropping))
 
-    # Print info message
-    msg = '[Reading file] Imported {0}/{2} transactions from {1}'
-    print(msg.format(added_records, path, df.shape[0]))
+    return df, instrumentation.records
 
 
-def read_file_paypal(lama: Financelama, path: str):
+def read_file(lama: Financelama, path: str, chunksize: int = None, format_name: str = None):
     """
-    Reads CSV file exported from PayPals Web UI into Financelama database.
+    Load CSV file of any format in bank_formats into database
+
+    Data is added to the database which is associated with that class instance.
+    Potential duplicates are filtered before adding data to database.
+    Transactions matching a drop rule of the database (see rules) are skipped.
 
     Parameters
     ----------
-    path : str
-        CSV file to load
     lama : Financelama
         Reference to Financelama object which manages connection to database
+    path : str
+        CSV file to load
+    chunksize : int, optional
+        Read and insert file in chunks of that many transactions, so that memory usage stays
+        flat for very large files. If not given, the whole file is read at once.
+    format_name : str, optional
+        Name of format in bank_formats. Default: detected by header of file
+
+    Returns
+    -------
+    Integer counting how many records where actually added.
     """
+    added_records = 0
+    total_records = 0
+    occurrences = {}
+    dropping = load_rules(lama)['dropping']
+    with lama.transaction() as conn:
+        for df in _iter_file(path, chunksize, format_name, dropping):
+            added_records += _insert_records(conn, _prepare_records(df, occurrences))
+            total_records += df.shape[0]
 
-    # Read CSV file, skip Header with time and account data, MBS encoding (windows only) for
-    # special characters
-    csv_file = pd.read_csv(
-        path, delimiter=',', encoding='ISO-8859-1',
-    )
+    sync_snapshot(lama)
 
-    df = _map_columns(csv_file, mapping_paypal)
+    # Print info message
+    logger.info('[Reading file] Imported %d/%d transactions from %s', added_records,
+                total_records, path)
 
-    # Add column with bank account
-    df['account'] = 'PayPal'
+    return added_records
+
+
+def read_file_dkb(lama: Financelama, path: str, chunksize: int = None):
+    """
+    Load CSV file into database
+
+    The file can be either a debit card or giro export from DKB, see read_file().
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object which manages connection to database
+    path : str
+        CSV file to load
+    chunksize : int, optional
+        Read and insert file in chunks of that many transactions, so that memory usage stays
+        flat for very large files. If not given, the whole file is read at once.
 
-    # Change decimal and thousand separator in value column
-    df['value'] = df['value'].apply(lambda x: x.replace(',', '.'), )
+    Returns
+    -------
+    Integer counting how many records where actually added.
+    """
+    format_name = _detect_format(path)
+    if format_name not in ('dkb_giro', 'dkb_debit'):
+        raise ValueError('Unknown file format of ' + path)
 
-    # Parsing day to standard timestamp YYYY-MM-DD
-    df['day'] = pd.to_datetime(df['day'], format='%d.%m.%Y')
-    df['value'] = pd.to_numeric(df['value'])
+    return read_file(lama, path, chunksize, format_name)
 
-    # Missing values are represented by '' which has to be filled by nan so
-    # that the merge operation is able to filter out duplicates correctly
-    df = df.fillna(value='None')
 
-    df = _drop_irrelevant_records(df)
+def read_file_paypal(lama: Financelama, path: str):
+    """
+    Reads CSV file exported from PayPals Web UI into Financelama database.
 
-    added_records = _add_to_database(lama, df)
+    Parameters
+    ----------
+    path : str
+        CSV file to load
+    lama : Financelama
+        Reference to Financelama object which manages connection to database
 
-    # Print info message
-    msg = '[Reading file] Imported {0}/{2} transactions from {1}'
-    print(msg.format(added_records, path, df.shape[0]))
+    Returns
+    -------
+    Integer counting how many records where actually added.
+    """
+    return read_file(lama, path, format_name='paypal')
 
 
-def read_folder_dkb(lama: Financelama, path: str):
+def read_folder_dkb(lama: Financelama, path: str, workers: int = None,
+                    executor: ProcessPoolExecutor = None) -> list:
     """
-    Load CSV file from folder into database
+    Load CSV files from folder into database
 
-    Convenience function to load several files into database. read_file() is
-    invoked for each file.
+    Convenience function to load several files into database. Files are parsed in parallel by
+    a pool of worker processes, the file format (DKB giro, DKB debit card or PayPal) is detected
+    by the header of each file. Files which can't be parsed are skipped. When all files are
+    parsed, they are written to the database by a single writer within one transaction.
 
     Parameters
     ----------
@@ -218,13 +407,62 @@ def read_folder_dkb(lama: Financelama, path: str):
         Reference to Financelama object which manages connection to database
     path : str
          Folder containing several compatible CSV files
+    workers : int, optional
+        Number of worker processes. Default: import_workers from config
+    executor : ProcessPoolExecutor, optional
+        Existing pool of worker processes to parse files with, e.g. shared by all databases of a
+        ledgers.LedgerPool (workers is ignored then). Default: new pool for this import
+
+    Returns
+    -------
+    List of dicts with 'file', 'imported' and 'skipped' (duplicates) row count for each file
     """
+    if workers is None:
+        workers = import_workers
+
     # Get file list of folder
-    files = [f for f in os.listdir(path) if f.endswith('.csv')]
-
-    for f in files:
-        # try:
-        read_file_dkb(lama, (path + f))
-        # except:
-        #    print('Error while reading file: ' + f + ' in ' + path)
-        #    print(sys.exc_info()[0])
+    files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith('.csv'))
+
+    summary = []
+    dropping = load_rules(lama)['dropping']
+
+    # Shared pool is left running
+    if executor is None:
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = contextlib.nullcontext(executor)
+
+    # Files are parsed before the write lock is taken, so that other writers aren't blocked
+    parsed = []
+    with pool as executor:
+        futures = [executor.submit(_parse_file, f, dropping) for f in files]
+
+        # Results are kept in order of the file list, independent of worker completion
+        for f, future in zip(files, futures):
+            try:
+                df, stages = future.result()
+            except Exception as e:
+                logger.warning('[Reading folder] Skipped file %s: %s', f,
+                               str(e) or type(e).__name__)
+                continue
+            add_stages(stages)
+            parsed.append((f, df))
+
+    with lama.transaction() as conn:
+        for f, df in parsed:
+            added_records = _insert_records(conn, df)
+            summary.append({'file': f,
+                            'imported': added_records,
+                            'skipped': df.shape[0] - added_records})
+
+    sync_snapshot(lama)
+
+    # Print info message
+    for s in summary:
+        logger.info('[Reading folder] Imported %d/%d transactions from %s', s['imported'],
+                    s['imported'] + s['skipped'], s['file'])
+    logger.info('[Reading folder] Total: imported %d, skipped %d transactions from %d files',
+                sum(s['imported'] for s in summary), sum(s['skipped'] for s in summary),
+                len(summary))
+
+    return summary
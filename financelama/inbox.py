@@ -0,0 +1,220 @@
+"""
+Background import of CSV files dropped into an inbox folder.
+
+A scanner thread polls the inbox and queues files whose size and modification time didn't change
+for the debounce time (i.e. files which are completely written). A worker thread imports queued
+files one after another, categorizes the new transactions and notifies listeners, e.g. the
+dashboard for refreshing its caches. Imported files are moved to the subfolder 'imported',
+files which couldn't be imported to 'failed'.
+"""
+import collections
+import os
+import queue
+import shutil
+import threading
+import time
+
+from financelama.config import inbox_debounce_seconds, inbox_latency_window, inbox_poll_seconds
+from financelama.core import Financelama
+from financelama.file_import import read_file
+from financelama.instrumentation import logger
+from financelama.process import categorize
+
+
+class InboxWatcher:
+    """
+    Watches inbox folder and imports new CSV files in the background.
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object which manages database connection.
+    path : str
+        Inbox folder, created if not existing
+    poll_seconds : float, optional
+        Interval of scanning the inbox. Default: inbox_poll_seconds from config
+    debounce_seconds : float, optional
+        Time a file has to stay unchanged before it's imported. Default: inbox_debounce_seconds
+        from config
+    fuzzy : bool, optional
+        Categorize new transactions by clusters of similar orderers (see process.categorize)
+
+    Examples
+    --------
+    with InboxWatcher(lama, 'inbox/') as watcher:
+        watcher.subscribe(lambda result: print(result))
+        ...
+    """
+
+    def __init__(self, lama: Financelama, path: str, poll_seconds: float = None,
+                 debounce_seconds: float = None, fuzzy: bool = False):
+        self.lama = lama
+        self.path = path
+        self.poll_seconds = inbox_poll_seconds if poll_seconds is None else poll_seconds
+        self.debounce_seconds = inbox_debounce_seconds if debounce_seconds is None \
+            else debounce_seconds
+        self.fuzzy = fuzzy
+
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._threads = []
+        self._listeners = []
+
+        # Files seen by scanner: path -> (size, mtime, first time of this state)
+        self._pending = {}
+        self._queued = set()
+
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=inbox_latency_window)
+        self._counts = {'imported_files': 0, 'failed_files': 0, 'imported_transactions': 0}
+
+    def subscribe(self, listener):
+        """ Registers function which is called from the worker thread after import and
+        categorization of each file with a dict of file, imported (transactions), error (None if
+        successful), seconds (import and categorization) and latency (seconds since detection).
+        """
+        self._listeners.append(listener)
+
+    def start(self):
+        """ Starts scanner and worker thread. """
+        for folder in ['', 'imported', 'failed']:
+            os.makedirs(os.path.join(self.path, folder), exist_ok=True)
+
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._scan_loop, name='inbox-scanner',
+                                          daemon=True),
+                         threading.Thread(target=self._work_loop, name='inbox-worker',
+                                          daemon=True)]
+        for t in self._threads:
+            t.start()
+        logger.info('[Inbox] Watching %s', self.path)
+
+    def stop(self, timeout: float = None):
+        """ Stops threads after the file currently imported. """
+        self._stop.set()
+        self._queue.put(None)
+        for t in self._threads:
+            t.join(timeout)
+        self._threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def scan(self):
+        """ Scans inbox once and queues files which didn't change for the debounce time. """
+        now = time.monotonic()
+        seen = set()
+
+        for entry in os.scandir(self.path):
+            if not entry.is_file() or not entry.name.lower().endswith('.csv') or \
+                    entry.path in self._queued:
+                continue
+            seen.add(entry.path)
+
+            stat = entry.stat()
+            state = (stat.st_size, stat.st_mtime)
+            previous = self._pending.get(entry.path)
+            if previous is None or previous[:2] != state:
+                self._pending[entry.path] = state + (now,)
+            elif now - previous[2] >= self.debounce_seconds:
+                # Latency is measured from the first time the final state was seen
+                del self._pending[entry.path]
+                self._queued.add(entry.path)
+                self._queue.put((entry.path, previous[2]))
+
+        # Forget files which were removed before being queued
+        for path in set(self._pending) - seen:
+            del self._pending[path]
+
+    def _scan_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.scan()
+            except OSError as e:
+                logger.warning('[Inbox] Scanning failed: %s', e)
+            self._stop.wait(self.poll_seconds)
+
+    def _work_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None or self._stop.is_set():
+                return
+            self._process(*item)
+
+    def _process(self, path: str, detected: float):
+        start = time.monotonic()
+        result = {'file': path, 'imported': 0, 'error': None}
+        try:
+            result['imported'] = read_file(self.lama, path)
+            if result['imported'] > 0:
+                categorize(self.lama, fuzzy=self.fuzzy)
+            target = 'imported'
+        except Exception as e:
+            # Any failure only affects this file, the worker keeps running
+            result['error'] = str(e) or type(e).__name__
+            target = 'failed'
+            logger.warning('[Inbox] Failed to import %s: %s', path, e, exc_info=True)
+
+        # Files which can't be moved stay queued, so that they aren't imported again
+        try:
+            shutil.move(path, self._target_path(path, target))
+            self._queued.discard(path)
+        except OSError as e:
+            logger.warning('[Inbox] Failed to move %s: %s', path, e)
+
+        end = time.monotonic()
+        result['seconds'] = end - start
+        result['latency'] = end - detected
+
+        with self._lock:
+            self._latencies.append(result['latency'])
+            if result['error'] is None:
+                self._counts['imported_files'] += 1
+                self._counts['imported_transactions'] += result['imported']
+            else:
+                self._counts['failed_files'] += 1
+
+        logger.info('[Inbox] %s in %.2f s (latency %.2f s, queue depth %d)',
+                    os.path.basename(path), result['seconds'], result['latency'],
+                    self._queue.qsize())
+
+        for listener in self._listeners:
+            try:
+                listener(result)
+            except Exception as e:
+                logger.warning('[Inbox] Listener failed: %s', e)
+
+    def _target_path(self, path: str, folder: str) -> str:
+        """ Path within subfolder, files of the same name are not overwritten. """
+        target = os.path.join(self.path, folder, os.path.basename(path))
+        if os.path.exists(target):
+            name, ext = os.path.splitext(target)
+            target = name + time.strftime('_%Y%m%d_%H%M%S') + ext
+
+        return target
+
+    def stats(self) -> dict:
+        """
+        Current state of the service.
+
+        Returns
+        -------
+        Dict with queue_depth (files waiting for import), pending (files waiting for debounce),
+        imported_files, failed_files, imported_transactions, last_latency and mean_latency
+        (seconds from detection of a complete file until import and categorization are done,
+        over the last inbox_latency_window files)
+        """
+        with self._lock:
+            latencies = list(self._latencies)
+            stats = dict(self._counts)
+
+        stats['queue_depth'] = self._queue.qsize()
+        stats['pending'] = len(self._pending)
+        stats['last_latency'] = latencies[-1] if latencies else None
+        stats['mean_latency'] = sum(latencies) / len(latencies) if latencies else None
+
+        return stats
@@ -0,0 +1,272 @@
+"""
+Instrumentation of processing stages (parse, map_columns, normalize, drop, dedup, insert,
+categorize, evaluate, figure_build).
+
+Stages are recorded with wall time, row count and memory only while an Instrumentation is
+active, otherwise stage() does nothing but yield a throw-away record. Recorded stages are passed
+to sinks when the instrumentation ends, e.g.
+
+    with Instrumentation([LogSink(), JsonSink('stages.json')]):
+        read_folder_dkb(lama, 'data/')
+        categorize(lama)
+"""
+import contextlib
+import cProfile
+import json
+import logging
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+from financelama.config import log_rate_limit
+
+logger = logging.getLogger('financelama')
+
+# Instrumentation collecting stages of all threads, None if disabled
+_active = None
+
+# Open stages of current thread, used for peak memory of nested stages
+_local = threading.local()
+
+
+def configure_logging(level=logging.INFO):
+    """ Prints log messages of given level and above to stderr, e.g. for scripts and the CLI. """
+    logging.basicConfig(level=level, format='%(message)s')
+
+
+class _RateLimitedLog:
+    """ Logs at most limit messages, further messages are only counted and summarized by
+    flush().
+    """
+
+    def __init__(self, level: int, limit: int):
+        self.level = level
+        self.limit = limit
+        self.count = 0
+
+    def __call__(self, msg: str, *args):
+        self.count += 1
+        if self.count <= self.limit:
+            logger.log(self.level, msg, *args)
+
+    def flush(self):
+        if self.count > self.limit:
+            logger.log(self.level, '... %d further messages suppressed', self.count - self.limit)
+        self.count = 0
+
+
+def rate_limited(level=logging.DEBUG, limit: int = None) -> _RateLimitedLog:
+    """
+    Logger for messages per transaction, only the first limit messages are logged. Call flush()
+    of the returned object afterwards for logging the number of suppressed messages.
+
+    Parameters
+    ----------
+    level : int, optional
+        Log level of messages. Default: logging.DEBUG
+    limit : int, optional
+        Maximum number of logged messages. Default: log_rate_limit from config
+    """
+    return _RateLimitedLog(level, log_rate_limit if limit is None else limit)
+
+
+def _max_rss_kib():
+    """ Peak resident memory of process (KiB), None if not available. """
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+@contextlib.contextmanager
+def stage(name: str, rows: int = None):
+    """
+    Records wall time, row count and memory of the enclosed code as stage name.
+
+    Yields
+    ------
+    dict
+        Record of stage, set 'rows' if the row count is known at the end of the stage only.
+        Peak memory is recorded as 'peak_bytes' (increase of memory allocated by Python during
+        stage, only if tracemalloc is tracing) and 'max_rss_kib' (peak of process).
+    """
+    record = {'stage': name, 'rows': rows}
+    instrumentation = _active
+    if instrumentation is None:
+        yield record
+        return
+
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        # Peak so far belongs to open stages, restart peak for this stage
+        current, peak = tracemalloc.get_traced_memory()
+        for frame in stack:
+            frame['peak'] = max(frame['peak'], peak)
+        tracemalloc.reset_peak()
+    frame = {'start_bytes': tracemalloc.get_traced_memory()[0] if tracing else 0, 'peak': 0}
+    stack.append(frame)
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record['seconds'] = time.perf_counter() - start
+        stack.pop()
+
+        if tracing:
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            for parent in stack:
+                parent['peak'] = max(parent['peak'], peak)
+            record['peak_bytes'] = peak - frame['start_bytes']
+        record['max_rss_kib'] = _max_rss_kib()
+
+        instrumentation.records.append(record)
+
+
+def add_stages(records: list):
+    """ Adds stages recorded by another process (e.g. import workers) to the active
+    instrumentation.
+    """
+    if _active is not None:
+        _active.records.extend(records)
+
+
+class Instrumentation:
+    """
+    Collects stages while active (with statement) and passes them to sinks at the end.
+
+    Parameters
+    ----------
+    sinks : list, optional
+        Objects with optional methods start() and finish(instrumentation), e.g. LogSink,
+        JsonSink, ProfileSink and TracemallocSink. Without sinks, stages are only collected in
+        records.
+    """
+    records: list
+    seconds: float
+
+    def __init__(self, sinks: list = None):
+        self.sinks = sinks or []
+        self.records = []
+        self.seconds = None
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        global _active
+        for sink in self.sinks:
+            if hasattr(sink, 'start'):
+                sink.start()
+
+        self._previous = _active
+        _active = self
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active
+        self.seconds = time.perf_counter() - self._start
+        _active = self._previous
+
+        for sink in reversed(self.sinks):
+            if hasattr(sink, 'finish'):
+                sink.finish(self)
+
+    def summary(self) -> list:
+        """
+        Stages aggregated by name in order of first occurrence.
+
+        Returns
+        -------
+        List of dicts with stage, calls, seconds, rows and peak_bytes (maximum)
+        """
+        stages = {}
+        for r in self.records:
+            s = stages.setdefault(r['stage'], {'stage': r['stage'], 'calls': 0, 'seconds': 0.0,
+                                               'rows': 0, 'peak_bytes': None})
+            s['calls'] += 1
+            s['seconds'] += r['seconds']
+            s['rows'] += r['rows'] or 0
+            if r.get('peak_bytes') is not None:
+                s['peak_bytes'] = max(s['peak_bytes'] or 0, r['peak_bytes'])
+
+        return list(stages.values())
+
+
+class LogSink:
+    """ Logs summary of stages (see Instrumentation.summary()). """
+
+    def __init__(self, level=logging.INFO):
+        self.level = level
+
+    def finish(self, instrumentation: Instrumentation):
+        for s in instrumentation.summary():
+            msg = '[Stage] %-12s %8.3f s %10d rows %4d calls'
+            args = [s['stage'], s['seconds'], s['rows'], s['calls']]
+            if s['peak_bytes'] is not None:
+                msg += ' %8.1f MiB peak'
+                args.append(s['peak_bytes'] / 2 ** 20)
+            logger.log(self.level, msg, *args)
+        logger.log(self.level, '[Stage] total        %8.3f s', instrumentation.seconds)
+
+
+class JsonSink:
+    """ Writes all recorded stages and their summary to JSON file. """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def finish(self, instrumentation: Instrumentation):
+        with open(self.path, 'w') as f:
+            json.dump({'seconds': instrumentation.seconds,
+                       'summary': instrumentation.summary(),
+                       'stages': instrumentation.records}, f, indent=2)
+
+
+class ProfileSink:
+    """ Profiles all code while instrumentation is active with cProfile and dumps statistics to
+    file (readable with pstats or snakeviz).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._profile = None
+
+    def start(self):
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def finish(self, instrumentation: Instrumentation):
+        self._profile.disable()
+        self._profile.dump_stats(self.path)
+
+
+class TracemallocSink:
+    """ Traces memory allocations while instrumentation is active, which enables peak memory per
+    stage, and dumps snapshot of allocations at the end to file (readable with
+    tracemalloc.Snapshot.load).
+    """
+
+    def __init__(self, path: str = None, frames: int = 1):
+        self.path = path
+        self.frames = frames
+        self._started = False
+
+    def start(self):
+        self._started = not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start(self.frames)
+
+    def finish(self, instrumentation: Instrumentation):
+        if self.path is not None:
+            tracemalloc.take_snapshot().dump(self.path)
+        if self._started:
+            tracemalloc.stop()
@@ -0,0 +1,275 @@
+"""
+Several ledgers (databases) served from one process.
+
+Each ledger, e.g. the transactions of one household, is a database of its own which is opened on
+first use as a Financelama instance with its own connections and caches, so ledgers never see
+each other's data. At most ledger_max_open ledgers are kept open, the least recently used ones
+which are not in use are closed and reopened on demand. Jobs of all ledgers (imports, evaluation)
+share one pool of threads, files of imported folders are parsed by one shared pool of worker
+processes.
+"""
+import collections
+import contextlib
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from financelama.config import import_workers, ledger_max_open, ledger_workers
+from financelama.core import Financelama
+from financelama.file_import import read_folder_dkb
+from financelama.instrumentation import logger, stage
+
+# Names of ledgers are used as file names of databases and snapshots
+ledger_name_pattern = re.compile(r'^[\w-]+$')
+
+
+class LedgerPool:
+    """
+    Manages databases of several ledgers, see module documentation.
+
+    Parameters
+    ----------
+    ledgers : dict, optional
+        Path of database (either existing or not) by name of ledger
+    max_open : int, optional
+        Number of ledgers kept open. Default: ledger_max_open from config
+    workers : int, optional
+        Number of threads running jobs of all ledgers. Default: ledger_workers from config
+    path_snapshots : str, optional
+        Folder with columnar snapshots of all ledgers, one subfolder per ledger (see
+        Financelama). Default: None (no snapshots)
+
+    Examples
+    --------
+    with LedgerPool.from_folder('ledgers/') as pool:
+        pool.import_folder('household', 'data/').result()
+        with pool.ledger('household') as lama:
+            categorize(lama)
+        cubes = pool.map(monthly_cube)
+    """
+
+    def __init__(self, ledgers: dict = None, max_open: int = None, workers: int = None,
+                 path_snapshots: str = None):
+        self.max_open = ledger_max_open if max_open is None else max_open
+        self.workers = ledger_workers if workers is None else workers
+        self.path_snapshots = path_snapshots
+
+        # Open ledgers in order of use (least recently used first) and number of their users
+        self._paths = {}
+        self._open = collections.OrderedDict()
+        self._users = collections.Counter()
+        self._lock = threading.RLock()
+
+        # Ledgers being opened outside of the lock, set when done
+        self._opening = {}
+
+        # Worker pools are started on first use
+        self._executor = None
+        self._parse_executor = None
+
+        self._counts = {'opened': 0, 'evicted': 0, 'hits': 0}
+
+        for name, path in (ledgers or {}).items():
+            self.add(name, path)
+
+    @classmethod
+    def from_folder(cls, path: str, **kwargs):
+        """ Pool of all databases (*.db) in folder, ledgers are named by file name. Further
+        arguments are passed to LedgerPool().
+        """
+        pool = cls(**kwargs)
+        for f in sorted(os.listdir(path)):
+            if f.endswith('.db'):
+                pool.add(f[:-len('.db')], os.path.join(path, f))
+
+        return pool
+
+    def add(self, name: str, path: str):
+        """ Adds ledger with database at path (either existing or not), opened on first use. """
+        if not ledger_name_pattern.match(name):
+            raise ValueError('Invalid name of ledger: ' + name)
+
+        with self._lock:
+            if name in self._paths:
+                raise ValueError('Ledger exists already: ' + name)
+            self._paths[name] = path
+
+    def names(self) -> list:
+        """ Names of all ledgers in alphabetical order. """
+        with self._lock:
+            return sorted(self._paths)
+
+    @contextlib.contextmanager
+    def ledger(self, name: str):
+        """
+        Context manager for using ledger, which is opened if necessary and kept open until the
+        block is left.
+
+        Yields
+        ------
+        Financelama
+        """
+        lama = self._acquire(name)
+        try:
+            yield lama
+        finally:
+            self._release(name)
+
+    def _acquire(self, name: str) -> Financelama:
+        while True:
+            with self._lock:
+                if name not in self._paths:
+                    raise ValueError('Unknown ledger: ' + str(name))
+
+                lama = self._open.get(name)
+                if lama is not None:
+                    self._open.move_to_end(name)
+                    self._counts['hits'] += 1
+                    self._users[name] += 1
+                    self._evict()
+                    return lama
+
+                # First user opens the ledger, others wait for it
+                opened = self._opening.get(name)
+                if opened is None:
+                    opened = self._opening[name] = threading.Event()
+                    path = self._paths[name]
+                    break
+            opened.wait()
+
+        # Schema creation and migrations of one ledger don't block other ledgers
+        try:
+            with stage('ledger_open'):
+                path_snapshot = None if self.path_snapshots is None \
+                    else os.path.join(self.path_snapshots, name)
+                lama = Financelama(path, path_snapshot)
+        except BaseException:
+            with self._lock:
+                del self._opening[name]
+            opened.set()
+            raise
+
+        with self._lock:
+            del self._opening[name]
+            self._open[name] = lama
+            self._counts['opened'] += 1
+            self._users[name] += 1
+            self._evict()
+        opened.set()
+        logger.debug('[Ledgers] Opened %s', name)
+
+        return lama
+
+    def _release(self, name: str):
+        with self._lock:
+            self._users[name] -= 1
+            if self._users[name] <= 0:
+                del self._users[name]
+            self._evict()
+
+    def _evict(self):
+        """ Closes least recently used ledgers which are not in use until at most max_open
+        ledgers are open. Ledgers in use stay open, even if there are more.
+        """
+        idle = [name for name in self._open if name not in self._users]
+        for name in idle[:max(0, len(self._open) - self.max_open)]:
+            self._open.pop(name).close()
+            self._counts['evicted'] += 1
+            logger.debug('[Ledgers] Closed %s', name)
+
+    def submit(self, name: str, function, *args, **kwargs):
+        """
+        Runs function(lama, *args, **kwargs) with ledger in the shared pool of threads.
+
+        Returns
+        -------
+        concurrent.futures.Future of result
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix='ledger')
+            executor = self._executor
+
+        def job():
+            with self.ledger(name) as lama:
+                return function(lama, *args, **kwargs)
+
+        return executor.submit(job)
+
+    def map(self, function, *args, names: list = None, **kwargs) -> dict:
+        """
+        Runs function(lama, *args, **kwargs) for several ledgers in parallel, see submit().
+
+        Parameters
+        ----------
+        names : list of str, optional
+            Ledgers to run function for. Default: all ledgers
+
+        Returns
+        -------
+        Dict with result by name of ledger
+        """
+        futures = {name: self.submit(name, function, *args, **kwargs)
+                   for name in (self.names() if names is None else names)}
+
+        return {name: future.result() for name, future in futures.items()}
+
+    def parse_executor(self) -> ProcessPoolExecutor:
+        """ Pool of worker processes (import_workers from config) shared by imports of all
+        ledgers, see file_import.read_folder_dkb().
+        """
+        with self._lock:
+            if self._parse_executor is None:
+                self._parse_executor = ProcessPoolExecutor(max_workers=import_workers)
+
+            return self._parse_executor
+
+    def import_folder(self, name: str, path: str):
+        """
+        Imports folder of CSV files into ledger in the background, see
+        file_import.read_folder_dkb().
+
+        Returns
+        -------
+        concurrent.futures.Future of import summary
+        """
+        return self.submit(name, read_folder_dkb, path, executor=self.parse_executor())
+
+    def stats(self) -> dict:
+        """
+        Current state of the pool.
+
+        Returns
+        -------
+        Dict with ledgers (count), open and in_use (ledgers), opened and evicted (ledgers since
+        start) and hits (uses of ledgers which were open already)
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats['ledgers'] = len(self._paths)
+            stats['open'] = len(self._open)
+            stats['in_use'] = len(self._users)
+
+        return stats
+
+    def close(self):
+        """ Waits for running jobs, stops worker pools and closes all ledgers. """
+        with self._lock:
+            executors = [self._executor, self._parse_executor]
+            self._executor = self._parse_executor = None
+
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown()
+
+        with self._lock:
+            while self._open:
+                self._open.popitem(last=False)[1].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
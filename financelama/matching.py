@@ -0,0 +1,108 @@
+import re
+
+import pandas as pd
+
+
+def keyword_pattern(keywords: list) -> re.Pattern:
+    """
+    Compiles list of keywords into single alternation pattern.
+
+    Keywords are lower-cased and escaped, so the pattern has to be applied to lower-cased text
+    and matches if any keyword is a substring of it.
+
+    Parameters
+    ----------
+    keywords: list of str
+        Keywords to search for.
+
+    Returns
+    -------
+    Compiled regular expression
+    """
+    # Longer keywords first so that overlapping alternatives do not shadow each other
+    escaped = sorted({re.escape(k.lower()) for k in keywords}, key=len, reverse=True)
+
+    return re.compile('|'.join(escaped))
+
+
+def contains_any(series: pd.Series, pattern: re.Pattern) -> pd.Series:
+    """
+    Boolean mask of all entries of series containing at least one keyword of pattern.
+
+    Parameters
+    ----------
+    series: pd.Series
+        Text column to search in. Entries which are not strings never match.
+    pattern: re.Pattern
+        Pattern as returned from keyword_pattern().
+
+    Returns
+    -------
+    Boolean pd.Series with the same index as series
+    """
+    if pattern.pattern == '':
+        return pd.Series(False, index=series.index)
+
+    return series.str.lower().str.contains(pattern, na=False)
+
+
+def category_pattern(categories: dict) -> re.Pattern:
+    """
+    Compiles lookup table of categories into single pattern.
+
+    Every category becomes one lookahead branch followed by an empty marker group. Branches are
+    tried in order of the lookup table, so the first category with a matching keyword wins.
+
+    Parameters
+    ----------
+    categories: dict
+        Lookup table with category as key and list of keywords as value.
+
+    Returns
+    -------
+    Compiled regular expression with one group per category (in order of categories)
+    """
+    branches = []
+    for keywords in categories.values():
+        # Categories without keywords must never match, but still need their marker group
+        alternation = keyword_pattern(keywords).pattern if len(keywords) > 0 else '(?!)'
+        branches.append('(?=.*?(?:' + alternation + '))()')
+
+    return re.compile('^(?:' + '|'.join(branches) + ')', re.DOTALL)
+
+
+def classify(series: pd.Series, categories: dict, default: str = 'other',
+             pattern: re.Pattern = None) -> pd.Series:
+    """
+    Assigns category to each entry of series.
+
+    Parameters
+    ----------
+    series: pd.Series
+        Identifiers used for finding the category.
+    categories: dict
+        Lookup table with category as key and list of keywords as value.
+    default: str, optional
+        Fallback if no matching category is found. Default: 'other'
+    pattern: re.Pattern, optional
+        category_pattern(categories) compiled before, e.g. by rules.load_rules(). Compiled on
+        each call if not given.
+
+    Returns
+    -------
+    pd.Series with assigned categories and same index as series
+    """
+    if len(categories) == 0 or series.empty:
+        return pd.Series(default, index=series.index, dtype=object)
+
+    if pattern is None:
+        pattern = category_pattern(categories)
+
+    markers = series.str.lower().str.extract(pattern)
+    matched = markers.notna()
+
+    # Column position of first matching marker group is position of category in lookup table
+    names = pd.Series(list(categories.keys()), dtype=object)
+    result = names.reindex(matched.values.argmax(axis=1)).set_axis(series.index)
+
+    return result.where(matched.any(axis=1), default)
@@ -0,0 +1,218 @@
+"""
+Fuzzy normalization of orderers and persistent cache of their categories.
+
+Near-duplicate orderers (typos, umlauts, legal forms, numbers of branches) are clustered with
+textdistance. Candidate pairs are found by an index of character trigrams, so only orderers
+sharing a considerable part of their trigrams are compared instead of all pairs. Each orderer
+is mapped to the canonical name of its cluster and a category, which is stored in the table
+orderer_cache. Only orderers not seen before have to be clustered and classified.
+"""
+import collections
+import hashlib
+
+import pandas as pd
+import textdistance
+
+from financelama.config import orderer_max_block, orderer_min_overlap, orderer_similarity, \
+    orderer_stopwords
+from financelama.core import Financelama
+from financelama.instrumentation import stage
+from financelama.matching import classify
+
+_umlauts = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'ß': 'ss'})
+
+
+def normalize_orderer(series: pd.Series) -> pd.Series:
+    """
+    Normalizes orderers for clustering: lower case, umlauts replaced, only letters and without
+    legal forms and other orderer_stopwords (see config).
+
+    Returns
+    -------
+    pd.Series of normalized orderers, '' if nothing is left
+    """
+    normalized = series.fillna('').astype(str).str.lower().str.translate(_umlauts)
+    normalized = normalized.str.replace(r'[^a-z]+', ' ', regex=True)
+    if orderer_stopwords:
+        normalized = normalized.str.replace(
+            r'\b(?:' + '|'.join(orderer_stopwords) + r')\b', ' ', regex=True)
+
+    return normalized.str.split().str.join(' ')
+
+
+def _trigrams(name: str) -> set:
+    padded = '  ' + name + ' '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def cluster_orderers(names: list, weights: list = None, new: set = None) -> dict:
+    """
+    Clusters near-duplicate names.
+
+    Two names are candidates if they share at least orderer_min_overlap of the trigrams of the
+    shorter name, trigrams contained in more than orderer_max_block names are not used for
+    finding candidates. Candidates with normalized Levenshtein similarity of at least
+    orderer_similarity are in the same cluster.
+
+    Parameters
+    ----------
+    names : list of str
+        Distinct normalized names
+    weights : list of numbers, optional
+        Weight of each name (e.g. number of transactions), the name with the highest weight
+        becomes canonical name of its cluster. Default: all names equal
+    new : set of str, optional
+        If given, only pairs with at least one of these names are compared, e.g. for adding new
+        names to names which have been clustered before
+
+    Returns
+    -------
+    dict mapping each name to the canonical name of its cluster
+    """
+    if weights is None:
+        weights = [1] * len(names)
+
+    grams = [_trigrams(name) for name in names]
+    index = collections.defaultdict(list)
+    for i, g in enumerate(grams):
+        for gram in g:
+            index[gram].append(i)
+
+    # Union-find over names
+    parent = list(range(len(names)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    probe = [new is None or name in new for name in names]
+
+    for i, g in enumerate(grams):
+        shared = collections.Counter()
+        for gram in g:
+            block = index[gram]
+            if len(block) <= orderer_max_block:
+                shared.update(j for j in block if j > i and (probe[i] or probe[j]))
+
+        for j in shared:
+            # Common trigrams counted in blocks only find candidates, ignored trigrams count too
+            count = len(g & grams[j])
+            if count < orderer_min_overlap * min(len(g), len(grams[j])):
+                continue
+
+            # Cheap bounds of similarity: each edit changes length by at most one and destroys
+            # at most three trigrams
+            longest = max(len(names[i]), len(names[j]))
+            edits = int((1 - orderer_similarity) * longest)
+            if abs(len(names[i]) - len(names[j])) > edits or \
+                    count < max(len(g), len(grams[j])) - 3 * edits:
+                continue
+
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j and textdistance.levenshtein.normalized_similarity(
+                    names[i], names[j]) >= orderer_similarity:
+                parent[root_j] = root_i
+
+    # Canonical name is the heaviest (then shortest) name of each cluster
+    canonical = {}
+    for i in sorted(range(len(names)), key=lambda i: (-weights[i], len(names[i]), names[i])):
+        canonical.setdefault(find(i), names[i])
+
+    return {name: canonical[find(i)] for i, name in enumerate(names)}
+
+
+def _cache_key(categories: dict) -> str:
+    """ Key of settings the cache was built with, cache is rebuilt if they change. """
+    settings = repr((sorted(categories.items()), orderer_similarity, orderer_min_overlap,
+                     orderer_max_block, orderer_stopwords))
+    return hashlib.sha1(settings.encode('utf-8')).hexdigest()
+
+
+def _create_cache(conn, categories: dict):
+    """ Creates orderer_cache and clears it if it was built with other settings. """
+    conn.execute('CREATE TABLE IF NOT EXISTS orderer_cache ('
+                 'orderer TEXT PRIMARY KEY, canonical TEXT, category TEXT)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orderer_cache_canonical '
+                 'ON orderer_cache (canonical)')
+
+    key = conn.execute("SELECT value FROM lama_meta WHERE key = 'orderer_cache_key'").fetchone()
+    if key is None or key[0] != _cache_key(categories):
+        conn.execute('DELETE FROM orderer_cache')
+        conn.execute("INSERT OR REPLACE INTO lama_meta VALUES ('orderer_cache_key', ?)",
+                     [_cache_key(categories)])
+
+
+def orderer_categories(lama: Financelama, orderers: pd.Series, categories: dict,
+                       default: str = 'other') -> pd.DataFrame:
+    """
+    Canonical name and category of orderers, served from orderer_cache.
+
+    Orderers not in the cache are clustered together with the canonical names of the cache, so
+    that new variants of known orderers get the same canonical name and category. A new
+    cluster gets the category which most of its transactions are classified to by their
+    orderer (see matching.classify()).
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object for database access.
+    orderers : pd.Series
+        Orderer of each transaction
+    categories : dict
+        Lookup table of categories, see rules.load_rules()
+    default : str, optional
+        Category of orderers without match
+
+    Returns
+    -------
+    pandas.DataFrame with columns canonical and category, same index as orderers
+    """
+    with stage('orderers', rows=orderers.shape[0]), lama.transaction() as conn:
+        _create_cache(conn, categories)
+
+        counts = orderers.fillna('None').astype(str).value_counts()
+        cache = pd.read_sql('SELECT orderer, canonical, category FROM orderer_cache',
+                            conn).set_index('orderer')
+        new = counts[~counts.index.isin(cache.index)]
+
+        if len(new) > 0:
+            normalized = normalize_orderer(pd.Series(new.index, index=new.index))
+
+            # Canonical names of cache keep their identity by highest weight
+            known = cache.drop_duplicates('canonical').set_index('canonical')['category']
+            weights = pd.concat([new.groupby(normalized.values).sum(),
+                                 pd.Series(float('inf'), index=known.index)])
+            weights = weights.groupby(level=0).sum().drop('', errors='ignore')
+            clusters = cluster_orderers(weights.index.tolist(), weights.tolist(),
+                                        new=set(normalized) - set(known.index))
+
+            # Orderers without letters are kept as they are
+            canonical = normalized.map(clusters)
+            canonical = canonical.fillna(pd.Series(new.index, index=new.index))
+
+            # Category of known clusters, new clusters by majority of classified orderers
+            category = canonical.map(known)
+            unknown = category.isna()
+            if unknown.any():
+                classified = pd.DataFrame({
+                    'canonical': canonical[unknown],
+                    'category': classify(pd.Series(new.index, index=new.index)[unknown],
+                                         categories, default),
+                    'count': new[unknown]})
+                classified = classified[classified['category'] != default]
+                majority = classified.groupby(['canonical', 'category'])['count'].sum()
+                majority = majority.sort_values(ascending=False, kind='stable').reset_index()
+                majority = majority.drop_duplicates('canonical').set_index('canonical')
+                category[unknown] = canonical[unknown].map(majority['category']).fillna(default)
+
+            conn.executemany('INSERT INTO orderer_cache VALUES (?, ?, ?)',
+                             zip(new.index.tolist(), canonical.tolist(), category.tolist()))
+            cache = pd.concat([cache, pd.DataFrame({'canonical': canonical.values,
+                                                    'category': category.values},
+                                                   index=new.index)])
+
+    keys = orderers.fillna('None').astype(str)
+    return pd.DataFrame({'canonical': keys.map(cache['canonical']),
+                         'category': keys.map(cache['category'])}, index=orderers.index)
@@ -1,25 +1,21 @@
+import logging
+
+from financelama.config import default_categories, rowid_batch_size
 from financelama.core import Financelama
+from financelama.instrumentation import logger, rate_limited, stage
+from financelama.matching import classify
+from financelama.rules import load_rules, match_rules, rule_columns
+from financelama.snapshot import sync_snapshot
 
-categories = {
-    'supermarket': ['rewe', 'coop', 'edeka', 'lidl', 'netto', 'norma', 'frukt', 'ica', 'ecenter', 'aksa'],
-    'rent': ['miete', 'mieete', 'wohnung', 'etagenbeitrag'],
-    'entertainment': ['netflix', 'spotify', 'ticket', 'konzert', 'museum', 'filmstaden'],
-    'restaurant': ['restaurant', 'restaurant', 'frittenwerk', 'bar', 'cafe', 'qstockholm', 'mcdonalds', 'backwerk', 'burger king', 'Bosch etterem', 'Bierkasse'],
-    'traffic': ['db', 'deutschebahn', 'train', 'deutsche bahn', 'sj', 'sl', 'flixbus'],
-    'drugstore': ['dm', 'rossmann'],
-    'shopping': ['amzn', 'amazon', 'ebay', 'lindt', 'eddie baur', 'bergfreunde', 'mayersche'],
-    'car': ['tankstelle', 'doetsch station',],
-    'income': ['gehalt', 'lohn', 'stipendium', 'entgelt'],
-    'cash': ['bankomat', 'sparkasse', 'sparda-bank', 'postbank']
-}
+import pandas as pd
 
 
 def _get_category(identifier: str) -> str:
     """
     Get suitable category for identifier.
 
-    Finds suitable category for given identifier from look up table. If no
-    matching category is found, 'other' as fallback will be returned.
+    Finds suitable category for given identifier from default look up table (see config). If
+    no matching category is found, 'other' as fallback will be returned.
 
     Parameters
     ----------
@@ -30,91 +26,237 @@ def _get_category(identifier: str) -> str:
     -------
     category : str
     """
-    for category, keywords in categories.items():
-        # Check for each keyword
-        for k in keywords:
-            # Check if lower-case keyword is substring of lower-case identifier
-            if identifier.lower().find(k.lower()) != -1:
-                return category
-    # Default value if no category was found
-    return 'other'
+    return classify(pd.Series([identifier]), default_categories)[0]
 
 
-def categorize(lama: Financelama, all_entries=False):
+def _categorize_by_index(lama: Financelama, all_entries: bool, log) -> int:
+    """ Assigns categories in SQL, keywords are looked up in the full-text index. Returns
+    number of categorized transactions.
+    """
+    rules = load_rules(lama)
+    with lama.transaction() as conn:
+        lama.bump_version(conn)
+        if all_entries:
+            conn.execute('UPDATE transactions SET category = NULL, rule_id = NULL')
+        count = conn.execute('SELECT COUNT(*) FROM transactions '
+                             'WHERE category IS NULL').fetchone()[0]
+
+        # First category with a matching keyword wins like in classify(), within a category
+        # the first matching rule is recorded
+        for category, keywords in rules['categories'].items():
+            assigned = 0
+            for keyword in keywords:
+                keyword = keyword.lower()
+                condition, params = lama.search_condition([keyword], rule_columns)
+                assigned += conn.execute('UPDATE transactions SET category = ?, rule_id = ? '
+                                         'WHERE category IS NULL AND (' + condition + ')',
+                                         [category, rules['rule_ids'][(category, keyword)]] +
+                                         params).rowcount
+            log('[Categorize] %d TRANSACTIONS ASSIGNED TO %s', assigned, category)
+
+        assigned = conn.execute("UPDATE transactions SET category = 'other' "
+                                "WHERE category IS NULL").rowcount
+        log('[Categorize] %d TRANSACTIONS ASSIGNED TO other', assigned)
+
+    return count
+
+
+def categorize(lama: Financelama, all_entries=False, verbose=False, fuzzy=False,
+               use_index=False):
     """
     Add categories to rows in database according to 'orderer', 'info' and 'reason' column.
 
+    Categories are assigned by the rules stored in the database (see rules), which are compiled
+    once and applied to all rows at once. Results are written back within a single transaction,
+    together with the rule which assigned each category.
+
+    With fuzzy categorization, near-duplicate orderers (e.g. typos) are clustered and each
+    cluster gets a category, which is cached in the database (see orderers). Only orderers not
+    seen before have to be classified. The reason column is only used for transactions whose
+    orderer has no category.
+
+    With use_index, keywords are looked up in the full-text index of the database and only
+    matching transactions are updated, nothing is loaded into memory. Keywords have to be
+    contained in orderer or reason, a match across both (as with classify() on their
+    concatenation) isn't found.
+
     Parameters
     ----------
     lama : Financelama
         References to Financelama object for database access.
     all_entries : bool, optional
         Assigns categories to ALL rows neglecting existing assignments
+    verbose : bool, optional
+        Log info message for each categorized transaction (rate-limited, see log_rate_limit in
+        config)
+    fuzzy : bool, optional
+        Categorize by clusters of similar orderers
+    use_index : bool, optional
+        Match keywords by full-text index instead of in memory (ignored with fuzzy)
     """
+    if use_index and not fuzzy:
+        log = rate_limited(logging.INFO if verbose else logging.DEBUG)
+        with stage('categorize') as record:
+            record['rows'] = _categorize_by_index(lama, all_entries, log)
+        log.flush()
 
-    # Load database from file
-    if all_entries:
-        sql_query = 'SELECT rowid, info, orderer, reason FROM transactions'
-    else:
-        sql_query = 'SELECT rowid, info, orderer, reason FROM transactions WHERE category IS NULL'
-    df, conn = lama.connect_database(sql_query)
+        sync_snapshot(lama)
+        logger.info('[Categorize] Assigned categories to %d transactions', record['rows'])
+        return
+
+    with stage('categorize') as record:
+        # Load database from file
+        if all_entries:
+            sql_query = 'SELECT rowid, info, orderer, reason FROM transactions'
+        else:
+            sql_query = 'SELECT rowid, info, orderer, reason FROM transactions ' \
+                        'WHERE category IS NULL'
+        df = lama.connect_database(sql_query)[0]
+        record['rows'] = df.shape[0]
+
+        # Assign categories to all rows, clusters of orderers have no rule
+        rules = load_rules(lama)
+        if fuzzy:
+            # Clustering requires textdistance, which is only imported if needed
+            from financelama.orderers import orderer_categories
+
+            assigned_categories = orderer_categories(lama, df['orderer'],
+                                                     rules['categories'])['category']
+            assigned_rules = pd.Series(pd.NA, index=df.index, dtype='Int64')
+            other = assigned_categories == 'other'
+            matched = match_rules(rules, df.loc[other, 'orderer'] + df.loc[other, 'reason'])
+            assigned_categories[other] = matched['category']
+            assigned_rules[other] = matched['rule_id']
+        else:
+            matched = match_rules(rules, df['orderer'] + df['reason'])
+            assigned_categories, assigned_rules = matched['category'], matched['rule_id']
 
-    # Iterate over table and assign categories
-    cur = conn.cursor()
-    for index, row in df.iterrows():
-        concat = row['orderer'] + row['reason']
-        assigned_category = _get_category(concat)
-        cur.execute('UPDATE transactions SET category = ? WHERE _ROWID_ = ?',
-                    [assigned_category, row['rowid']])
+        with lama.transaction() as conn:
+            lama.bump_version(conn)
+            conn.executemany('UPDATE transactions SET category = ?, rule_id = ? WHERE _ROWID_ = ?',
+                             zip(assigned_categories.tolist(),
+                                 [None if pd.isna(r) else int(r) for r in assigned_rules],
+                                 df['rowid'].tolist()))
 
-        # Print info message
-        info_str = row['orderer'] + '|' + row['info'] + '|' + row['reason']
-        print('[Categorize] TRANSACTION ' + info_str.ljust(80)[
-                                            :80] + ' ASSIGNED TO ' + assigned_category)
+    sync_snapshot(lama)
 
-    conn.commit()
-    conn.close()
+    # Log info message
+    if verbose:
+        log = rate_limited(logging.INFO)
+        info_str = df['orderer'] + '|' + df['info'] + '|' + df['reason']
+        for s, c in zip(info_str, assigned_categories):
+            log('[Categorize] TRANSACTION %s ASSIGNED TO %s', s.ljust(80)[:80], c)
+        log.flush()
+    logger.info('[Categorize] Assigned categories to %d transactions', df.shape[0])
+
+
+def _report_selection(list_of_rowids=None, list_of_ranges=None, start=None, end=None,
+                      orderer: str = None, category: str = None):
+    """
+    Builds SQL conditions selecting transactions for modify_report().
+
+    Returns
+    -------
+    List of (condition, params) touples, one for each statement. Explicit rowids are split
+    into several statements to stay below the limit of SQL variables. Empty if nothing is
+    selected.
+    """
+    filters = []
+    params = []
+    if start is not None:
+        filters.append('day >= ?')
+        params.append(str(pd.Timestamp(start).normalize()))
+    if end is not None:
+        # End day is included
+        filters.append('day < ?')
+        params.append(str(pd.Timestamp(end).normalize() + pd.Timedelta(days=1)))
+    if orderer is not None:
+        filters.append('orderer LIKE ?')
+        params.append(orderer)
+    if category is not None:
+        filters.append('category = ?')
+        params.append(category)
+
+    # Rowids within a range are left to the range, so that no row is updated (and counted) twice
+    ranges = [(int(r[0]), int(r[1])) for r in list_of_ranges or []]
+    rowids = sorted(r for r in set(list_of_rowids or [])
+                    if not any(first <= r <= last for first, last in ranges))
+
+    selections = []
+    for i in range(0, len(rowids), rowid_batch_size):
+        batch = rowids[i:i + rowid_batch_size]
+        selections.append(('rowid IN (' + ', '.join(['?'] * len(batch)) + ')', batch))
+    if ranges:
+        selections.append((' OR '.join(['rowid BETWEEN ? AND ?'] * len(ranges)),
+                           [v for r in ranges for v in r]))
+
+    # Without rowids and ranges, filters select the rows on their own
+    if list_of_rowids is None and list_of_ranges is None and filters:
+        selections = [(None, [])]
+
+    statements = []
+    for selection, selection_params in selections:
+        conditions = filters if selection is None else ['(' + selection + ')'] + filters
+        statements.append((' AND '.join(conditions), selection_params + params))
+
+    return statements
 
 
 def modify_report(lama: Financelama, report_name: str,
                   list_of_rowids=None,
-                  list_of_ranges=None):
+                  list_of_ranges=None,
+                  start=None, end=None,
+                  orderer: str = None,
+                  category: str = None) -> int:
     """
     Modify report column in database for specified rows
 
-    Updates report column in database for all rows specified by rowid. All
-    transactions within the same report are handled as a single expense,
+    Updates report column in database for all rows specified by rowid, ranges of rowids or
+    filters. All transactions within the same report are handled as a single expense,
     for example holiday expenses can be summarized into one report.
     Note: The user has to make sure that new report name isn't used already.
 
+    Rows are selected by rowids and ranges, filters restrict this selection further. If only
+    filters are given, all matching rows are selected. All updates are done in SQL within a
+    single transaction.
+
     Parameters
     ----------
     lama : Financelama
         References to Financelama object for database access.
     report_name : str
-        Name of report
+        Name of report, None removes selected rows from their reports
     list_of_rowids : list of ints, optional
         RowIds to update
     list_of_ranges : list of int touples, optional
         Range of rowids will be updated with report_name. Both values are included.
+    start, end : date-like, optional
+        Only rows of this date range (both days included)
+    orderer : str, optional
+        Only rows with matching orderer, SQL LIKE pattern (case insensitive), e.g. '%hotel%'
+    category : str, optional
+        Only rows of this category
 
+    Returns
+    -------
+    Integer counting how many rows were updated.
     """
-    conn = lama.connect_database()[1]
-    cur = conn.cursor()
-
-    counter = 0
-    if list_of_rowids is not None:
-        for i in list_of_rowids:
-            cur.execute('UPDATE transactions SET report =  ? WHERE _ROWID_ = ?',
-                        [report_name, i])
-            counter += 1
-
-    if list_of_ranges is not None:
-        for i in list_of_ranges:
-            row_ids = list(range(i[0], i[1] + 1))
-            arg = list(zip([report_name] * len(row_ids), row_ids))
-            cur.executemany('UPDATE transactions SET report =  ? WHERE _ROWID_ = ?', arg)
-            counter += len(row_ids)
-
-    conn.commit()
-    conn.close()
+    statements = _report_selection(list_of_rowids, list_of_ranges, start, end, orderer,
+                                   category)
+
+    with lama.transaction() as conn:
+        lama.bump_version(conn)
+
+        counter = 0
+        for condition, params in statements:
+            counter += conn.execute('UPDATE transactions SET report = ? WHERE ' + condition,
+                                    [report_name] + params).rowcount
+
+    sync_snapshot(lama)
+
+    if report_name is None:
+        logger.info('[Report] Removed %d transactions from their reports', counter)
+    else:
+        logger.info('[Report] Assigned %d transactions to report %s', counter, report_name)
+
+    return counter
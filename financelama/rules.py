@@ -0,0 +1,311 @@
+"""
+Persistent rules for categorizing and dropping transactions.
+
+Rules are stored in table rules of the database, which is seeded with default_categories and
+dropping_keywords (see config) on creation. Each change of the rules increases the rules
+version. Compiled rules are cached for their version, so that running processes (e.g. dashboard
+and inbox) pick up changes made by others without restarting.
+
+Each categorized transaction records the rule which assigned its category in column rule_id.
+Changing a rule only reclassifies the transactions concerned: transactions containing the
+keyword of an added rule are looked up in the full-text index, transactions of a removed rule by
+their rule_id (or by keyword if they have none). Only if a change reorders categories, all
+transactions are reclassified.
+"""
+import sqlite3
+
+import pandas as pd
+
+from financelama.config import default_categories, dropping_keywords, financelama_columns
+from financelama.core import Financelama
+from financelama.instrumentation import logger, stage
+from financelama.matching import category_pattern, classify
+from financelama.snapshot import sync_snapshot
+
+# Kinds of rules: category rules have a category as target, drop rules a column
+rule_kinds = ['category', 'drop']
+
+# Text categorization rules are matched against, see process.categorize()
+rule_columns = ['orderer', 'reason']
+
+
+def _create_rules(conn):
+    """ Creates rules table and seeds it with default rules if not existing. """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'rules'").fetchone():
+        return
+
+    conn.execute('CREATE TABLE rules (rule_id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT, '
+                 'target TEXT, keyword TEXT, priority INTEGER, UNIQUE (kind, target, keyword))')
+    conn.execute("INSERT OR IGNORE INTO lama_meta VALUES ('rules_version', 0)")
+
+    rules = [('category', category, keyword, priority)
+             for priority, (category, keywords) in enumerate(default_categories.items())
+             for keyword in keywords]
+    rules += [('drop', column, keyword, 0)
+              for column, keywords in dropping_keywords.items() for keyword in keywords]
+    conn.executemany('INSERT OR IGNORE INTO rules (kind, target, keyword, priority) '
+                     'VALUES (?, ?, ?, ?)', rules)
+
+
+def _rules_version(conn) -> int:
+    """ Current rules version, None if rules table doesn't exist yet. """
+    version = conn.execute("SELECT value FROM lama_meta WHERE key = 'rules_version'").fetchone()
+    return None if version is None else version[0]
+
+
+def _compile(conn) -> dict:
+    """ Reads and compiles rules, see load_rules(). """
+    rules = pd.read_sql('SELECT rule_id, kind, target, keyword, priority FROM rules '
+                        'ORDER BY priority, rule_id', conn)
+
+    # Order of categories is order of their first rule
+    categories = {}
+    rule_ids = {}
+    for rule in rules[rules['kind'] == 'category'].itertuples():
+        categories.setdefault(rule.target, []).append(rule.keyword)
+        rule_ids.setdefault((rule.target, rule.keyword.lower()), rule.rule_id)
+
+    dropping = {}
+    for rule in rules[rules['kind'] == 'drop'].itertuples():
+        dropping.setdefault(rule.target, []).append(rule.keyword)
+
+    return {'version': _rules_version(conn),
+            'rules': rules,
+            'categories': categories,
+            'pattern': category_pattern(categories),
+            'rule_ids': rule_ids,
+            'dropping': dropping}
+
+
+def load_rules(lama: Financelama) -> dict:
+    """
+    Rules compiled for matching, cached for the current rules version.
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object for database access.
+
+    Returns
+    -------
+    Dict with
+        'version': rules version,
+        'rules': pandas.DataFrame with rule_id, kind, target, keyword and priority of all rules,
+        'categories': lookup table of categories (see matching.classify),
+        'pattern': compiled pattern of categories (see matching.category_pattern),
+        'rule_ids': rule_id by category and lower-cased keyword,
+        'dropping': keywords of drop rules by column (like dropping_keywords in config)
+    """
+    version = _rules_version(lama.connection())
+    if version is None:
+        with lama.transaction() as conn:
+            _create_rules(conn)
+        version = _rules_version(lama.connection())
+
+    cached = lama.cache.get('rules')
+    if cached is None or cached['version'] != version:
+        cached = _compile(lama.connection())
+        lama.cache['rules'] = cached
+
+    return cached
+
+
+def match_rules(rules: dict, series: pd.Series, default: str = 'other') -> pd.DataFrame:
+    """
+    Assigns category and rule to each entry of series.
+
+    The category is the first category with a matching keyword (see matching.classify), the
+    rule is the first matching rule of this category.
+
+    Parameters
+    ----------
+    rules : dict
+        Compiled rules, see load_rules()
+    series : pd.Series
+        Text to match, e.g. orderer and reason
+    default : str, optional
+        Category of entries without match, their rule_id is missing
+
+    Returns
+    -------
+    pandas.DataFrame with columns category and rule_id (Int64), same index as series
+    """
+    category = classify(series, rules['categories'], default, rules['pattern'])
+    rule_id = pd.Series(pd.NA, index=series.index, dtype='Int64')
+
+    # Only entries of a category are searched for its keywords, entries found are done
+    for name, text in series[category != default].str.lower().groupby(category):
+        for keyword in rules['categories'][name]:
+            if text.empty:
+                break
+            keyword = keyword.lower()
+            found = text.str.contains(keyword, regex=False, na=False)
+            rule_id[text.index[found]] = rules['rule_ids'][(name, keyword)]
+            text = text[~found]
+
+    return pd.DataFrame({'category': category, 'rule_id': rule_id})
+
+
+def _sql_values(series: pd.Series) -> list:
+    """ Values of series for SQL parameters, missing values become None. """
+    return [None if pd.isna(v) else v for v in series.astype(object)]
+
+
+def _reclassify(lama: Financelama, conn, rules: dict, condition: str, params: list) -> int:
+    """ Categorizes selected transactions again, only those which already have a category.
+    Returns number of transactions whose category or rule changed.
+    """
+    df = lama.connect_database('SELECT rowid, orderer, reason, category, rule_id '
+                               'FROM transactions WHERE category IS NOT NULL AND (' +
+                               condition + ')', params)[0]
+    matched = match_rules(rules, df['orderer'] + df['reason'])
+
+    changed = (matched['category'] != df['category']) | \
+        (matched['rule_id'].astype('float64').fillna(-1) != df['rule_id'].fillna(-1))
+    conn.executemany('UPDATE transactions SET category = ?, rule_id = ? WHERE _ROWID_ = ?',
+                     zip(matched.loc[changed, 'category'].tolist(),
+                         _sql_values(matched.loc[changed, 'rule_id']),
+                         df.loc[changed, 'rowid'].tolist()))
+
+    return int(changed.sum())
+
+
+def _order_changed(before: dict, after: dict) -> bool:
+    """ True if categories of both compiled rules are matched in different order. """
+    return [c for c in before['categories'] if c in after['categories']] != \
+        [c for c in after['categories'] if c in before['categories']]
+
+
+def _bump_rules_version(conn):
+    conn.execute("UPDATE lama_meta SET value = value + 1 WHERE key = 'rules_version'")
+
+
+def add_rule(lama: Financelama, target: str, keyword: str, kind: str = 'category',
+             priority: int = None) -> int:
+    """
+    Adds rule and reclassifies categorized transactions containing its keyword.
+
+    Transactions are looked up by the full-text index of orderer and reason, so only they are
+    read. Keywords spanning from orderer into reason are found by categorize() only. If the
+    priority changes the order of categories, all categorized transactions are reclassified.
+    Drop rules apply to files imported afterwards, transactions in the database are kept.
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object for database access.
+    target : str
+        Category of category rule or column of drop rule
+    keyword : str
+        Keyword (case insensitive)
+    kind : str, optional
+        'category' or 'drop'
+    priority : int, optional
+        Order of categories, lower priority is matched first. Default: priority of existing
+        rules of the category, after all categories for new categories
+
+    Returns
+    -------
+    rule_id of new rule
+    """
+    keyword = keyword.strip()
+    if kind not in rule_kinds:
+        raise ValueError('Unknown kind of rule: ' + str(kind))
+    if not keyword:
+        raise ValueError('Rule without keyword')
+    if kind == 'drop' and target not in financelama_columns:
+        raise ValueError('Unknown column of drop rule: ' + str(target))
+
+    load_rules(lama)
+    with stage('rules') as record, lama.transaction() as conn:
+        before = _compile(conn)
+        if priority is None:
+            priority = conn.execute(
+                'SELECT COALESCE((SELECT MIN(priority) FROM rules WHERE kind = ? AND target = ?), '
+                '(SELECT MAX(priority) + 1 FROM rules), 0)', [kind, target]).fetchone()[0]
+        try:
+            rule_id = conn.execute('INSERT INTO rules (kind, target, keyword, priority) '
+                                   'VALUES (?, ?, ?, ?)',
+                                   [kind, target, keyword, priority]).lastrowid
+        except sqlite3.IntegrityError:
+            raise ValueError('Rule exists already: {0} {1} {2}'.format(kind, target, keyword))
+        _bump_rules_version(conn)
+
+        changed = 0
+        if kind == 'category':
+            lama.bump_version(conn)
+            rules = _compile(conn)
+            if _order_changed(before, rules):
+                condition, params = '1', []
+            else:
+                condition, params = lama.search_condition([keyword.lower()], rule_columns)
+            changed = _reclassify(lama, conn, rules, condition, params)
+        record['rows'] = changed
+
+    sync_snapshot(lama)
+    logger.info('[Rules] Added rule %d (%s %s: %s), reclassified %d transactions', rule_id,
+                kind, target, keyword, changed)
+
+    return rule_id
+
+
+def remove_rule(lama: Financelama, rule_id: int) -> int:
+    """
+    Removes rule and reclassifies all transactions categorized by it, or all categorized
+    transactions if the order of categories changes (removal of the first rule of a category).
+    Transactions of the rule's category without rule_id (categorized before rules were recorded
+    or by fuzzy clustering) are reclassified if they contain its keyword.
+
+    Parameters
+    ----------
+    lama : Financelama
+        Reference to Financelama object for database access.
+    rule_id : int
+        Rule to remove, see list_rules()
+
+    Returns
+    -------
+    Number of transactions whose category or rule changed
+    """
+    load_rules(lama)
+    with stage('rules') as record, lama.transaction() as conn:
+        before = _compile(conn)
+        rule = conn.execute('SELECT kind, target, keyword FROM rules WHERE rule_id = ?',
+                            [rule_id]).fetchone()
+        if rule is None:
+            raise ValueError('Unknown rule: ' + str(rule_id))
+        conn.execute('DELETE FROM rules WHERE rule_id = ?', [rule_id])
+        _bump_rules_version(conn)
+
+        changed = 0
+        if rule[0] == 'category':
+            lama.bump_version(conn)
+            rules = _compile(conn)
+            if _order_changed(before, rules):
+                condition, params = '1', []
+            else:
+                # Transactions categorized before rules were recorded (or by fuzzy clustering)
+                # have no rule_id, they are looked up by keyword
+                search, params = lama.search_condition([rule[2].lower()], rule_columns)
+                condition = 'rule_id = ? OR (rule_id IS NULL AND category = ? AND (' + \
+                    search + '))'
+                params = [rule_id, rule[1]] + params
+            changed = _reclassify(lama, conn, rules, condition, params)
+        record['rows'] = changed
+
+    sync_snapshot(lama)
+    logger.info('[Rules] Removed rule %d (%s %s: %s), reclassified %d transactions', rule_id,
+                rule[0], rule[1], rule[2], changed)
+
+    return changed
+
+
+def list_rules(lama: Financelama) -> pd.DataFrame:
+    """
+    All rules in order of matching.
+
+    Returns
+    -------
+    pandas.DataFrame with rule_id, kind, target, keyword and priority
+    """
+    return load_rules(lama)['rules'].copy()
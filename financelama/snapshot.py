@@ -0,0 +1,164 @@
+"""
+Columnar snapshot of the transactions table for fast analytic loads.
+
+The snapshot is stored as Parquet files partitioned by year (year=YYYY/part.parquet) in the
+snapshot folder of a Financelama object and is kept in sync with the change version of the
+database. Requires the optional dependency pyarrow.
+"""
+import os
+import shutil
+
+import pandas as pd
+
+from financelama.core import Financelama
+
+# Columns stored in snapshot, rowid identifies transactions in the database
+snapshot_columns = [
+    'rowid', 'account', 'day', 'info', 'orderer', 'orderer_account', 'orderer_bank', 'reason',
+    'value', 'category', 'report'
+]
+
+
+def _import_pyarrow():
+    """ Imports pyarrow modules used for snapshots, raises ImportError with hint if missing. """
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.fs
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('Parquet snapshots require pyarrow: pip install pyarrow') from e
+
+    return pyarrow
+
+
+def _read_version(path: str) -> int:
+    """ Change version of database the snapshot in path was written for, -1 if not existing. """
+    try:
+        with open(os.path.join(path, '_version')) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return -1
+
+
+def _write_partition(pa, path: str, year: str, df: pd.DataFrame):
+    """ Replaces partition of year atomically, an empty dataframe removes the partition. """
+    partition = os.path.join(path, 'year=' + year)
+
+    if df.empty:
+        shutil.rmtree(partition, ignore_errors=True)
+        return
+
+    os.makedirs(partition, exist_ok=True)
+    # Files starting with '_' are ignored when reading the dataset
+    tmp_file = os.path.join(partition, '_part.parquet.tmp')
+    pa.parquet.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_file)
+    os.replace(tmp_file, os.path.join(partition, 'part.parquet'))
+
+
+def sync_snapshot(lama: Financelama):
+    """
+    Brings snapshot up to date with database. Only partitions of years with changes since the
+    last sync are rewritten. Does nothing if lama has no snapshot folder configured.
+
+    Parameters
+    ----------
+    lama : Financelama
+        References to Financelama object for database access.
+    """
+    if lama.PATH_SNAPSHOT is None:
+        return
+
+    pa = _import_pyarrow()
+    path = lama.PATH_SNAPSHOT
+
+    version = lama.version()
+    snapshot_version = _read_version(path)
+    if snapshot_version == version:
+        return
+
+    sql_query = 'SELECT ' + ', '.join(snapshot_columns) + ' FROM transactions'
+
+    if snapshot_version < 0:
+        # Write snapshot from scratch
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+        df = lama.connect_database(sql_query)[0]
+
+        for year, partition in df.groupby(df['day'].dt.strftime('%Y')):
+            _write_partition(pa, path, year, partition)
+    else:
+        years = sorted({m[:4] for m in lama.changes_since(snapshot_version)[0]})
+        for year in years:
+            df = lama.connect_database(sql_query + ' WHERE day >= ? AND day < ?',
+                                       [year + '-01-01', str(int(year) + 1) + '-01-01'])[0]
+
+            _write_partition(pa, path, year, df)
+
+    with open(os.path.join(path, '_version'), 'w') as f:
+        f.write(str(version))
+
+
+def load_snapshot(lama: Financelama, columns: list = None, start=None, end=None,
+                  ranges: list = None) -> pd.DataFrame:
+    """
+    Loads transactions from snapshot.
+
+    Only requested columns are read and the day filter is pushed down to the Parquet files,
+    whole years outside of the filter are skipped. Files are memory-mapped.
+
+    Parameters
+    ----------
+    lama : Financelama
+        References to Financelama object with snapshot folder.
+    columns : list of str, optional
+        Columns to load, see snapshot_columns. Default: all columns
+    start : datetime-like, optional
+        Only load transactions on or after this day.
+    end : datetime-like, optional
+        Only load transactions before this day.
+    ranges : list of touples, optional
+        Only load transactions within one of the given (start, end) ranges of days. Start is
+        included, end is excluded.
+
+    Returns
+    -------
+    pandas.DataFrame with same datatypes as Financelama.connect_database()
+    """
+    pa = _import_pyarrow()
+    sync_snapshot(lama)
+
+    if columns is None:
+        columns = snapshot_columns
+
+    if start is not None or end is not None:
+        ranges = [(start, end)] + (ranges or [])
+
+    expression = None
+    for range_start, range_end in ranges or []:
+        # Filter on partition (year) allows skipping whole files
+        day = pa.dataset.field('day')
+        year = pa.dataset.field('year')
+        condition = None
+        if range_start is not None:
+            range_start = pd.Timestamp(range_start)
+            condition = (day >= pa.scalar(range_start, pa.timestamp('ns'))) & \
+                        (year >= range_start.year)
+        if range_end is not None:
+            range_end = pd.Timestamp(range_end)
+            end_condition = (day < pa.scalar(range_end, pa.timestamp('ns'))) & \
+                            (year <= range_end.year)
+            condition = end_condition if condition is None else condition & end_condition
+        if condition is not None:
+            expression = condition if expression is None else expression | condition
+
+    # Empty database has no partitions to infer the schema from
+    if not any(d.startswith('year=') for d in os.listdir(lama.PATH_SNAPSHOT)):
+        return lama.connect_database('SELECT ' + ', '.join(columns) +
+                                     ' FROM transactions LIMIT 0')[0]
+
+    dataset = pa.dataset.dataset(lama.PATH_SNAPSHOT, format='parquet', partitioning='hive',
+                                 filesystem=pa.fs.LocalFileSystem(use_mmap=True))
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    return table.to_pandas()
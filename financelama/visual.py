@@ -1,57 +1,259 @@
 # -*- coding: utf-8 -*-
+import contextlib
+import functools
+import operator
+import re
+
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+import dash_table
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import plotly.graph_objs as go
 import plotly.express as px
 
 import pandas as pd
 
+from financelama.analytics import analytics, frame_analytics, rolling_spend, running_balance
+from financelama.config import analytics_windows, dashboard_cache_size, dashboard_reload_seconds
+from financelama.core import Financelama, search_columns, value_in_euros
+from financelama.evaluation import filter_cube, frame_to_cube, monthly_cube
+from financelama.inbox import InboxWatcher
+from financelama.instrumentation import stage
+from financelama.ledgers import LedgerPool
+
 
 # ROADMAP Activity heatmap (github-like) see: https://community.plot.ly/t/colored-calendar-heatmap-in-dash/10907/5
 
-def generate_table(dataframe):
-    df = dataframe[['orderer', 'reason', 'value', 'category', 'report']]
-    df.insert(0, 'day', dataframe['day'].dt.date)
+# Columns of transaction table with SQL expression used for querying them
+table_columns = {
+    'day': 'substr(day, 1, 10)',
+    'orderer': 'orderer',
+    'reason': 'reason',
+    'value': 'CAST(value AS REAL)',
+    'category': 'category',
+    'report': 'report',
+}
+
+# Columns of tables with recurring payments and anomalies
+recurring_columns = ['orderer', 'value', 'period', 'next_expected', 'monthly_value', 'category',
+                     'active']
+anomaly_columns = ['month', 'category', 'expense', 'expected', 'zscore']
+
+# Operators of dash_table filter queries with their SQL equivalent
+filter_operators = {
+    'contains': 'LIKE', '=': '=', 'eq': '=', '!=': '<>', 'ne': '<>', '<': '<', 'lt': '<',
+    '<=': '<=', 'le': '<=', '>': '>', 'gt': '>', '>=': '>=', 'ge': '>=', 'datestartswith': 'LIKE',
+}
+comparisons = {
+    '=': operator.eq, '<>': operator.ne, '<': operator.lt, '<=': operator.le, '>': operator.gt,
+    '>=': operator.ge,
+}
+
+
+def _parse_filter_query(filter_query: str) -> list:
+    """
+    Parses filter query of dash_table (e.g. '{orderer} contains "rewe" && {value} < 0').
 
-    df.sort_values(by=['day'], inplace=True)
+    Returns
+    -------
+    List of (column, operator, value) touples, unknown columns and operators are ignored.
+    """
+    filters = []
+    for expression in (filter_query or '').split(' && '):
+        match = re.match(r'^\{(\w+)\} (\S+) (.*)$', expression.strip())
+        if match is None:
+            continue
 
-    return html.Table(
-        # Header
-        [html.Tr([html.Th(col) for col in df.columns])] +
+        col, op, value = match.groups()
+        if col not in table_columns or op not in filter_operators:
+            continue
 
-        # Body
-        [html.Tr([
-            html.Td(df.iloc[i][col]) for col in df.columns
-        ]) for i in range(len(df))]
+        value = value.strip()
+        if len(value) > 1 and value[0] == value[-1] and value[0] in '"\'`':
+            value = value[1:-1]
+        if col == 'value':
+            try:
+                value = float(value)
+            except ValueError:
+                continue
+
+        filters.append((col, op, value))
+
+    return filters
+
+
+def _query_table_page(lama: Financelama, start, end, page_current: int, page_size: int,
+                      sort_by: list, filter_query: str, search: str = None):
+    """
+    Queries one page of transactions between start (included) and end (excluded) from the
+    database, filtering and sorting is done by SQL. Without start and end, all transactions
+    are queried. Words of search are looked up in the full-text index (see
+    Financelama.search_condition).
+
+    Returns
+    -------
+    List of records for dash_table and total number of pages as touple in that very order.
+    """
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append('day >= ?')
+        params.append(str(start))
+    if end is not None:
+        conditions.append('day < ?')
+        params.append(str(end))
+
+    selection = lama.search_condition(search or '')
+    if selection is not None:
+        conditions.append('(' + selection[0] + ')')
+        params += selection[1]
+
+    for col, op, value in _parse_filter_query(filter_query):
+        if op in ('contains', 'datestartswith'):
+            # Wildcards typed by the user are matched literally
+            value = re.sub(r'([\\%_])', r'\\\1', str(value)) + '%'
+            if op == 'contains':
+                value = '%' + value
+            conditions.append(table_columns[col] + " LIKE ? ESCAPE '\\'")
+        else:
+            conditions.append(table_columns[col] + ' ' + filter_operators[op] + ' ?')
+        params.append(value)
+
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    # Rowid breaks ties, so that pages of equal values neither overlap nor skip rows
+    order = ' ORDER BY day, rowid'
+    if sort_by:
+        direction = 'DESC' if sort_by[0]['direction'] == 'desc' else 'ASC'
+        order = ' ORDER BY ' + table_columns[sort_by[0]['column_id']] + ' ' + direction + \
+            ', rowid'
+
+    conn = lama.connection()
+    count = conn.execute('SELECT COUNT(*) FROM transactions' + where, params).fetchone()[0]
+
+    select = ', '.join(expression + ' AS ' + col for col, expression in table_columns.items())
+    df = pd.read_sql('SELECT ' + select + ' FROM transactions' + where + order +
+                     ' LIMIT ? OFFSET ?', conn,
+                     params=params + [page_size, page_current * page_size])
+
+    return df.to_dict('records'), max(1, -(-count // page_size))
+
+
+def _frame_table_page(dataframe: pd.DataFrame, start, end, page_current: int, page_size: int,
+                      sort_by: list, filter_query: str, search: str = None):
+    """
+    Same as _query_table_page() but served from dataframe sorted by day, used if no database
+    is given to the dashboard.
+    """
+    # Binary search for the range of days
+    first = 0 if start is None else dataframe['day'].searchsorted(start)
+    last = len(dataframe) if end is None else dataframe['day'].searchsorted(end)
+    extract = dataframe.iloc[first:last]
+
+    for word in (search or '').split():
+        mask = pd.Series(False, index=extract.index)
+        for col in search_columns:
+            mask |= extract[col].astype(object).fillna('').astype(str).str.contains(
+                word, case=False, regex=False)
+        extract = extract[mask]
+
+    df = pd.DataFrame({'day': extract['day'].dt.strftime('%Y-%m-%d')})
+    # Missing values of compact representation are displayed like the ones in the database
+    for col in ['orderer', 'reason', 'category', 'report']:
+        df[col] = extract[col].astype(object).fillna('None')
+    df['value'] = value_in_euros(extract)
+
+    for col, op, value in _parse_filter_query(filter_query):
+        if op == 'contains':
+            mask = df[col].astype(str).str.contains(value, case=False, regex=False)
+        elif op == 'datestartswith':
+            mask = df[col].str.startswith(value)
+        else:
+            mask = comparisons[filter_operators[op]](df[col], value)
+        df = df[mask]
+
+    if sort_by:
+        df = df.sort_values(by=sort_by[0]['column_id'],
+                            ascending=sort_by[0]['direction'] != 'desc', kind='stable')
+
+    page = df.iloc[page_current * page_size:(page_current + 1) * page_size]
+
+    return page[list(table_columns)].to_dict('records'), max(1, -(-len(df) // page_size))
+
+
+def generate_datatable():
+    """
+    Generates empty transaction table which is paginated, sorted and filtered server-side.
+
+    Returns
+    -------
+    dash_table.DataTable
+        Table to add to dash layout.
+    """
+    return dash_table.DataTable(
+        id='datatable',
+        columns=[{'name': col, 'id': col, 'type': 'numeric' if col == 'value' else 'text'}
+                 for col in table_columns],
+        data=[],
+        page_current=0,
+        page_size=25,
+        page_count=1,
+        page_action='custom',
+        sort_action='custom',
+        sort_mode='single',
+        sort_by=[],
+        filter_action='custom',
+        filter_query='',
     )
 
 
-def generate_monthly_expenses(dataframe):
+def generate_search():
+    """
+    Generates search box for transactions, matching transactions of all months (or of the
+    selected month) are shown in the transaction table.
+
+    Returns
+    -------
+    dcc.Input
+        Search box to add to dash layout.
+    """
+    return dcc.Input(id='search', type='search', debounce=True,
+                     placeholder='Search orderer, reason and info',
+                     style={'width': '100%'})
+
+
+def generate_monthly_expenses(cube):
     """
     Generates aggregated monthly expenses as bar chart.
 
     Parameters
     ----------
-    dataframe : pandas.DataFrame
-        Evaluated dataframe with data to display
+    cube : pandas.DataFrame
+        Aggregate cube with data to display (see evaluation.monthly_cube)
 
     Returns
     -------
     dash_core_components.Graph
         Graph to add to dash layout.
     """
-    extract = dataframe[['day', 'value']]
+    return dcc.Graph(id='monthly-expenses', figure=_monthly_expenses_figure(cube))
+
 
-    # Sum up values per week, returns object with DatetimeIndex
-    extract = extract.groupby(pd.Grouper(key='day', freq='M')).sum()
+def _monthly_expenses_figure(cube):
+    """ Bar chart with sum of values per month of cube or slice of it. """
+    # Sum up values per month, months without transactions are shown as well
+    extract = cube.groupby(level='month')['value'].sum()
+    if len(extract) > 0:
+        extract = extract.reindex(
+            pd.date_range(extract.index.min(), extract.index.max(), freq='M'), fill_value=0)
 
     # Create diagram and fill with data
     data = [dict(
         type='bar',
         x=extract.index,
-        y=extract.value,
+        y=extract.values,
         name='Rest of world',
     )]
 
@@ -59,69 +261,568 @@ def generate_monthly_expenses(dataframe):
         title='Monthly expenses'
     )
 
-    return dcc.Graph(id='monthly-expenses', figure=go.Figure(data, layout))
+    return go.Figure(data, layout)
+
+
+def _pie_figure(cube, sign: str, title: str):
+    """ Pie chart with sum of income or expenses (sign) per category of cube or slice of it. """
+    extract = cube[cube.index.get_level_values('sign') == sign]
+    extract = extract.groupby(level='category')['value'].sum().abs().reset_index()
+
+    return px.pie(extract[extract['value'] > 0], values='value', names='category', title=title)
+
+
+def generate_pie_chart_expenses(cube):
+    return dcc.Graph(id='pie-expenses', figure=_pie_figure(cube, 'expense', 'Expenses'))
+
+
+def generate_pie_chart_income(cube):
+    return dcc.Graph(id='pie-income', figure=_pie_figure(cube, 'income', 'Income'))
+
+
+def generate_category_trends(cube):
+    """
+    Generates monthly expenses per category as line chart.
+
+    Parameters
+    ----------
+    cube : pandas.DataFrame
+        Aggregate cube with data to display (see evaluation.monthly_cube)
+
+    Returns
+    -------
+    dash_core_components.Graph
+        Graph to add to dash layout.
+    """
+    return dcc.Graph(id='category-trends', figure=_category_trends_figure(cube))
+
+
+def _category_trends_figure(cube):
+    """ Line chart with expenses per month and category of cube or slice of it. """
+    expenses = cube[cube.index.get_level_values('sign') == 'expense']
+    expenses = expenses.groupby(level=['month', 'category'])['value'].sum().abs()
+    expenses = expenses.unstack('category', fill_value=0)
+
+    data = [dict(
+        type='scatter',
+        mode='lines',
+        x=expenses.index,
+        y=expenses[category],
+        name=category,
+    ) for category in expenses.columns]
+
+    layout = go.Layout(
+        title='Monthly expenses per category'
+    )
+
+    return go.Figure(data, layout)
 
 
-def generate_pie_chart_expenses(dataframe):
-    df = dataframe.loc[dataframe['value'] < 0].copy()
-    df['value'] = df['value'].abs()
+def period_figures(cube, month=None) -> dict:
+    """
+    Figures of monthly expenses, income and expenses per category and category trends, as
+    shown by the dashboard for a filter selection.
 
-    return dcc.Graph(id='pie-expenses', figure=px.pie(df, values='value', names='category', title='Expenses'))
+    Parameters
+    ----------
+    cube : pandas.DataFrame
+        Aggregate cube or filtered slice of it (see evaluation.monthly_cube and filter_cube)
+    month : date-like, optional
+        Month (any day of it) whose income and expenses are shown in the pie charts. Default:
+        all months of cube
 
+    Returns
+    -------
+    Dict of plotly figures by id of their graph in the dashboard
+    """
+    if month is None:
+        month_extract = cube
+        title = ''
+    else:
+        # Month slice from sorted index of cube, months are indexed by their last day
+        month = pd.Timestamp(month) + pd.offsets.MonthEnd(0)
+        month_extract = cube.loc[month:month]
+        title = ' ' + month.strftime('%Y-%m')
+
+    return {'monthly-expenses': _monthly_expenses_figure(cube),
+            'pie-expenses': _pie_figure(month_extract, 'expense', 'Expenses' + title),
+            'pie-income': _pie_figure(month_extract, 'income', 'Income' + title),
+            'category-trends': _category_trends_figure(cube)}
+
+
+def generate_rolling_spend(views: dict):
+    """
+    Generates rolling expenses per category with selection of the window as line chart.
+
+    Parameters
+    ----------
+    views : dict
+        Analytics views with data to display (see analytics.analytics)
+
+    Returns
+    -------
+    dash_html_components.Div
+        Window selection and graph to add to dash layout.
+    """
+    window = analytics_windows[0]
 
-def generate_pie_chart_income(dataframe):
-    df = dataframe.loc[dataframe['value'] > 0].copy()
-    return dcc.Graph(id='pie-income', figure=px.pie(df, values='value', names='category', title='Income'))
+    return html.Div([
+        dcc.RadioItems(id='rolling-window', value=window, labelStyle={'display': 'inline-block'},
+                       options=[{'label': '{0} days'.format(w), 'value': w}
+                                for w in analytics_windows]),
+        dcc.Graph(id='rolling-spend', figure=_rolling_figure(views['rolling'][window], window)),
+    ])
+
+
+def _rolling_figure(rolling, window: int):
+    """ Line chart with expenses of trailing window per day and category. """
+    data = [dict(
+        type='scattergl',
+        mode='lines',
+        x=rolling.index,
+        y=rolling[category],
+        name=category,
+    ) for category in rolling.columns]
+
+    layout = go.Layout(
+        title='Expenses of last {0} days per category'.format(window)
+    )
+
+    return go.Figure(data, layout)
 
 
-def start_dashboard(dataframe: pd.DataFrame):
+def generate_running_balance(views: dict):
+    """
+    Generates running balance per account as line chart.
+
+    Parameters
+    ----------
+    views : dict
+        Analytics views with data to display (see analytics.analytics)
+
+    Returns
+    -------
+    dash_core_components.Graph
+        Graph to add to dash layout.
+    """
+    return dcc.Graph(id='running-balance', figure=_balance_figure(views['balance']))
+
+
+def _balance_figure(balance):
+    """ Line chart with balance per day and account. """
+    data = [dict(
+        type='scattergl',
+        mode='lines',
+        x=balance.index,
+        y=balance[account],
+        name=account,
+    ) for account in balance.columns]
+
+    layout = go.Layout(
+        title='Balance per account (relative to first transaction)'
+    )
+
+    return go.Figure(data, layout)
+
+
+def _recurring_records(recurring) -> list:
+    """ Records of recurring payments for dash_table. """
+    df = recurring[recurring_columns].copy()
+    df['next_expected'] = df['next_expected'].dt.strftime('%Y-%m-%d')
+    df['active'] = df['active'].map({True: 'yes', False: 'no'})
+
+    return df.to_dict('records')
+
+
+def _anomaly_records(anomalies) -> list:
+    """ Records of flagged anomalies for dash_table, newest first. """
+    df = anomalies[anomalies['anomaly']].reset_index()
+    df['month'] = df['month'].dt.strftime('%Y-%m')
+    df = df[anomaly_columns].round({'expense': 2, 'expected': 2, 'zscore': 1})
+
+    return df.iloc[::-1].to_dict('records')
+
+
+def generate_analytics_tables(views: dict):
+    """
+    Generates tables of recurring payments and month-over-month anomalies of expenses.
+
+    Parameters
+    ----------
+    views : dict
+        Analytics views with data to display (see analytics.analytics)
+
+    Returns
+    -------
+    dash_html_components.Div
+        Row with both tables to add to dash layout.
+    """
+    return html.Div([
+        html.Div([
+            html.H4('Recurring payments'),
+            dash_table.DataTable(id='recurring-table', page_size=10,
+                                 columns=[{'name': col, 'id': col} for col in recurring_columns],
+                                 data=_recurring_records(views['recurring'])),
+        ], className="six columns"),
+
+        html.Div([
+            html.H4('Unusual expenses'),
+            dash_table.DataTable(id='anomaly-table', page_size=10,
+                                 columns=[{'name': col, 'id': col} for col in anomaly_columns],
+                                 data=_anomaly_records(views['anomalies'])),
+        ], className="six columns")
+    ], className="row")
+
+
+def _filter_options(cube, level: str) -> list:
+    """ Dropdown options with all values of given level of cube. """
+    return [{'label': v, 'value': v} for v in sorted(cube.index.unique(level=level))]
+
+
+def generate_filters(cube):
+    """
+    Generates filter controls for date range, accounts and categories of all figures.
+
+    Parameters
+    ----------
+    cube : pandas.DataFrame
+        Aggregate cube with data to display (see evaluation.monthly_cube)
+
+    Returns
+    -------
+    dash_html_components.Div
+        Row with filter controls to add to dash layout.
+    """
+    months = cube.index.get_level_values('month')
+
+    return html.Div([
+        html.Div([
+            dcc.DatePickerRange(
+                id='filter-dates',
+                display_format='YYYY-MM-DD',
+                min_date_allowed=(months.min() - pd.offsets.MonthBegin(1)).date()
+                if len(months) > 0 else None,
+                max_date_allowed=months.max().date() if len(months) > 0 else None,
+                clearable=True,
+            )
+        ], className="four columns"),
+
+        html.Div([
+            dcc.Dropdown(id='filter-accounts', options=_filter_options(cube, 'account'),
+                         multi=True, placeholder='All accounts')
+        ], className="four columns"),
+
+        html.Div([
+            dcc.Dropdown(id='filter-categories', options=_filter_options(cube, 'category'),
+                         multi=True, placeholder='All categories')
+        ], className="four columns"),
+    ], className="row")
+
+
+def generate_ledger_switch(names: list):
+    """
+    Generates dropdown for switching between ledgers, hidden if there are none.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of ledgers, the first one is selected
+
+    Returns
+    -------
+    dash_html_components.Div
+        Ledger switch to add to dash layout.
+    """
+    return html.Div([
+        dcc.Dropdown(id='ledger', options=[{'label': n, 'value': n} for n in names],
+                     value=names[0] if names else None, clearable=False)
+    ], style={} if names else {'display': 'none'})
+
+
+def _inbox_status(watcher: InboxWatcher) -> str:
+    """ Status line of background import. """
+    stats = watcher.stats()
+    status = 'Inbox: {0} queued, {1} imported files ({2} transactions), {3} failed'.format(
+        stats['queue_depth'] + stats['pending'], stats['imported_files'],
+        stats['imported_transactions'], stats['failed_files'])
+    if stats['last_latency'] is not None:
+        status += ', latency {0:.1f} s (mean {1:.1f} s)'.format(stats['last_latency'],
+                                                               stats['mean_latency'])
+
+    return status
+
+
+def start_dashboard(dataframe: pd.DataFrame, lama: Financelama = None, inbox: str = None,
+                    ledgers: LedgerPool = None):
     """
     Creates dashboard as web page and starts local server. Functions generating
     page content are invoked from here.
 
+    All figures follow the filter controls (date range, accounts and categories). Figures of
+    each filter combination are memoized together with the change version of the database, so
+    that repeated combinations are served from memory in all browser sessions. Changes in the
+    database are picked up periodically without restarting the dashboard. Analytics (rolling
+    expenses, balances, recurring payments and anomalies) follow the same filters. The search box
+    queries the full-text index of the database, only the visible page of matching
+    transactions is loaded.
+
+    With a pool of ledgers, one dashboard serves all of them and the ledger is switched by a
+    dropdown. Figures are memoized per ledger, databases of ledgers not in use are closed by the
+    pool.
+
     Parameters
     ----------
     dataframe : pandas.DataFrame
-        Evaluated dataframe with data to display
+        Evaluated dataframe with data to display, either in standard or compact representation
+        (see evaluation.evaluate)
+    lama : Financelama, optional
+        If given, figures are served from the incrementally updated aggregate cube of the
+        database and monthly raw data is queried page by page from the database.
+    inbox : str, optional
+        Folder which is watched for new CSV files while the dashboard is running (requires
+        lama). New files are imported and categorized in the background, see inbox.InboxWatcher.
+    ledgers : LedgerPool, optional
+        If given, ledgers of the pool are displayed instead of dataframe or lama (both may be
+        None then).
     """
     app = dash.Dash(__name__, external_stylesheets=['https://codepen.io/chriddyp/pen/bWLwgP.css'])
 
+    names = ledgers.names() if ledgers is not None else []
+    if ledgers is not None and not names:
+        raise ValueError('No ledgers to display')
+
+    @contextlib.contextmanager
+    def database(ledger):
+        # Database of ledger, lama (or None for dataframe) without ledger pool
+        if ledgers is None:
+            yield lama
+        else:
+            with ledgers.ledger(ledger) as current:
+                yield current
+
+    # All figures are served from the aggregate cube
+    if lama is None and ledgers is None:
+        cube = frame_to_cube(dataframe)
+
+        # Transactions sorted by day for binary search
+        dataframe = dataframe.sort_values(by=['day'], kind='stable', ignore_index=True)
+
+        views = frame_analytics(dataframe)
+
+    def current_version(ledger):
+        with database(ledger) as db:
+            return db.version() if db is not None else 0
+
+    def current_cube(ledger):
+        with database(ledger) as db:
+            return monthly_cube(db) if db is not None else cube
+
+    def current_views(ledger):
+        with database(ledger) as db:
+            return analytics(db) if db is not None else views
+
+    # Background import, caches are refreshed by the import thread so that page responses
+    # don't have to
+    watcher = None
+    if inbox is not None and lama is not None:
+        watcher = InboxWatcher(lama, inbox)
+        watcher.subscribe(lambda result: (monthly_cube(lama), analytics(lama)))
+
+    @functools.lru_cache(maxsize=dashboard_cache_size)
+    def filtered_figures(ledger, start, end, accounts, categories, month, version):
+        with stage('figure_build') as record:
+            # Version is only part of the key, the cube is always the current one
+            extract = filter_cube(current_cube(ledger), start, end, accounts, categories)
+            record['rows'] = extract.shape[0]
+
+            return tuple(period_figures(extract, month).values())
+
+    @functools.lru_cache(maxsize=dashboard_cache_size)
+    def filtered_analytics(ledger, start, end, accounts, categories, window, version):
+        with stage('analytics_build') as record:
+            current = current_views(ledger)
+            daily = filter_cube(current['daily'], accounts=accounts, categories=categories)
+            record['rows'] = daily.shape[0]
+
+            # Windows and balances start before the selected range, so they are computed
+            # for all days and sliced afterwards
+            if accounts or categories:
+                rolling = rolling_spend(daily, [window])[window]
+            else:
+                rolling = current['rolling'][window]
+            if accounts:
+                balance = running_balance(filter_cube(current['daily'], accounts=accounts))
+            else:
+                balance = current['balance']
+            start = pd.Timestamp(start) if start is not None else None
+            end = pd.Timestamp(end) if end is not None else None
+
+            recurring = current['recurring']
+            if accounts:
+                recurring = recurring[recurring['account'].isin(accounts)]
+            if categories:
+                recurring = recurring[recurring['category'].isin(categories)]
+
+            return (_rolling_figure(rolling.loc[start:end], window),
+                    _balance_figure(balance.loc[start:end]),
+                    _recurring_records(recurring),
+                    _anomaly_records(filter_cube(current['anomalies'], start, end,
+                                                 categories=categories)))
+
+    # Layout is generated for the first ledger
+    ledger = names[0] if names else None
+    cube = current_cube(ledger)
+    views = current_views(ledger)
+
     app.layout = html.Div(children=[
         html.H1('Financelama'),
+        generate_ledger_switch(names),
+        html.Div(id='inbox-status', children=_inbox_status(watcher) if watcher else ''),
+
+        generate_filters(cube),
 
-        # generate_table(lama.data)
-        generate_monthly_expenses(dataframe),
+        generate_monthly_expenses(cube),
 
         html.Div([
             html.Div([
-                generate_pie_chart_expenses(dataframe)
+                generate_pie_chart_expenses(cube)
             ], className="six columns"),
 
             html.Div([
-                generate_pie_chart_income(dataframe)
+                generate_pie_chart_income(cube)
             ], className="six columns")
         ], className="row"),
-        html.Div([
-            # Monthly RAW data will be displayed here when clicked on bar chart
-        ], id='div-datatable')
+
+        generate_category_trends(cube),
+
+        generate_rolling_spend(views),
+        generate_running_balance(views),
+        generate_analytics_tables(views),
+
+        # Monthly RAW data will be displayed here when clicked on bar chart or searched for
+        dcc.Store(id='selected-month'),
+        generate_search(),
+        generate_datatable(),
+
+        # Selected ledger and its change version, polled for hot reload
+        dcc.Store(id='data-version', data={'ledger': ledger, 'version': current_version(ledger)}),
+        dcc.Interval(id='reload-interval', interval=dashboard_reload_seconds * 1000,
+                     disabled=lama is None and ledgers is None),
 
     ])
 
-    # Callback for updating charts and table when clicking on bar
+    # Callback for switching ledger and picking up changes in database
     @app.callback(
-        Output('div-datatable', 'children'),
-        [Input('monthly-expenses', 'clickData')])
-    def update_datatable(clickData):
+        Output('data-version', 'data'),
+        [Input('reload-interval', 'n_intervals'), Input('ledger', 'value')],
+        [State('data-version', 'data')])
+    def reload_data(n_intervals, ledger, version):
+        new_version = {'ledger': ledger, 'version': current_version(ledger)}
+        if new_version == version:
+            raise PreventUpdate
+
+        return new_version
+
+    # Callback for showing state of background import
+    if watcher is not None:
+        @app.callback(
+            Output('inbox-status', 'children'),
+            [Input('reload-interval', 'n_intervals')])
+        def update_inbox_status(n_intervals):
+            return _inbox_status(watcher)
+
+    # Callback for updating filter options after changes in database
+    @app.callback(
+        [Output('filter-accounts', 'options'), Output('filter-categories', 'options')],
+        [Input('data-version', 'data')])
+    def update_filter_options(version):
+        current = current_cube(version['ledger'])
+        return _filter_options(current, 'account'), _filter_options(current, 'category')
+
+    # Callback for selecting month when clicking on bar, table starts at first page for new
+    # month or search
+    @app.callback(
+        [Output('selected-month', 'data'), Output('datatable', 'page_current')],
+        [Input('monthly-expenses', 'clickData'), Input('search', 'value')])
+    def select_month(clickData, search):
         # Get end date from clicked data point and calculate start date from that
-        if clickData == None:
-            return
+        if clickData is None:
+            return None, 0
 
         clicked_timestamp = pd.Timestamp(clickData['points'][0]['x'])
-        # df['month'] = df['purchase_date'].dt.floor('d') - pd.offsets.MonthBegin(1)
         datetime_start = clicked_timestamp.floor('d') - pd.offsets.MonthBegin(1)
-        datetime_end = clicked_timestamp.floor('d')
+        datetime_end = clicked_timestamp.floor('d') + pd.Timedelta(days=1)
 
-        mask = (dataframe['day'] > datetime_start) & (dataframe['day'] < datetime_end)
-        return generate_table(dataframe.loc[mask])
+        return {'start': str(datetime_start), 'end': str(datetime_end)}, 0
 
-    app.run_server(debug=False)
+    # Callback for updating all figures with filtered data
+    @app.callback(
+        [Output('monthly-expenses', 'figure'),
+         Output('pie-expenses', 'figure'),
+         Output('pie-income', 'figure'),
+         Output('category-trends', 'figure')],
+        [Input('filter-dates', 'start_date'),
+         Input('filter-dates', 'end_date'),
+         Input('filter-accounts', 'value'),
+         Input('filter-categories', 'value'),
+         Input('selected-month', 'data'),
+         Input('data-version', 'data')])
+    def update_figures(start_date, end_date, accounts, categories, month, version):
+        if month is not None:
+            month = str(pd.Timestamp(month['end']) - pd.Timedelta(days=1))
+
+        # Filter state as hashable key, order of selected values doesn't matter
+        ledger = version['ledger']
+        return filtered_figures(ledger, start_date, end_date,
+                                tuple(sorted(accounts or [])), tuple(sorted(categories or [])),
+                                month, current_version(ledger))
+
+    # Callback for updating analytics with filtered data
+    @app.callback(
+        [Output('rolling-spend', 'figure'),
+         Output('running-balance', 'figure'),
+         Output('recurring-table', 'data'),
+         Output('anomaly-table', 'data')],
+        [Input('filter-dates', 'start_date'),
+         Input('filter-dates', 'end_date'),
+         Input('filter-accounts', 'value'),
+         Input('filter-categories', 'value'),
+         Input('rolling-window', 'value'),
+         Input('data-version', 'data')])
+    def update_analytics(start_date, end_date, accounts, categories, window, version):
+        ledger = version['ledger']
+        return filtered_analytics(ledger, start_date, end_date,
+                                  tuple(sorted(accounts or [])), tuple(sorted(categories or [])),
+                                  window, current_version(ledger))
+
+    # Callback for updating table with visible page of selected month and search results
+    @app.callback(
+        [Output('datatable', 'data'), Output('datatable', 'page_count')],
+        [Input('selected-month', 'data'),
+         Input('search', 'value'),
+         Input('datatable', 'page_current'),
+         Input('datatable', 'page_size'),
+         Input('datatable', 'sort_by'),
+         Input('datatable', 'filter_query'),
+         Input('data-version', 'data')])
+    def update_datatable(month, search, page_current, page_size, sort_by, filter_query,
+                         version):
+        search = (search or '').strip()
+        if month is None and not search:
+            return [], 1
+
+        start = pd.Timestamp(month['start']) if month is not None else None
+        end = pd.Timestamp(month['end']) if month is not None else None
+
+        with database(version['ledger']) as db:
+            if db is not None:
+                return _query_table_page(db, start, end, page_current, page_size, sort_by,
+                                         filter_query, search)
+        return _frame_table_page(dataframe, start, end, page_current, page_size, sort_by,
+                                 filter_query, search)
+
+    if watcher is None:
+        app.run_server(debug=False)
+    else:
+        with watcher:
+            app.run_server(debug=False)
@@ -1,4 +1,5 @@
 from financelama.core import Financelama
+from financelama.instrumentation import configure_logging
 
 import timeit
 
@@ -12,6 +13,8 @@ def benchmark(function):
     print(timeit.timeit(function, number=1))
 
 
+configure_logging()
+
 # Create lama object with dataframe as data property
 lama = Financelama()
 
@@ -28,6 +31,6 @@ lama = Financelama()
 
 
 # Start DASH web application
-start_dashboard(evaluate(lama))
+start_dashboard(evaluate(lama), lama)
 
 # os.remove('lama.db')
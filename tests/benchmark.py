@@ -0,0 +1,204 @@
+"""
+Benchmarks of import, categorization, rules, search, reports, evaluation, analytics, dashboard
+figures and their static export on synthetic data (see synthetic_data.py).
+
+Results are written as JSON and can be compared with results of a previous version, e.g.
+
+    python -m tests.benchmark --rows 1000 100000 --output new.json --compare old.json
+
+Exits with 1 if a benchmark got slower than the given tolerance.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from financelama.analytics import analytics
+from financelama.core import Financelama
+from financelama.evaluation import evaluate, monthly_cube
+from financelama.export import export_reports
+from financelama.file_import import _add_to_database, _parse, read_file_dkb, read_folder_dkb
+from financelama.process import categorize, modify_report
+from financelama.rules import add_rule, remove_rule
+from financelama.visual import _category_trends_figure, _monthly_expenses_figure, _pie_figure
+
+from tests.synthetic_data import generate_folder
+
+
+def _timed(function, quiet=True):
+    """ Runs function once, output is suppressed. Returns duration in seconds and result. """
+    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+        start = time.perf_counter()
+        result = function()
+        duration = time.perf_counter() - start
+
+    return duration, result
+
+
+def _figures(lama: Financelama):
+    cube = monthly_cube(lama)
+    return (_monthly_expenses_figure(cube), _pie_figure(cube, 'expense', 'Expenses'),
+            _pie_figure(cube, 'income', 'Income'), _category_trends_figure(cube))
+
+
+def run_benchmarks(rows: int, duplicate_rate: float, workdir: str, workers: int = None) -> list:
+    """
+    Runs all benchmarks on synthetic data with given number of transactions.
+
+    Parameters
+    ----------
+    rows : int
+        Number of generated transactions
+    duplicate_rate : float
+        Share of duplicates of the overlapping giro export, see generate_folder()
+    workdir : str
+        Folder for generated files and databases
+    workers : int, optional
+        Number of worker processes for folder import
+
+    Returns
+    -------
+    List of dicts with 'benchmark', 'rows' and 'seconds'
+    """
+    folder = os.path.join(workdir, 'data_{0}'.format(rows))
+    generate_seconds, files = _timed(lambda: generate_folder(folder, rows, duplicate_rate))
+    print('[Benchmark] Generated {0} transactions in {1:.2f} s'.format(rows, generate_seconds))
+
+    results = []
+
+    def record(name, function):
+        seconds, result = _timed(function)
+        results.append({'benchmark': name, 'rows': rows, 'seconds': round(seconds, 6)})
+        print('[Benchmark] {0:<24} {1:>10} rows {2:10.4f} s'.format(name, rows, seconds))
+        return result
+
+    def database(name):
+        path = os.path.join(workdir, '{0}_{1}.db'.format(name, rows))
+        if os.path.exists(path):
+            os.remove(path)
+        return Financelama(path)
+
+    # Import of single file and of new records only
+    lama = database('file')
+    record('read_file_dkb', lambda: read_file_dkb(lama, files['giro']))
+    df = _timed(lambda: _parse(files['paypal']))[1]
+    record('_add_to_database', lambda: _add_to_database(lama, df))
+    record('_add_to_database_dupl', lambda: _add_to_database(lama, df))
+    lama.close()
+
+    # Remaining benchmarks run on database with all files
+    lama = database('folder')
+    record('read_folder_dkb', lambda: read_folder_dkb(lama, folder, workers=workers))
+    record('categorize', lambda: categorize(lama, all_entries=True))
+    record('categorize_index', lambda: categorize(lama, all_entries=True, use_index=True))
+    rule_id = record('add_rule', lambda: add_rule(lama, 'benchmark', 'markt', priority=-1))
+    record('remove_rule', lambda: remove_rule(lama, rule_id))
+    record('search', lambda: lama.search('rewe markt'))
+
+    last_rowid = lama.connection().execute('SELECT MAX(rowid) FROM transactions').fetchone()[0]
+    record('modify_report', lambda: modify_report(
+        lama, 'benchmark', list_of_ranges=[(1, max(1, last_rowid // 10))]))
+
+    # Cold evaluation with empty cache, warm evaluation after a small change
+    lama.cache.clear()
+    record('evaluate', lambda: evaluate(lama))
+    modify_report(lama, 'benchmark', list_of_rowids=[last_rowid])
+    record('evaluate_incremental', lambda: evaluate(lama))
+
+    lama.cache.clear()
+    record('analytics', lambda: analytics(lama))
+    modify_report(lama, None, list_of_rowids=[last_rowid])
+    record('analytics_incremental', lambda: analytics(lama))
+
+    lama.cache.clear()
+    record('dashboard_figures', lambda: _figures(lama))
+    record('dashboard_figures_warm', lambda: _figures(lama))
+    record('export_reports', lambda: export_reports(lama, os.path.join(workdir, 'export')))
+    lama.close()
+
+    return results
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline: list, tolerance: float) -> list:
+    """
+    Compares results with results of a previous run.
+
+    Returns
+    -------
+    List of messages for benchmarks which are slower than baseline by more than tolerance
+    (relative, e.g. 0.2 for 20 %)
+    """
+    previous = {(r['benchmark'], r['rows']): r['seconds'] for r in baseline}
+    regressions = []
+    for r in results:
+        seconds = previous.get((r['benchmark'], r['rows']))
+        if seconds is not None and r['seconds'] > seconds * (1 + tolerance):
+            regressions.append('{0} ({1} rows): {2:.4f} s instead of {3:.4f} s'.format(
+                r['benchmark'], r['rows'], r['seconds'], seconds))
+
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000],
+                        help='Numbers of transactions, e.g. 1000 100000 1000000')
+    parser.add_argument('--duplicate-rate', type=float, default=0.1)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--workdir', default=None,
+                        help='Folder for generated data (default: temporary folder)')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, metavar='JSON',
+                        help='Results of previous run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='financelama_benchmark_')
+    try:
+        results = []
+        for rows in args.rows:
+            results += run_benchmarks(rows, args.duplicate_rate, workdir, args.workers)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'revision': _git_revision(),
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'duplicate_rate': args.duplicate_rate,
+            'results': results,
+        }, f, indent=2)
+    print('[Benchmark] Results written to ' + args.output)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        for r in regressions:
+            print('[Benchmark] REGRESSION ' + r)
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,203 @@
+"""
+Generator for synthetic but realistic CSV exports of DKB (giro account and debit card) and PayPal.
+
+Files are written like the original exports: header with account data, German number format and
+ISO-8859-1 encoding. Duplicates are generated like overlapping exports of the same account,
+i.e. a share of the transactions of an export is contained in the following export as well.
+
+Usage: python -m tests.synthetic_data <folder> [rows] [duplicate_rate] [seed]
+"""
+import csv
+import datetime
+import os
+import random
+import sys
+
+orderers = [
+    'REWE Markt GmbH', 'Lidl sagt Danke', 'EDEKA Center', 'Vermieter Müller', 'NETFLIX.COM',
+    'Spotify AB', 'DB Vertrieb GmbH', 'FlixBus', 'dm-drogerie markt', 'Rossmann', 'AMAZON EU S.A R.L.',
+    'eBay GmbH', 'Arbeitgeber AG', 'Stipendium Stiftung', 'Cafe Central', 'Bäckerei Schröder',
+    'McDonalds', 'Postbank', 'Sparkasse Köln', 'Tankstelle Süd', 'Max Mustermann',
+    'KREDITKARTENABRECHNUNG', 'Ausgleich Kreditkarte',
+]
+reasons = [
+    'Einkauf', 'Miete Januar', 'Gehalt Oktober', 'Umbuchung', 'Danke für Ihren Einkauf', '',
+    'Ticket Berlin', 'Lastschrift', 'Abo', 'Erstattung', 'Rechnung 4711',
+]
+infos = ['Lastschrift', 'Gutschrift', 'Folgelastschrift', 'Überweisung', 'Kartenzahlung']
+paypal_types = ['Allgemeine Zahlung', 'Handyzahlung', 'Rückzahlung', 'Bankgutschrift']
+
+giro_columns = [
+    'Buchungstag', 'Wertstellung', 'Buchungstext', 'Auftraggeber / Begünstigter',
+    'Verwendungszweck', 'Kontonummer', 'BLZ', 'Betrag (EUR)', 'Gläubiger-ID', 'Mandatsreferenz',
+    'Kundenreferenz',
+]
+debit_columns = [
+    'Umsatz abgerechnet und nicht im Saldo enthalten', 'Wertstellung', 'Belegdatum',
+    'Beschreibung', 'Betrag (EUR)', 'Ursprünglicher Betrag',
+]
+paypal_columns = [
+    'Datum', 'Uhrzeit', 'Zeitzone', 'Name', 'Typ', 'Status', 'Währung', 'Brutto', 'Gebühr',
+    'Netto', 'Absender E-Mail-Adresse', 'Empfänger E-Mail-Adresse', 'Transaktionscode',
+    'Betreff', 'Hinweis',
+]
+
+
+def german_number(value: float, thousands: bool = True) -> str:
+    """ Formats number with decimal comma and optional dot as thousands separator. """
+    s = '{0:,.2f}'.format(value).replace(',', ' ').replace('.', ',')
+    return s.replace(' ', '.' if thousands else '')
+
+
+def _days(rng: random.Random, rows: int, start: datetime.date, days: int) -> list:
+    """ Sorted random days within range, newest first like in the exports. """
+    return sorted((start + datetime.timedelta(days=rng.randrange(days)) for _ in range(rows)),
+                  reverse=True)
+
+
+def _with_duplicates(rng: random.Random, previous: list, rows: list,
+                     duplicate_rate: float) -> list:
+    """ Replaces share of rows by rows of previous export (overlapping exports). """
+    count = min(len(previous), int(round(len(rows) * duplicate_rate)))
+    return rng.sample(previous, count) + rows[count:]
+
+
+def giro_rows(rows: int, seed: int = 0, start=datetime.date(2019, 1, 1), days: int = 730) -> list:
+    """ Transaction rows of DKB giro export. """
+    rng = random.Random(seed)
+    result = []
+    for day in _days(rng, rows, start, days):
+        day = day.strftime('%d.%m.%Y')
+        value = round(rng.uniform(-1500, 800), 2) if rng.random() < 0.9 \
+            else round(rng.uniform(1000, 4000), 2)
+        result.append([
+            day, day, rng.choice(infos), rng.choice(orderers), rng.choice(reasons),
+            'DE{0:020d}'.format(rng.randrange(10 ** 8)), rng.choice(['BYLADEM1001', '']),
+            german_number(value), '', '', '',
+        ])
+    return result
+
+
+def debit_rows(rows: int, seed: int = 0, start=datetime.date(2019, 1, 1),
+               days: int = 730) -> list:
+    """ Transaction rows of DKB debit card export. """
+    rng = random.Random(seed)
+    result = []
+    for day in _days(rng, rows, start, days):
+        receipt = (day - datetime.timedelta(days=rng.randrange(3))).strftime('%d.%m.%Y')
+        value = round(rng.uniform(-400, 50), 2)
+        result.append([
+            rng.choice(['Ja', 'Nein']), day.strftime('%d.%m.%Y'), receipt, rng.choice(orderers),
+            german_number(value), '',
+        ])
+    return result
+
+
+def paypal_rows(rows: int, seed: int = 0, start=datetime.date(2019, 1, 1),
+                days: int = 730) -> list:
+    """ Transaction rows of PayPal export. """
+    rng = random.Random(seed)
+    result = []
+    for day in _days(rng, rows, start, days):
+        value = round(rng.uniform(-200, 100), 2)
+        fee = round(rng.uniform(-2, 0), 2) if value > 0 else 0.0
+        result.append([
+            day.strftime('%d.%m.%Y'), '{0:02d}:{1:02d}:{2:02d}'.format(
+                rng.randrange(24), rng.randrange(60), rng.randrange(60)),
+            'CET', rng.choice(orderers), rng.choice(paypal_types), 'Abgeschlossen', 'EUR',
+            german_number(value, False), german_number(fee, False),
+            german_number(value + fee, False), 'ich@example.com', 'shop@example.com',
+            '{0:017X}'.format(rng.randrange(16 ** 17)), rng.choice(['Bestellung', '']),
+            rng.choice(['Hinweis', '']),
+        ])
+    return result
+
+
+def write_dkb_giro(path: str, rows: list, account: str = 'DE12345678901234567890'):
+    """ Writes DKB giro export with header and given transaction rows (see giro_rows()). """
+    with open(path, 'w', encoding='ISO-8859-1', newline='') as f:
+        writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(['Kontonummer:', account + ' / Girokonto'])
+        f.write('\n')
+        writer.writerow(['Von:', '01.01.2019'])
+        writer.writerow(['Bis:', '31.12.2020'])
+        writer.writerow(['Kontostand vom 31.12.2020:', '1.234,56 EUR'])
+        f.write('\n')
+        writer.writerow(giro_columns)
+        writer.writerows(rows)
+
+
+def write_dkb_debit(path: str, rows: list, card: str = '1234********5678'):
+    """ Writes DKB debit card export with header and given transaction rows (see
+    debit_rows()).
+    """
+    with open(path, 'w', encoding='ISO-8859-1', newline='') as f:
+        writer = csv.writer(f, delimiter=';', quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(['Kreditkarte:', card])
+        f.write('\n')
+        writer.writerow(['Von:', '01.01.2019'])
+        writer.writerow(['Bis:', '31.12.2020'])
+        writer.writerow(['Saldo:', '-12,00 EUR'])
+        writer.writerow(['Datum:', '31.12.2020'])
+        writer.writerow(debit_columns)
+        writer.writerows(rows)
+
+
+def write_paypal(path: str, rows: list):
+    """ Writes PayPal export with given transaction rows (see paypal_rows()). """
+    with open(path, 'w', encoding='ISO-8859-1', newline='') as f:
+        writer = csv.writer(f, delimiter=',', quoting=csv.QUOTE_ALL, lineterminator='\n')
+        writer.writerow(paypal_columns)
+        writer.writerows(rows)
+
+
+def generate_folder(path: str, rows: int, duplicate_rate: float = 0.1, seed: int = 0) -> dict:
+    """
+    Generates folder with two overlapping DKB giro exports, one DKB debit card export and one
+    PayPal export.
+
+    Parameters
+    ----------
+    path : str
+        Folder to write to, created if not existing
+    rows : int
+        Total number of transactions of all files
+    duplicate_rate : float, optional
+        Share of transactions of the second giro export which are already contained in the
+        first one
+    seed : int, optional
+        Seed of random generator, same seed gives same files
+
+    Returns
+    -------
+    Dict with paths of files by 'giro', 'giro_overlap', 'debit' and 'paypal'
+    """
+    os.makedirs(path, exist_ok=True)
+
+    giro = rows * 3 // 10
+    debit = rows * 2 // 10
+    paypal = rows - 2 * giro - debit
+
+    files = {
+        'giro': os.path.join(path, 'dkb_giro_1.csv'),
+        'giro_overlap': os.path.join(path, 'dkb_giro_2.csv'),
+        'debit': os.path.join(path, 'dkb_debit.csv'),
+        'paypal': os.path.join(path, 'paypal.CSV'),
+    }
+
+    first = giro_rows(giro, seed)
+    second = _with_duplicates(random.Random(seed), first, giro_rows(giro, seed + 1),
+                              duplicate_rate)
+    write_dkb_giro(files['giro'], first)
+    write_dkb_giro(files['giro_overlap'], second)
+    write_dkb_debit(files['debit'], debit_rows(debit, seed + 2))
+    write_paypal(files['paypal'], paypal_rows(paypal, seed + 3))
+
+    return files
+
+
+if __name__ == '__main__':
+    generate_folder(sys.argv[1],
+                    int(sys.argv[2]) if len(sys.argv) > 2 else 1000,
+                    float(sys.argv[3]) if len(sys.argv) > 3 else 0.1,
+                    int(sys.argv[4]) if len(sys.argv) > 4 else 0)
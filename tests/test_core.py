@@ -0,0 +1,24 @@
+"""
+Connections and schema of the database.
+"""
+import threading
+
+from financelama.core import Financelama
+
+
+def test_connections_of_ended_threads_are_closed(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+
+    for _ in range(10):
+        threads = [threading.Thread(target=lama.version) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # Only the connection of the main thread is left
+    assert len(lama._connections) == 1
+    assert lama.version() == 0
+
+    lama.close()
+    assert not lama._connections
@@ -0,0 +1,110 @@
+"""
+Dashboard callbacks on small databases, the Dash server isn't started.
+"""
+import dash
+import pandas as pd
+import pytest
+
+from financelama.core import Financelama
+from financelama.evaluation import evaluate
+from financelama.file_import import _add_to_database
+from financelama.process import categorize
+from financelama import visual
+
+
+@pytest.fixture
+def callbacks(monkeypatch):
+    """ Callbacks registered by start_dashboard() by function name. """
+    registered = {}
+    register = dash.Dash.callback
+
+    def callback(self, *args, **kwargs):
+        decorator = register(self, *args, **kwargs)
+
+        def wrapper(function):
+            registered[function.__name__] = function
+            return decorator(function)
+        return wrapper
+
+    monkeypatch.setattr(dash.Dash, 'callback', callback)
+    monkeypatch.setattr(dash.Dash, 'run_server', lambda self, **kwargs: None)
+
+    return registered
+
+
+def test_empty_database(tmp_path, callbacks):
+    lama = Financelama(str(tmp_path / 'empty.db'))
+    visual.start_dashboard(evaluate(lama), lama)
+
+    version = callbacks['reload_data'](0, None, None)
+    rolling, balance, recurring, anomalies = callbacks['update_analytics'](
+        None, None, None, None, 30, version)
+    assert len(rolling.data) == 0 and recurring == [] and anomalies == []
+
+
+def test_income_only_filter(tmp_path, callbacks):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, pd.DataFrame({
+        'day': pd.to_datetime(['2020-01-05', '2020-01-20', '2020-02-05']),
+        'info': 'None', 'orderer': ['Arbeitgeber', 'Rewe Markt', 'Arbeitgeber'],
+        'reason': ['Gehalt', 'Einkauf', 'Gehalt'], 'orderer_account': 'None',
+        'orderer_bank': 'None', 'value': [2000.0, -50.0, 2000.0], 'account': 'DE1'}))
+    categorize(lama)
+    visual.start_dashboard(evaluate(lama), lama)
+
+    version = callbacks['reload_data'](0, None, None)
+    rolling = callbacks['update_analytics'](None, None, None, ['income'], 30, version)[0]
+    assert len(rolling.data) == 0
+
+    rolling = callbacks['update_analytics'](None, None, None, None, 30, version)[0]
+    assert [trace.name for trace in rolling.data] == ['supermarket']
+
+
+def test_table_filter_matches_wildcards_literally(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, pd.DataFrame({
+        'day': pd.to_datetime(['2020-01-05', '2020-01-06', '2020-01-07']),
+        'info': 'None', 'orderer': ['Shop', 'Shop', 'Shop'],
+        'reason': ['50% off', '500 units', 'a_b'], 'orderer_account': 'None',
+        'orderer_bank': 'None', 'value': [-1.0, -2.0, -3.0], 'account': 'DE1'}))
+    df = evaluate(lama).sort_values(by=['day'], kind='stable', ignore_index=True)
+
+    for query, expected in [('{reason} contains "50%"', ['50% off']),
+                            ('{reason} contains "_"', ['a_b'])]:
+        page = visual._query_table_page(lama, None, None, 0, 10, [], query)[0]
+        assert [r['reason'] for r in page] == expected
+        page = visual._frame_table_page(df, None, None, 0, 10, [], query)[0]
+        assert [r['reason'] for r in page] == expected
+
+
+def test_compact_table_shows_missing_values_as_none(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, pd.DataFrame({
+        'day': pd.to_datetime(['2020-01-05']), 'info': 'None', 'orderer': ['Shop'],
+        'reason': ['Einkauf'], 'orderer_account': 'None', 'orderer_bank': 'None',
+        'value': [-1.0], 'account': 'DE1'}))
+    df = evaluate(lama, compact=True)
+
+    page = visual._frame_table_page(df, None, None, 0, 10, [], '')[0]
+    assert page[0]['report'] == 'None' and page[0]['category'] == 'None'
+    assert page == visual._frame_table_page(evaluate(lama), None, None, 0, 10, [], '')[0]
+
+
+def test_table_pages_sorted_by_duplicate_values(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, pd.DataFrame({
+        'day': pd.to_datetime(['2020-01-05'] * 30), 'info': 'None',
+        'orderer': ['Shop {0}'.format(i) for i in range(30)], 'reason': 'Einkauf',
+        'orderer_account': 'None', 'orderer_bank': 'None', 'value': -1.0, 'account': 'DE1'}))
+
+    # SQLite happens to return ties in a stable order, so the query has to break ties itself
+    statements = []
+    lama.connection().set_trace_callback(statements.append)
+
+    for sort_by in [[], [{'column_id': 'value', 'direction': 'desc'}]]:
+        orderers = [r['orderer'] for page in range(3)
+                    for r in visual._query_table_page(lama, None, None, page, 10, sort_by, '')[0]]
+        assert sorted(orderers) == sorted('Shop {0}'.format(i) for i in range(30))
+
+    orders = [s.split(' ORDER BY ')[1] for s in statements if ' ORDER BY ' in s]
+    assert len(orders) == 6 and all(' rowid LIMIT ' in order for order in orders)
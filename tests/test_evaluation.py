@@ -0,0 +1,59 @@
+"""
+Evaluation of transactions and aggregate cube.
+"""
+import pandas as pd
+
+from financelama.core import Financelama
+from financelama.evaluation import evaluate, monthly_cube
+from financelama.file_import import _add_to_database
+from financelama.process import modify_report
+
+
+def _transactions(days, values):
+    return pd.DataFrame({
+        'day': pd.to_datetime(days), 'info': 'None',
+        'orderer': ['Shop {0}'.format(i) for i in range(len(days))], 'reason': 'Einkauf',
+        'orderer_account': 'None', 'orderer_bank': 'None', 'value': values, 'account': 'DE1'})
+
+
+def test_evaluate_does_not_write(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, _transactions(['2020-01-05', '2020-02-05'], [-1.0, -2.0]))
+    version = lama.version()
+    evaluate(lama)
+
+    conn = lama.connection()
+    assert conn.execute("SELECT value FROM lama_meta WHERE key = 'summary_version'").fetchone() \
+        is None
+
+    # Summaries are built by the cube
+    monthly_cube(lama)
+    assert conn.execute("SELECT value FROM lama_meta WHERE key = 'summary_version'").fetchone() \
+        == (version,)
+
+
+def _sorted(df):
+    return df.sort_values(by=['day', 'orderer', 'reason'], ignore_index=True)
+
+
+def test_incremental_evaluation_equals_fresh_evaluation(tmp_path):
+    path = str(tmp_path / 'lama.db')
+    lama = Financelama(path)
+    _add_to_database(lama, _transactions(['2020-01-05', '2020-01-20', '2020-02-05', '2020-03-05'],
+                                         [-1.0, -2.0, -3.0, 4.0]))
+    modify_report(lama, 'holiday', list_of_rowids=[2, 3])
+    for compact in [False, True]:
+        evaluate(lama, compact=compact)
+    monthly_cube(lama)
+
+    # Small import into one month, the report gets another transaction
+    new = _transactions(['2020-02-10', '2020-02-11'], [-5.0, -6.0])
+    new['orderer'] = ['New 0', 'New 1']
+    _add_to_database(lama, new)
+    modify_report(lama, 'holiday', list_of_rowids=[5])
+
+    fresh = Financelama(path)
+    for compact in [False, True]:
+        pd.testing.assert_frame_equal(_sorted(evaluate(lama, compact=compact)),
+                                      _sorted(evaluate(fresh, compact=compact)))
+    pd.testing.assert_frame_equal(monthly_cube(lama), monthly_cube(fresh))
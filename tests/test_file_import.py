@@ -0,0 +1,176 @@
+"""
+Import of bank files.
+"""
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from financelama import file_import
+from financelama.config import dropping_keywords
+from financelama.core import Financelama
+from financelama.file_import import (_detect_format, _drop_irrelevant_records, _parse,
+                                     read_file_dkb, read_folder_dkb)
+
+from tests.synthetic_data import write_dkb_debit, write_dkb_giro, write_paypal
+
+giro_header = ('"Kontonummer:";"DE12345678901234567890 / Girokonto";\n'
+               '\n'
+               '"Von:";"01.01.2020";\n'
+               '"Bis:";"31.01.2020";\n'
+               '"Kontostand vom 31.01.2020:";"1.000,00 EUR";\n'
+               '\n')
+giro_columns = ('"Buchungstag";"Wertstellung";"Buchungstext";"Auftraggeber / Begünstigter";'
+                '"Verwendungszweck";"Kontonummer";"BLZ";"Betrag (EUR)";\n')
+giro_row = ('"05.01.2020";"05.01.2020";"Lastschrift";"REWE Markt";"Einkauf";"DE1";"BLZ1";'
+            '"-12,34";\n')
+
+
+def write_file(path, content):
+    with open(path, 'w', encoding='ISO-8859-1') as f:
+        f.write(content)
+
+
+def _drop_reference(df, dropping):
+    # Row by row like the original implementation
+    keep = [index for index, row in df.iterrows()
+            if not any(row[col].lower().find(t.lower()) != -1
+                       for col, tags in dropping.items() for t in tags)]
+    return df.loc[keep]
+
+
+def test_drop_irrelevant_records_matches_reference():
+    df = pd.DataFrame({
+        'orderer': ['KREDITKARTENABRECHNUNG 01/20', 'Rewe', 'ausgleich kreditkarte', 'a+b (c)',
+                    'None', 'Kreditkarte', 'Shop'],
+        'reason': ['None', 'Umbuchung Sparen', 'x', 'y', 'UMBUCHUNG', 'z', 'a.b'],
+        'value': [-100.0, -5.0, 100.0, -1.0, 10.0, -2.0, -3.0]},
+        index=[7, 3, 5, 0, 1, 2, 9])
+
+    for dropping in [dropping_keywords, {'orderer': ['a+b', '(C)'], 'reason': ['a.b']}]:
+        pd.testing.assert_frame_equal(_drop_irrelevant_records(df, dropping),
+                                      _drop_reference(df, dropping))
+
+
+def test_read_file_dkb_returns_added_records(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    path = str(tmp_path / 'giro.csv')
+    write_file(path, giro_header + giro_columns + giro_row)
+
+    assert read_file_dkb(lama, path) == 1
+    assert read_file_dkb(lama, path) == 0
+
+
+def test_read_folder_dkb_skips_malformed_files(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    # Header without account field
+    write_file(str(folder / 'bad.csv'), '"Kontonummer:"\n')
+    write_file(str(folder / 'good.csv'), giro_header + giro_columns + giro_row)
+
+    summary = read_folder_dkb(lama, str(folder), workers=1)
+    assert [(s['file'], s['imported']) for s in summary] == [(str(folder / 'good.csv'), 1)]
+
+
+class _WritingExecutor(ThreadPoolExecutor):
+    """ Parses files in threads and writes to the database while files are submitted. """
+
+    def __init__(self, path):
+        super().__init__(max_workers=1)
+        self.path = path
+
+    def submit(self, fn, *args, **kwargs):
+        con = sqlite3.connect(self.path, timeout=0)
+        con.execute('BEGIN IMMEDIATE')
+        con.rollback()
+        con.close()
+        return super().submit(fn, *args, **kwargs)
+
+
+def test_read_folder_dkb_parses_without_write_lock(tmp_path):
+    path = str(tmp_path / 'lama.db')
+    lama = Financelama(path)
+    folder = tmp_path / 'data'
+    folder.mkdir()
+    write_file(str(folder / 'giro.csv'), giro_header + giro_columns + giro_row)
+
+    with _WritingExecutor(path) as executor:
+        summary = read_folder_dkb(lama, str(folder), executor=executor)
+    assert summary[0]['imported'] == 1
+
+
+def test_reimport_after_fingerprint_migration(tmp_path):
+    path = str(tmp_path / 'giro.csv')
+    second = giro_row.replace('REWE Markt', 'Rossmann')
+    write_file(path, giro_header + giro_columns + giro_row + giro_row + second)
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    # Identical transactions within a file are kept
+    assert read_file_dkb(lama, path) == 3
+
+    # Database of a version without fingerprints, days were stored as timestamps
+    df = pd.read_sql('SELECT account, day, info, orderer, orderer_account, orderer_bank, reason, '
+                     'value, category, report FROM transactions', lama.connection())
+    df['day'] = pd.to_datetime(df['day'])
+    con = sqlite3.connect(str(tmp_path / 'legacy.db'))
+    df.to_sql('transactions', con, index=False)
+    con.close()
+
+    migrated = Financelama(str(tmp_path / 'legacy.db'))
+    assert migrated.connection().execute(
+        'SELECT COUNT(DISTINCT fingerprint) FROM transactions').fetchone()[0] == 3
+    assert read_file_dkb(migrated, path) == 0
+    assert migrated.connection().execute('SELECT COUNT(*) FROM transactions').fetchone()[0] == 3
+
+
+def test_formats_are_detected_and_mapped(tmp_path):
+    files = {'dkb_giro': str(tmp_path / 'giro.csv'), 'dkb_debit': str(tmp_path / 'debit.csv'),
+             'paypal': str(tmp_path / 'paypal.csv')}
+    write_dkb_giro(files['dkb_giro'], [['05.01.2020', '06.01.2020', 'Lastschrift', 'REWE Markt',
+                                        'Einkauf', 'DE1', 'BLZ1', '-1.234,56', '', '', '']])
+    write_dkb_debit(files['dkb_debit'], [['Ja', '06.01.2020', '05.01.2020', 'Rossmann', '-12,30',
+                                          '']])
+    write_paypal(files['paypal'], [['07.01.2020', '10:00:00', 'CET', 'Shop', 'Handyzahlung',
+                                    'Abgeschlossen', 'EUR', '-10,50', '0,00', '-10,50', 'a', 'b',
+                                    'X', 'Bestellung', '']])
+    expected = {
+        'dkb_giro': {'day': '2020-01-06', 'info': 'Lastschrift', 'orderer': 'REWE Markt',
+                     'reason': 'Einkauf', 'orderer_account': 'DE1', 'orderer_bank': 'BLZ1',
+                     'value': -1234.56, 'account': 'DE12345678901234567890'},
+        'dkb_debit': {'day': '2020-01-06', 'info': 'None', 'orderer': 'Rossmann',
+                      'reason': 'None', 'orderer_account': 'None', 'orderer_bank': 'None',
+                      'value': -12.3, 'account': '1234********5678'},
+        'paypal': {'day': '2020-01-07', 'info': 'None', 'orderer': 'Shop',
+                   'reason': 'Handyzahlung Bestellung', 'orderer_account': 'None',
+                   'orderer_bank': 'None', 'value': -10.5, 'account': 'PayPal'},
+    }
+
+    for name, path in files.items():
+        assert _detect_format(path) == name
+        record = _parse(path).to_dict('records')[0]
+        record['day'] = record['day'].strftime('%Y-%m-%d')
+        assert record == expected[name]
+
+    path = str(tmp_path / 'unknown.csv')
+    write_file(path, '"Datum";"Betrag"\n')
+    with pytest.raises(ValueError):
+        _detect_format(path)
+
+
+def test_format_added_to_registry(tmp_path, monkeypatch):
+    monkeypatch.setitem(file_import.bank_formats, 'testbank', {
+        'signature': r'^Date;Payee', 'delimiter': ';', 'encoding': 'utf-8', 'skip_rows': 0,
+        'account': 'Testbank', 'mapping': {'day': ['Date'], 'orderer': ['Payee'],
+                                           'value': ['Amount']},
+        'thousands': None, 'decimal': '.', 'date_format': '%Y-%m-%d'})
+    path = str(tmp_path / 'testbank.csv')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('Date;Payee;Amount\n2020-01-05;Café;-3.50\n')
+
+    assert _detect_format(path) == 'testbank'
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    assert file_import.read_file(lama, path) == 1
+    assert lama.connection().execute(
+        'SELECT account, orderer, value FROM transactions').fetchone() == ('Testbank', 'Café',
+                                                                           -3.5)
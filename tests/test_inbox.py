@@ -0,0 +1,37 @@
+"""
+Background import of the inbox, files are processed directly without starting the threads.
+"""
+import os
+
+from financelama.core import Financelama
+from financelama.inbox import InboxWatcher
+
+from tests.test_file_import import giro_columns, giro_header, giro_row, write_file
+
+
+def test_malformed_file_keeps_worker_running(tmp_path):
+    inbox = tmp_path / 'inbox'
+    watcher = InboxWatcher(Financelama(str(tmp_path / 'lama.db')), str(inbox))
+    for folder in ['', 'imported', 'failed']:
+        os.makedirs(os.path.join(str(inbox), folder), exist_ok=True)
+    results = []
+    watcher.subscribe(results.append)
+
+    # Header without account field
+    bad = str(inbox / 'bad.csv')
+    write_file(bad, '"Kontonummer:"\n')
+    good = str(inbox / 'good.csv')
+    write_file(good, giro_header + giro_columns + giro_row)
+
+    watcher._queue.put((bad, 0.0))
+    watcher._queue.put((good, 0.0))
+    watcher._queue.put(None)
+    watcher._work_loop()
+
+    assert results[0]['error'] is not None
+    assert results[1]['error'] is None and results[1]['imported'] == 1
+    assert os.path.exists(str(inbox / 'failed' / 'bad.csv'))
+    assert os.path.exists(str(inbox / 'imported' / 'good.csv'))
+    stats = watcher.stats()
+    assert stats['failed_files'] == 1 and stats['imported_files'] == 1
+
@@ -0,0 +1,50 @@
+"""
+Opening and eviction of ledgers in a LedgerPool.
+"""
+import threading
+import time
+
+from financelama import ledgers
+from financelama.ledgers import LedgerPool
+
+
+def test_opening_ledger_does_not_block_others(tmp_path, monkeypatch):
+    pool = LedgerPool({'slow': str(tmp_path / 'slow.db'), 'fast': str(tmp_path / 'fast.db')})
+    started = threading.Event()
+    original = ledgers.Financelama
+
+    def open_ledger(path, path_snapshot=None):
+        # Simulates a long migration of the slow ledger
+        if path.endswith('slow.db'):
+            started.set()
+            time.sleep(1)
+        return original(path, path_snapshot)
+
+    monkeypatch.setattr(ledgers, 'Financelama', open_ledger)
+
+    user = pool.submit('slow', lambda lama: lama.version())
+    started.wait()
+    begin = time.monotonic()
+    with pool.ledger('fast') as lama:
+        lama.version()
+    assert time.monotonic() - begin < 0.5
+
+    # Second user of the slow ledger waits for it instead of opening it again
+    with pool.ledger('slow') as lama:
+        assert lama.version() == 0
+    assert user.result() == 0
+    assert pool.stats()['opened'] == 2
+    pool.close()
+
+
+def test_least_recently_used_idle_ledger_is_closed(tmp_path):
+    with LedgerPool({n: str(tmp_path / (n + '.db')) for n in 'abc'}, max_open=2) as pool:
+        with pool.ledger('a'), pool.ledger('b'), pool.ledger('c'):
+            assert pool.stats()['open'] == 3
+        # Ledger c is released first while a and b are still in use
+        assert pool.stats()['open'] == 2 and pool.stats()['evicted'] == 1
+        with pool.ledger('a'):
+            pass
+        with pool.ledger('c'):
+            pass
+        assert pool.stats()['hits'] == 1 and pool.stats()['evicted'] == 2
@@ -0,0 +1,33 @@
+"""
+Categorization and assignment of transactions to reports.
+"""
+import subprocess
+import sys
+
+import pandas as pd
+
+from financelama.core import Financelama
+from financelama.file_import import _add_to_database
+from financelama.process import modify_report
+
+
+def test_modify_report_counts_each_row_once(tmp_path):
+    lama = Financelama(str(tmp_path / 'lama.db'))
+    _add_to_database(lama, pd.DataFrame({
+        'day': pd.date_range('2020-01-01', periods=10), 'info': 'None',
+        'orderer': ['Hotel {0}'.format(i) for i in range(10)], 'reason': 'None',
+        'orderer_account': 'None', 'orderer_bank': 'None', 'value': -10.0, 'account': 'DE1'}))
+
+    # Rowids 3 and 4 are contained in the range as well
+    assert modify_report(lama, 'holiday', list_of_rowids=[3, 4, 9],
+                         list_of_ranges=[(2, 5)]) == 5
+    assert lama.connection().execute(
+        "SELECT COUNT(*) FROM transactions WHERE report = 'holiday'").fetchone()[0] == 5
+
+
+def test_categorize_does_not_import_textdistance():
+    # Fuzzy clustering (orderers) is only imported for categorize(fuzzy=True)
+    code = 'import sys, financelama.process; print("textdistance" in sys.modules)'
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True,
+                            check=True).stdout
+    assert output.strip() == 'False'
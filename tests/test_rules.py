@@ -0,0 +1,78 @@
+"""
+Rule edits reclassify transactions like a full categorization with the changed rules.
+"""
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from financelama.core import Financelama
+from financelama.file_import import read_folder_dkb
+from financelama.process import categorize
+from financelama.rules import add_rule, list_rules, remove_rule
+
+from tests.synthetic_data import generate_folder
+
+
+@pytest.fixture(scope='module')
+def lama(tmp_path_factory):
+    path = tmp_path_factory.mktemp('rules')
+    generate_folder(str(path / 'data'), 2000)
+    lama = Financelama(str(path / 'lama.db'))
+    read_folder_dkb(lama, str(path / 'data'), workers=1)
+    categorize(lama)
+
+    return lama
+
+
+def _assert_like_full_categorization(lama, rules=True):
+    query = 'SELECT rowid, category, rule_id FROM transactions ORDER BY rowid'
+    edited = lama.connect_database(query)[0]
+    categorize(lama, all_entries=True)
+    full = lama.connect_database(query)[0]
+
+    assert (edited['category'] == full['category']).all()
+    if rules:
+        assert (edited['rule_id'].fillna(-1) == full['rule_id'].fillna(-1)).all()
+
+
+def test_add_rule(lama):
+    add_rule(lama, 'groceries', 'markt')
+    _assert_like_full_categorization(lama)
+
+
+def test_add_rule_reordering_categories(lama):
+    # Moves all keywords of category drugstore in front of supermarket and restaurant
+    add_rule(lama, 'drugstore', 'zzz', priority=-1)
+    _assert_like_full_categorization(lama)
+
+
+def test_remove_first_rule_of_category(lama):
+    rules = list_rules(lama)
+    first = rules[rules['target'] == 'drugstore'].iloc[0]
+    remove_rule(lama, int(first['rule_id']))
+    _assert_like_full_categorization(lama)
+
+
+def test_remove_rule(lama):
+    rules = list_rules(lama)
+    remove_rule(lama, int(rules[rules['keyword'] == 'rewe'].iloc[0]['rule_id']))
+    _assert_like_full_categorization(lama)
+
+
+def test_remove_rule_of_migrated_database(tmp_path):
+    # Database of a version without rule_id, categorized by keywords
+    path = str(tmp_path / 'lama.db')
+    con = sqlite3.connect(path)
+    pd.DataFrame({
+        'account': 'DE1', 'day': ['2020-01-0{0}'.format(i) for i in range(1, 5)],
+        'info': 'Lastschrift', 'orderer': ['REWE Markt', 'Rossmann', 'Stadtwerke', 'rewe'],
+        'orderer_account': 'None', 'orderer_bank': 'None', 'reason': 'Einkauf',
+        'value': -10.0, 'category': ['supermarket', 'drugstore', 'other', 'supermarket'],
+        'report': 'None'}).to_sql('transactions', con, index=False)
+    con.close()
+
+    lama = Financelama(path)
+    rules = list_rules(lama)
+    assert remove_rule(lama, int(rules[rules['keyword'] == 'rewe'].iloc[0]['rule_id'])) == 2
+    _assert_like_full_categorization(lama, rules=False)